@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Calculate quality of many test alignments against one gold standard
+
+The gold standard is read once and every test alignment is scored as by
+calc_alignment_quality.py, outputs of a test alignment are written to
+outdir/<name of the test alignment file> (+ .json, .html, ...). One summary
+table with the overall scores of all test alignments is written at the end.
+
+Test alignments are given as paths, glob patterns or '@list_file' (a file with
+one path or pattern per line).
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+
+from gold_standard.file_utils import atomic_write
+from gold_standard.num_seq import ParsingError
+from gold_standard.parallel import get_shared, pool_map
+
+from calc_alignment_quality import (
+    add_scoring_arguments, calculate_aln_quality_complex,
+    calculate_aln_quality_simple, check_args, load_gold_complex,
+    load_gold_simple, write_html_files)
+
+
+FORMAT = '%(asctime)s:%(levelname)s:%(funcName)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+_log = logging.getLogger("__main__")
+
+SIMPLE_COLUMNS = ["sensitivity", "specificity", "ppv", "npv", "mcc",
+                  "sp_score", "TP", "FP", "FN", "TN", "aligned_templates"]
+COMPLEX_COLUMNS = ["overall_score", "aligned_templates"]
+
+
+def expand_test_paths(specs):
+    """
+    Expand paths, glob patterns and '@list_file' arguments to a list of paths
+    (in the given order, without duplicates)
+    """
+    paths = []
+    for spec in specs:
+        if spec.startswith('@'):
+            with open(spec[1:]) as a:
+                lines = [l.strip() for l in a.read().splitlines()]
+            paths.extend(expand_test_paths(
+                [l for l in lines if l and not l.startswith('#')]))
+        elif glob.has_magic(spec):
+            matched = sorted(glob.glob(spec))
+            if not matched:
+                _log.warning("No test alignments match %s", spec)
+            paths.extend(matched)
+        else:
+            paths.append(spec)
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+def get_output_prefixes(aln_paths, outdir):
+    """
+    Output prefix of every test alignment, outdir/<file name>; file names
+    that occur more than once get a number appended
+    """
+    names = [os.path.basename(p) for p in aln_paths]
+    counts = {}
+    prefixes = []
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+        if names.count(name) > 1:
+            name = "{}_{}".format(name, counts[name])
+        prefixes.append(os.path.join(outdir, name))
+    return prefixes
+
+
+def score_test_alignment(aln_path, output, gold_in, args):
+    """
+    Score one test alignment against the already read gold standard and write
+    its outputs
+
+    :return: dict with a row of the summary table
+    """
+    paths = {
+        'gold_dir': args.gold_dir,
+        'gold_path': args.gold_path,
+        'aln_path': aln_path,
+        'final_core': args.final_core
+    }
+    row = {'test_alignment': aln_path, 'output': output}
+    try:
+        if args.gold_json:
+            quality_data = calculate_aln_quality_complex(
+                paths, output, args.input_format, args.json, args.dont_fill,
+                gold_in=gold_in, compression=args.compress,
+                bootstrap=args.bootstrap, confidence=args.confidence)
+            row['overall_score'] = quality_data['overall_score']
+        else:
+            quality_data = calculate_aln_quality_simple(
+                paths, output, args.input_format, args.multi, args.json,
+                args.dont_fill, args.gold_3ssp, args.target_only,
+                gold_in=gold_in, compression=args.compress,
+                result_formats=args.results, bootstrap=args.bootstrap,
+                confidence=args.confidence)
+            stats = quality_data['stats']
+            row.update(stats['full_stats'])
+            row.update(stats['full_matrix'])
+            row['sp_score'] = stats['sp_score']
+        row['aligned_templates'] = len(quality_data['num_aln']['cores'])
+        write_html_files(quality_data, args, output)
+        row['status'] = 'ok'
+    except ParsingError as e:
+        with atomic_write(output + ".err") as o:
+            o.write(e.message)
+        _log.error("Could not parse %s: %s", aln_path, e.message)
+        row['status'] = 'parsing error'
+    except Exception as e:
+        if args.debug:
+            _log.exception("Failed to score %s", aln_path)
+        else:
+            _log.error("Failed to score %s: %s", aln_path, e)
+        row['status'] = 'error'
+    return row
+
+
+def _score_chunk(chunk):
+    shared = get_shared()
+    return [score_test_alignment(aln_path, output, shared['gold_in'],
+                                 shared['args'])
+            for aln_path, output in chunk]
+
+
+def get_summary_value(value):
+    if value is None:
+        return ""
+    elif isinstance(value, float):
+        return "%.5f" % value
+    return str(value)
+
+
+def write_summary(rows, columns, summary_path):
+    header = ["test_alignment", "status"] + columns + ["output"]
+    lines = ["\t".join(header)]
+    for row in rows:
+        lines.append("\t".join(get_summary_value(row.get(c)) for c in header))
+    with atomic_write(summary_path) as o:
+        o.write("\n".join(lines) + "\n")
+    _log.info("Created the summary file: %s", summary_path)
+
+
+def run_batch(aln_paths, outdir, args, jobs=1, summary_path=None):
+    """
+    Read the gold standard once and score all test alignments (in 'jobs'
+    processes)
+
+    :return: list of summary rows (in the order of aln_paths)
+    """
+    input_paths = {
+        'gold_dir': args.gold_dir,
+        'gold_path': args.gold_path,
+        'final_core': args.final_core,
+        'compiled_gold': args.compiled_gold
+    }
+    if args.gold_json:
+        gold_in = load_gold_complex(input_paths)
+    else:
+        gold_in = load_gold_simple(input_paths, args.input_format, args.multi,
+                                   args.dont_fill, args.gold_3ssp)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    outputs = get_output_prefixes(aln_paths, outdir)
+    chunks = [[item] for item in zip(aln_paths, outputs)]
+    rows = [row for chunk_rows in pool_map(
+                _score_chunk, chunks, jobs, {'gold_in': gold_in, 'args': args})
+            for row in chunk_rows]
+
+    if summary_path is None:
+        summary_path = os.path.join(outdir, "summary.tsv")
+    columns = COMPLEX_COLUMNS if args.gold_json else SIMPLE_COLUMNS
+    write_summary(rows, columns, summary_path)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates quality of many"
+                                                 " test alignments based on"
+                                                 " one gold standard (read"
+                                                 " only once)")
+    parser.add_argument("outdir")
+    parser.add_argument("test_alns", nargs='+',
+                        help="test alignments: paths, glob patterns or "
+                             "@file with one path per line")
+    add_scoring_arguments(parser)
+    parser.add_argument("--summary", help="summary table (default: "
+                        "outdir/summary.tsv)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of test alignments scored in parallel")
+
+    args = parser.parse_args()
+    check_args(parser, args)
+
+    aln_paths = expand_test_paths(args.test_alns)
+    if not aln_paths:
+        parser.error("No test alignments were found")
+    _log.info("Scoring %s test alignments", len(aln_paths))
+
+    rows = run_batch(aln_paths, args.outdir, args, args.jobs, args.summary)
+    failed = [r['test_alignment'] for r in rows if r['status'] != 'ok']
+    if failed:
+        _log.error("%s of %s test alignments failed: %s", len(failed),
+                   len(rows), ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,19 +8,19 @@ import sys
 from copy import deepcopy
 
 from gold_standard.aln_processor import make_master_seq_full
+from gold_standard.file_utils import COMPRESSIONS, open_output
+from gold_standard.gold_binary import load_gold_cached
+from gold_standard.gold_index import gold_index_to_aln
 from gold_standard.html_handler import HtmlHandler
-from gold_standard.parsers.aln3SSP import parse_3SSP
-from gold_standard.parsers.csv_parser import (
-    parse_csv_alignment)
 from gold_standard.parsers.gold import (parse_gold_pairwise,
                                         parse_gold_multi, parse_gold_json)
-from gold_standard.parsers.fasta import parse_fasta
-from gold_standard.parsers.fatcat import parse_fatcat
+from gold_standard.parsers.registry import (detect_format, get_format,
+                                            get_format_names)
 from gold_standard.num_seq import (core_aln_to_num, convert_3ssp_to_gold_aln,
                                    get_core_indexes, ParsingError)
 
 from gold_standard.aln_analyzer import calc_scores_3dm, calc_scores_3dm_complex
-from gold_standard.result_processor import process_results
+from gold_standard.result_processor import RESULT_FORMATS, ResultWriter, process_results
 
 # use frozensets of sequence ids as keys in dictionaries
 # (regular sets cannot be used because they are mutable)
@@ -31,51 +31,42 @@ logging.basicConfig(level=logging.INFO, format=FORMAT)
 _log = logging.getLogger("__main__")
 
 
-def write_html_files(quality_data, args):
-    hh = HtmlHandler()
+def write_html_files(quality_data, args, output=None):
+    """
+    Write the html outputs requested in args, output overrides args.output
+    """
+    output = args.output if output is None else output
+    hh = HtmlHandler(compression=args.compress)
     if not args.gold_json:
         if args.html_pair and quality_data["write_pairwise_html"]:
             # write pairwise html output
-            hh.write_html(quality_data, args.output + "_pairwise", mode="pairwise")
+            hh.write_html(quality_data, output + "_pairwise", mode="pairwise")
 
         if args.html or args.html_var or args.html_var_short:
             # create html output
-            hh.write_html(quality_data, args.output, mode="cores")
+            hh.write_html(quality_data, output, mode="cores")
 
             if args.html_var:
                 # create html output with variable regions (full or trimmed)
-                hh.write_html(quality_data, args.output + "_var", mode="var")
+                hh.write_html(quality_data, output + "_var", mode="var")
 
             if args.html_var_short:
                 # create html output with variable regions (full or trimmed)
-                hh.write_html(quality_data, args.output + "_varshort", mode="var_short")
+                hh.write_html(quality_data, output + "_varshort", mode="var_short")
     else:
         if args.html_pair and quality_data["write_pairwise_html"]:
             # write pairwise html output
-            hh.write_html(quality_data, args.output + "_pairwise", mode="pairwise_complex")
+            hh.write_html(quality_data, output + "_pairwise", mode="pairwise_complex")
 
         if args.html or args.html_var or args.html_var_short:
             # create html output
-            hh.write_html(quality_data, args.output, mode="cores_complex")
+            hh.write_html(quality_data, output, mode="cores_complex")
             if args.html_var_short:
                 # create html output with variable regions (full or trimmed)
-                hh.write_html(quality_data, args.output + "_varshort", mode="var_short_complex")
+                hh.write_html(quality_data, output + "_varshort", mode="var_short_complex")
             if args.html_var:
                 # create html output with variable regions (full or trimmed)
-                hh.write_html(quality_data, args.output + "_varshort", mode="var_complex")
-
-
-def detect_input_format(aln_path):
-    """
-    Check if input format is 3dm or 3SSP
-    """
-    with open(aln_path) as a:
-        first_line = a.read().splitlines()[0]
-
-    if first_line.isupper() and len(first_line.split()) > 2:
-        return "3SSP"
-    else:
-        return "3dm"
+                hh.write_html(quality_data, output + "_varshort", mode="var_complex")
 
 
 def parse_input_alignment(aln_path, full_seq, gold_ids, in_format, final_core_path, master_id, dont_fill=False):
@@ -88,21 +79,19 @@ def parse_input_alignment(aln_path, full_seq, gold_ids, in_format, final_core_pa
     else:
         core_indexes = None
 
-    strcts_order = []
-    write_pairwise_html = True
-    if in_format != 'csv':
-        if not in_format:
-            # detect input format (only for fatcat, 3dm, 3SSP)
-            in_format = detect_input_format(aln_path)
-
-        if in_format == 'fatcat' or in_format == '3dm':
-            aln_dict, strcts_order = parse_fatcat(aln_path, gold_ids)
-        elif in_format == 'fasta':
-            aln_dict = parse_fasta(aln_path, gold_ids)
-        elif in_format == '3SSP':
-            aln_dict, strcts_order = parse_3SSP(aln_path)
-        else:
-            raise Exception("Invalid input format: {}".format(in_format))
+    if not in_format:
+        in_format = detect_format(aln_path)
+    input_format = get_format(in_format)
+    write_pairwise_html = input_format.pairwise_html
+    if not write_pairwise_html:
+        _log.warning("Pairwise comparison is not available for %s "
+                     "alignments", in_format)
+
+    if input_format.grounded:
+        aln_dict, strcts_order, num_aln_dict, core_indexes = \
+            input_format.parse(aln_path, gold_ids, full_seq)
+    else:
+        aln_dict, strcts_order = input_format.parse(aln_path, gold_ids)
 
         # fill in the alignment with gaps so that the full master sequence is in
         # the test alignment
@@ -116,9 +105,6 @@ def parse_input_alignment(aln_path, full_seq, gold_ids, in_format, final_core_pa
 
         # create alignment of grounded sequences
         num_aln_dict, core_indexes, num_corvar = core_aln_to_num(aln_dict, full_seq, golden_ids=gold_ids)
-    else:
-        # input format is 'csv'
-        aln_dict, num_aln_dict, core_indexes = parse_csv_alignment(aln_path, gold_ids)
 
     # check if enough sequences
     tmpl_no = len(num_aln_dict['cores'])
@@ -163,16 +149,53 @@ def process_per_residue_data(per_residue_scores, target_id, target_seq, max_scor
     return wrong_cols
 
 
-def calculate_aln_quality_complex(paths, output, in_format, write_json, dont_fill=False):
-    # read the gold standard alignments
-
+def load_gold_complex(paths):
+    """
+    Read the json gold standard alignments (and the corvar file next to it)
+    """
     gold_path = paths['gold_path']
     corvar_path = gold_path.replace('.json', '.txt.Var')
-    gold_corvar = parse_gold_multi(corvar_path)
-    gold_in = parse_gold_json(gold_path, corvar_path)
+    gold_in = parse_gold_json(gold_path, corvar_path, compiled=True)
+    gold_in['gold_corvar'] = parse_gold_multi(corvar_path)
+
+    if not gold_in['ids']:
+        raise RuntimeError("No gold standard alignments were found")
+    return gold_in
+
+
+def load_gold_simple(paths, in_format, multi, dont_fill=False, gold_3ssp=False):
+    """
+    Read the pairwise, multiple or 3SSP gold standard alignments (from the
+    compiled gold file paths['compiled_gold'] if it's given, see
+    gold_binary.load_gold_cached)
+    """
+    if gold_3ssp:
+        final_core_var_path = os.path.join(paths['gold_dir'], 'final_core.txt.Var')
+        gold_in = parse_gold_multi(final_core_var_path)
+        _, _, gold_num_aln_dict, _, _ = parse_input_alignment(
+                paths['gold_path'], gold_in['full_seq'], gold_in['ids'], in_format,
+                paths['final_core'], gold_in["ids"][0], dont_fill=dont_fill)
+        gold_in['alns'] = gold_num_aln_dict
+
+    elif paths.get('compiled_gold'):
+        gold_path = paths['gold_path'] if multi else paths['gold_dir']
+        gold_in = load_gold_cached(gold_path, multi, paths['compiled_gold'])
+    elif multi:
+        gold_in = parse_gold_multi(paths['gold_path'])
+    else:
+        gold_in = parse_gold_pairwise(paths['gold_dir'])
 
     if not gold_in['ids']:
         raise RuntimeError("No gold standard alignments were found")
+    return gold_in
+
+
+def calculate_aln_quality_complex(paths, output, in_format, write_json, dont_fill=False, jobs=1, gold_in=None,
+                                  compression=None, bootstrap=None, confidence=0.95):
+    # read the gold standard alignments (unless they were read already)
+    if gold_in is None:
+        gold_in = load_gold_complex(paths)
+    gold_corvar = gold_in['gold_corvar']
 
     # that's the test alignment in a final core format, not necessary
     final_core = paths.get("final_core")
@@ -183,17 +206,18 @@ def calculate_aln_quality_complex(paths, output, in_format, write_json, dont_fil
             gold_in["target"], dont_fill=dont_fill)
 
     # calculate scores
-    scores = calc_scores_3dm_complex(gold_in, num_aln_dict)
+    scores = calc_scores_3dm_complex(gold_in, num_aln_dict, jobs=jobs, bootstrap=bootstrap,
+                                     confidence=confidence)
     if write_json:
         # write scores to a json file
-        with open(output + ".json", 'w') as o:
+        with open_output(output + ".json", compression) as o:
             json.dump(scores, o, indent=4)
 
     target_id = gold_in['target']
 
     wrong_cols = process_per_residue_data(scores['per_residue_scores'], target_id, gold_in['full_seq'][target_id], scores["max_scores"])
 
-    return {
+    quality_data = {
         'target_id': target_id,
         'write_pairwise_html': write_pairwise_html,
         'overall_score': scores['overall_score'],
@@ -206,48 +230,50 @@ def calculate_aln_quality_complex(paths, output, in_format, write_json, dont_fil
         'core_indexes': sorted(core_indexes),
         'gold_ids': gold_in['ids'],
         'order': strcts_order,
-        'gold_corvar': gold_corvar
+        'gold_corvar': gold_corvar,
+        'score_table': gold_in['score_table']
     }
-
-
-def calculate_aln_quality_simple(paths, output, in_format, multi, write_json, dont_fill=False, gold_3ssp=False, target_only=False):
-    # read the gold standard alignments
-    if gold_3ssp:
-        final_core_var_path = os.path.join(paths['gold_dir'], 'final_core.txt.Var')
-        gold_in = parse_gold_multi(final_core_var_path)
-        _, _, gold_num_aln_dict, _, _ = parse_input_alignment(
-                paths['gold_path'], gold_in['full_seq'], gold_in['ids'], in_format,
-                paths['final_core'], gold_in["ids"][0], dont_fill=dont_fill)
-        gold_in['alns'] = gold_num_aln_dict
-
-    elif multi:
-        gold_in = parse_gold_multi(paths['gold_path'])
-    else:
-        gold_in = parse_gold_pairwise(paths['gold_dir'])
-
-    if not gold_in['ids']:
-        raise RuntimeError("No gold standard alignments were found")
+    if 'confidence_intervals' in scores:
+        _log.info("Bootstrap confidence intervals (%g%%): %s", confidence * 100,
+                  scores['confidence_intervals'])
+        quality_data['confidence_intervals'] = scores['confidence_intervals']
+    return quality_data
+
+
+def calculate_aln_quality_simple(paths, output, in_format, multi, write_json, dont_fill=False, gold_3ssp=False, target_only=False,
+                                 jobs=1, gold_in=None, compression=None, result_formats=None, bootstrap=None,
+                                 confidence=0.95):
+    # read the gold standard alignments (unless they were read already)
+    if gold_in is None:
+        gold_in = load_gold_simple(paths, in_format, multi, dont_fill, gold_3ssp)
     _log.info("'SIMPLE' score calculation")
 
     aln_dict, strcts_order, num_aln_dict, core_indexes, write_pairwise_html = parse_input_alignment(
             paths['aln_path'], gold_in['full_seq'], gold_in['ids'], in_format, paths['final_core'], gold_in["ids"][0],
             dont_fill=dont_fill)
 
-    # calculate scores
-    scores = calc_scores_3dm(gold_in['alns'], num_aln_dict, multi, target_id=gold_in['ids'][0], target_only=target_only)
-    stats = process_results(scores['pairwise'], scores['full'], scores['sp_scores'],
-                            output, len(strcts_order))
+    # calculate scores, the results of the pairs are written as they're scored
+    writer = ResultWriter(output, result_formats, compression)
+    try:
+        scores = calc_scores_3dm(gold_in['alns'], num_aln_dict, multi, target_id=gold_in['ids'][0],
+                                 target_only=target_only, jobs=jobs, on_pairs=writer.write_pairs)
+        stats = process_results(scores['pairwise'], scores['full'], scores['sp_scores'],
+                                output, len(strcts_order), bootstrap=bootstrap,
+                                confidence=confidence, writer=writer)
+    finally:
+        writer.close()
 
     if write_json:
         # write scores to a json file
-        with open(output + ".json", 'w') as o:
+        with open_output(output + ".json", compression) as o:
             json.dump(stats, o)
 
     return {
+        "stats": stats,
         "write_pairwise_html": write_pairwise_html,
         'wrong_cols': scores["wrong_cols"],
         'aa_aln': aln_dict,
-        'gold_aln': gold_in['alns'],
+        'gold_aln': gold_index_to_aln(gold_in['alns']),
         'gold_ids': gold_in['ids'],
         'num_aln': num_aln_dict,
         'full': gold_in['full_seq'],
@@ -256,14 +282,11 @@ def calculate_aln_quality_simple(paths, output, in_format, multi, write_json, do
     }
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Calculates quality of the"
-                                                 " multiple sequence alignment"
-                                                 " based on the provided golden"
-                                                 " standard pairwise or"
-                                                 " multiple alignments")
-    parser.add_argument("test_aln_path")
-    parser.add_argument("output")
+def add_scoring_arguments(parser):
+    """
+    Options of the gold standard, the test alignment format and the outputs
+    (shared with batch_alignment_quality.py)
+    """
     parser.add_argument("--gold_dir")
     parser.add_argument("--html", help="HTML output (without variable regions)",
                         action="store_true")
@@ -281,9 +304,26 @@ def main():
     parser.add_argument("--gold_json", default=False, action='store_true')
     parser.add_argument("--gold_3ssp", default=False, action='store_true')
     parser.add_argument("--target_only", default=False, action='store_true')
-
-    args = parser.parse_args()
-    # check args
+    parser.add_argument("--compiled_gold", help="compiled gold file (see "
+                        "compile_gold.py), created from the gold standard if "
+                        "it doesn't exist or is out of date")
+    parser.add_argument("--compress", choices=sorted(COMPRESSIONS),
+                        help="compress the json, html, jsonl and csv outputs "
+                             "(.gz, .bz2 or .xz is added to the file names)")
+    parser.add_argument("--results", action="append", choices=RESULT_FORMATS,
+                        help="result files (can be repeated, default: txt - "
+                             "the text report written to the output path; "
+                             "jsonl, csv and npz are written to output.jsonl,"
+                             " output.csv and output.npz)")
+    parser.add_argument("--bootstrap", type=int, help="number of bootstrap "
+                        "resamples of the pairs (residues with gold_json) "
+                        "for confidence intervals of the SP score, mcc and "
+                        "sensitivity")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="confidence level of the bootstrap intervals")
+
+
+def check_args(parser, args):
     if args.multi and not args.gold_path:
         raise parser.error("In the 'multi' mode you must provide the gold_path "
                            "argument")
@@ -297,33 +337,52 @@ def main():
         # no exception traceback when not in debug mode
         sys.tracebacklimit = 0
 
-    # check input format
-    allowed_formats = ["fasta", "3dm", "3SSP", "fatcat", "csv", "json"]
-    # 3dm - fasta format but variable regions are not in the alignment
-    # fatcat - 'final_core'-like format
-    # 3SSP - sequence id (no whitespaces) and sequence (corvar) on one line
-    #   separated by a comma
+    # check input format (see gold_standard/parsers/registry.py)
+    allowed_formats = get_format_names()
     if args.input_format and args.input_format not in allowed_formats:
         parser.error("{} is not an allowed formats. Input format needs to be "
                      "one of the following: {}".format(args.input_format,
                                                        allowed_formats))
+    # only one can be true
+    assert not (args.gold_json and args.gold_3ssp)
+    if args.compiled_gold and (args.gold_json or args.gold_3ssp):
+        parser.error("compiled_gold can only be used in the multi and the "
+                     "pairwise mode")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates quality of the"
+                                                 " multiple sequence alignment"
+                                                 " based on the provided golden"
+                                                 " standard pairwise or"
+                                                 " multiple alignments")
+    parser.add_argument("test_aln_path")
+    parser.add_argument("output")
+    add_scoring_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes used to score the alignment")
+
+    args = parser.parse_args()
+    check_args(parser, args)
 
     input_paths = {
         'gold_dir': args.gold_dir,
         'gold_path': args.gold_path,
         'aln_path': args.test_aln_path,
-        'final_core': args.final_core
+        'final_core': args.final_core,
+        'compiled_gold': args.compiled_gold
     }
-    # only one can be true
-    assert not (args.gold_json and args.gold_3ssp)
     try:
         if args.gold_json:
             quality_data = calculate_aln_quality_complex(input_paths, args.output,
-                                                         args.input_format, args.json, args.dont_fill)
+                                                         args.input_format, args.json, args.dont_fill,
+                                                         args.jobs, compression=args.compress,
+                                                         bootstrap=args.bootstrap, confidence=args.confidence)
         else:
             quality_data = calculate_aln_quality_simple(
                     input_paths, args.output, args.input_format, args.multi, args.json,
-                    args.dont_fill, args.gold_3ssp, args.target_only)
+                    args.dont_fill, args.gold_3ssp, args.target_only, args.jobs,
+                    compression=args.compress, result_formats=args.results,
+                    bootstrap=args.bootstrap, confidence=args.confidence)
 
         write_html_files(quality_data, args)
     except ParsingError as e:
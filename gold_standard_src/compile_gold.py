@@ -0,0 +1,37 @@
+#!/usr/bin/python
+import argparse
+import logging
+
+from gold_standard.gold_binary import compile_gold
+
+
+FORMAT = '%(asctime)s:%(levelname)s:%(funcName)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+_log = logging.getLogger("__main__")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the gold standard "
+                                                 "alignments to a binary file "
+                                                 "loaded by calc_alignment_"
+                                                 "quality.py --compiled_gold")
+    parser.add_argument("output", help="compiled gold file (.npy)")
+    parser.add_argument("--gold_dir", help="directory with pairwise .Var "
+                        "files")
+    parser.add_argument("--multi", action="store_true")
+    parser.add_argument("--gold_path", help=".Var file with the multiple "
+                        "alignment (multi mode)")
+    args = parser.parse_args()
+    if args.multi and not args.gold_path:
+        parser.error("In the 'multi' mode you must provide the gold_path "
+                     "argument")
+    elif not args.multi and not args.gold_dir:
+        parser.error("In the pairwise (default) mode you must provide the "
+                     "gold_dir argument")
+
+    compile_gold(args.gold_path if args.multi else args.gold_dir, args.multi,
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,24 @@
 import logging
 
+import numpy as np
+
+from .complex_gold import ScoreTable, compile_gold_json, get_score_table
 from .dict_utils import merge_dicts, merge_nested_dicts
+from .gold_index import get_gold_index, grounded_to_array
+from .pair_store import CONFUSION_KEYS, PairArray
+from .parallel import (
+    chunk_by_cost, chunk_in_order, get_shared, pool_imap, pool_map)
+from .result_processor import bootstrap_intervals
 from .sanity_checker import (
     check_pairwise_score, check_pairwise_score_3dm)
+from .vector_scoring import (
+    calc_scores_3dm_batched, score_pair_counts, wrong_cols_to_dict)
 
 
 fs = frozenset
 
 _log = logging.getLogger(__name__)
 
-SCORE_MODS = {
-    "a": 1.0,
-    "b": 0.8,
-    "c": 0.5,
-    "u": -1.0,
-    "d": 0
-}
-
 
 def compare_pairwise(cores):
     diff_cols1 = {cores['1']['id']: {}, cores['2']['id']: {}}
@@ -64,15 +66,14 @@ def compare_alignments(aln1, aln2):
 
 
 def get_max_sp_score(golden_aln, id1, id2, multi=False):
+    gold_index = get_gold_index(golden_aln, multi)
     if multi:
         # each residue in the var region gives one point to the overall score
-        score = len(golden_aln['var'][id1]) + len(golden_aln['var'][id2])
-        seq1 = golden_aln['cores'][id1]
-        seq2 = golden_aln['cores'][id2]
+        score = len(gold_index.var[id1]) + len(gold_index.var[id2])
     else:
         score = 0
-        seq1 = golden_aln[id1]
-        seq2 = golden_aln[id2]
+    seq1 = gold_index.cores[id1]
+    seq2 = gold_index.cores[id2]
     for i, res_i in enumerate(seq1):
         if res_i == '-' and seq2[i] == '-':
             # ignore this position if both are gaps
@@ -88,8 +89,9 @@ def get_max_sp_score(golden_aln, id1, id2, multi=False):
 
 def score_var_regions(golden_aln, id1, id2, var1, multi):
     matrix = {"FN": 0, "TN": 0}
+    gold_index = get_gold_index(golden_aln, multi)
     for p in var1:
-        aln_res = get_aligned_res(p, id1, id2, golden_aln, multi)
+        aln_res = gold_index.get_aligned_res(p, id1, id2)
         if aln_res == '-':
             matrix["TN"] += 1
         else:
@@ -101,11 +103,12 @@ def score_core_regions_3dm(sequences, golden_aln, id1, id2, multi):
     result = {"matrix": {"TP": 0, "FP": 0, "FN": 0, "TN": 0},
               "sp_score": 0,
               "wrong_cols": {i: {} for i in sequences.keys()}}
+    gold_index = get_gold_index(golden_aln, multi)
     # score core regions (regions that are part of the core in the TEST
     # alignments - not necessarily core regions in the golden alignments)
     for i, res_i in enumerate(sequences[id1]):
         if res_i != '-' and sequences[id2][i] != '-':
-            res2_gold = get_aligned_res(res_i, id1, id2, golden_aln, multi)
+            res2_gold = gold_index.get_aligned_res(res_i, id1, id2)
             if sequences[id2][i] == res2_gold:
                 result['sp_score'] += 2
                 result['matrix']['TP'] += 2
@@ -115,7 +118,7 @@ def score_core_regions_3dm(sequences, golden_aln, id1, id2, multi):
                 result['wrong_cols'][id1][i] = 1
                 result['wrong_cols'][id2][i] = 1
         elif res_i != '-' and sequences[id2][i] == '-':
-            res2_gold = get_aligned_res(res_i, id1, id2, golden_aln, multi)
+            res2_gold = gold_index.get_aligned_res(res_i, id1, id2)
             if res2_gold == '-':
                 result['sp_score'] += 1
                 result['matrix']['TN'] += 1
@@ -124,8 +127,7 @@ def score_core_regions_3dm(sequences, golden_aln, id1, id2, multi):
                 result['wrong_cols'][id1][i] = 1
                 result['wrong_cols'][id2][i] = 1
         elif sequences[id2][i] != '-' and sequences[id1][i] == '-':
-            res1_gold = get_aligned_res(sequences[id2][i], id2, id1, golden_aln,
-                                        multi)
+            res1_gold = gold_index.get_aligned_res(sequences[id2][i], id2, id1)
             if res1_gold == '-':
                 result['sp_score'] += 1
                 result['matrix']["TN"] += 1
@@ -144,37 +146,31 @@ def calc_pairwise_score_3dm(golden_aln, sequences, var_regs, multi):
                         "the same length: {} and {}".format(
                             id1, id2, sequences[id1], sequences[id2],
                             len(sequences[id1]), len(sequences[id2])))
-    result = score_core_regions_3dm(sequences, golden_aln, id1, id2, multi)
+    gold_index = get_gold_index(golden_aln, multi)
+    result = score_core_regions_3dm(sequences, gold_index, id1, id2, multi)
     # score variable regions in seq1
-    var_matrix = score_var_regions(golden_aln, id1, id2, var_regs[id1], multi)
+    var_matrix = score_var_regions(gold_index, id1, id2, var_regs[id1], multi)
     result['matrix'] = merge_dicts(result['matrix'], var_matrix)
 
     # score variable regions in seq2
-    var_matrix = score_var_regions(golden_aln, id2, id1, var_regs[id2], multi)
+    var_matrix = score_var_regions(gold_index, id2, id1, var_regs[id2], multi)
     result['matrix'] = merge_dicts(result['matrix'], var_matrix)
 
     # check output sanity
     check_pairwise_score_3dm(sequences, var_regs, result, id1, id2)
 
-    sp_max = get_max_sp_score(golden_aln, id1, id2, multi)
+    sp_max = get_max_sp_score(gold_index, id1, id2, multi)
     result['sp_score'] = float(result['sp_score']) / sp_max
     return result
 
 
 def get_aligned_res(res_num, query_id, id2, golden_aln, multi=False):
-    if not multi:
-        aln_pos = golden_aln[query_id].index(res_num)
-        aligned_res = golden_aln[id2][aln_pos]
-    else:
-        if res_num in golden_aln['cores'][query_id]:
-            aln_pos = golden_aln['cores'][query_id].index(res_num)
-            aligned_res = golden_aln['cores'][id2][aln_pos]
-        elif res_num in golden_aln['var'][query_id]:
-            aligned_res = '-'
-        else:
-            raise Exception("Residue {} from sequence {} is not present in "
-                            "the gold alignment".format(res_num, query_id))
-    return aligned_res
+    """
+    Get residue aligned to res_num in the gold alignment, golden_aln can be
+    a GoldIndex (preferred when called in a loop - otherwise the gold alignment
+    is indexed on every call)
+    """
+    return get_gold_index(golden_aln, multi).get_aligned_res(res_num, query_id, id2)
 
 
 def calc_pairwise_score(golden_aln, id1, seq1, id2, seq2):
@@ -190,10 +186,11 @@ def calc_pairwise_score(golden_aln, id1, seq1, id2, seq2):
             id2: {}
         }
     }
+    gold_index = get_gold_index(golden_aln)
 
     for i, res_i in enumerate(seq1):
         if res_i != '-' and seq2[i] != '-':
-            res2_gold = get_aligned_res(res_i, id1, id2, golden_aln)
+            res2_gold = gold_index.get_aligned_res(res_i, id1, id2)
             if seq2[i] == res2_gold:
                 result['sp_score'] += 2
                 result['matrix']["TP"] += 2
@@ -203,7 +200,7 @@ def calc_pairwise_score(golden_aln, id1, seq1, id2, seq2):
                 result['wrong_cols'][id1][i] = 1
                 result['wrong_cols'][id2][i] = 1
         elif seq1[i] != '-':
-            res2_gold = get_aligned_res(res_i, id1, id2, golden_aln)
+            res2_gold = gold_index.get_aligned_res(res_i, id1, id2)
             if res2_gold == '-':
                 result['sp_score'] += 1
                 result['matrix']["TN"] += 1
@@ -212,7 +209,7 @@ def calc_pairwise_score(golden_aln, id1, seq1, id2, seq2):
                 result['wrong_cols'][id1][i] = 1
                 result['wrong_cols'][id2][i] = 1
         elif seq2[i] != '-':
-            res1_gold = get_aligned_res(seq2[i], id2, id1, golden_aln)
+            res1_gold = gold_index.get_aligned_res(seq2[i], id2, id1)
             if res1_gold == '-':
                 result['sp_score'] += 1
                 result['matrix']["TN"] += 1
@@ -225,56 +222,139 @@ def calc_pairwise_score(golden_aln, id1, seq1, id2, seq2):
     # check output sanity
     check_pairwise_score(seq1, seq2, result['matrix'])
     # normalize SP score
-    sp_max = get_max_sp_score(golden_aln, id1, id2)
+    sp_max = get_max_sp_score(gold_index, id1, id2)
     result['sp_score'] = float(result['sp_score']) / sp_max
     return result
 
 
-def calc_scores_3dm(golden_alns, test_aln, multi, target_only=False, target_id=None):
+def calc_scores_3dm(golden_alns, test_aln, multi, target_only=False, target_id=None, jobs=1, on_pairs=None):
+    """
+    Score all pairs of sequences in the test alignment
+
+    :param jobs: number of processes to score the pairs in
+    :param on_pairs: function(matrices, sp_scores) called with the results of
+        every chunk of pairs as soon as it's scored (e.g.
+        result_processor.ResultWriter.write_pairs)
+    """
     _log.info("Calculating confusion matrices [3DM mode]")
+    if multi:
+        golden_alns = get_gold_index(golden_alns, multi)
+        if jobs <= 1:
+            # all pairs are scored against the same gold alignment so they
+            # can be scored in one batch
+            result = calc_scores_3dm_batched(golden_alns, test_aln, target_only,
+                                             target_id)
+            if on_pairs is not None:
+                on_pairs(result['pairwise'], result['sp_scores'])
+            return result
+        # build the arrays before the workers are started so they are shared
+        golden_alns.arrays()
+
+    ids = test_aln["cores"].keys()
+    # convert the grounded sequences to arrays once for all the pairs
+    test_arrays = {seq_id: grounded_to_array(seq)
+                   for seq_id, seq in test_aln["cores"].iteritems()}
+    # wrong columns are counted in place in per sequence arrays and
+    # converted to dicts at the end
+    result = {
+        'pairwise': PairArray(ids, fields=CONFUSION_KEYS, dtype=np.int64),
+        'full': {'TP': 0, 'FP': 0, 'TN': 0, 'FN': 0},
+        'sp_scores': PairArray(ids),
+        'wrong_cols': {seq_id: np.zeros(len(seq), dtype=np.int64)
+                       for seq_id, seq in test_arrays.iteritems()}
+    }
+    var_arrays = {seq_id: grounded_to_array(var)
+                  for seq_id, var in test_aln["var"].iteritems()}
+
+    # the pairs are handed to on_pairs in the order of their sorted ids (as
+    # they're written by ResultWriter), so the chunks are consecutive pairs
+    # of this order and the results don't depend on the number of jobs
+    pairs = sorted([(id1, id2) for a, id1 in enumerate(ids)
+                    for id2 in ids[a + 1:]
+                    if not target_only or target_id in (id1, id2)],
+                   key=sorted)
+    chunks = chunk_in_order(pairs, jobs * 4)
+    shared = {
+        'golden_alns': golden_alns,
+        'test_arrays': test_arrays,
+        'var_arrays': var_arrays,
+        'multi': multi
+    }
+    for partial in pool_imap(score_pair_chunk, chunks, jobs, shared):
+        if on_pairs is not None:
+            on_pairs(partial['pairwise'], partial['sp_scores'])
+        merge_pair_results(result, partial)
+    result['wrong_cols'] = {
+        seq_id: wrong_cols_to_dict(counts)
+        for seq_id, counts in result['wrong_cols'].iteritems()}
+    return result
+
+
+def score_pair_chunk(pairs):
+    """
+    Score a chunk of pairs (worker of calc_scores_3dm), the partial results
+    are merged before they are returned
+    """
+    shared = get_shared()
+    test_arrays = shared['test_arrays']
+    var_arrays = shared['var_arrays']
+    multi = shared['multi']
     result = {
         'pairwise': {},
         'full': {'TP': 0, 'FP': 0, 'TN': 0, 'FN': 0},
         'sp_scores': {},
-        'wrong_cols': {seq_id: {} for seq_id in test_aln["cores"].keys()}
+        'wrong_cols': {}
     }
-    for id1, seq1 in test_aln["cores"].iteritems():
-        if target_only and id1 != target_id:
-            continue
-        for id2, seq2 in test_aln["cores"].iteritems():
-            id_set = fs([id1, id2])
-            if id1 != id2 and id_set not in result['pairwise'].keys():
-                _log.debug("Calculating confusion matrix for sequences %s "
-                           "and %s", id1, id2)
-                sequences = {
-                    id1: seq1,
-                    id2: seq2
-                }
-                var_regs = {
-                    id1: test_aln['var'][id1],
-                    id2: test_aln['var'][id2]
-                }
-                if not multi:
-                    golden_aln = golden_alns[id_set]
-                else:
-                    golden_aln = golden_alns
-
-                scores = calc_pairwise_score_3dm(golden_aln, sequences,
-                                                 var_regs, multi)
-                result['wrong_cols'][id1] = merge_dicts(
-                    result['wrong_cols'][id1], scores["wrong_cols"][id1])
-
-                result['wrong_cols'][id2] = merge_dicts(
-                    result['wrong_cols'][id2], scores["wrong_cols"][id2])
-
-                result['pairwise'][id_set] = scores['matrix']
-                # add the values to the matrix with overall scores
-                result['full'] = merge_dicts(result['full'], scores['matrix'])
-                result['sp_scores'][id_set] = scores['sp_score']
+    full = result['full']
+    wrong_cols = result['wrong_cols']
+    for id1, id2 in pairs:
+        _log.debug("Calculating confusion matrix for sequences %s "
+                   "and %s", id1, id2)
+        seq1 = test_arrays[id1]
+        seq2 = test_arrays[id2]
+        if len(seq1) != len(seq2):
+            raise Exception(
+                "Aligned sequences {} and {} ({} and {}) are not of "
+                "the same length: {} and {}".format(
+                    id1, id2, list(seq1), list(seq2), len(seq1), len(seq2)))
+        id_set = fs([id1, id2])
+        if multi:
+            golden_aln = shared['golden_alns']
+        else:
+            golden_aln = get_gold_index(shared['golden_alns'][id_set])
+        wrong, matrix, sp_score = score_pair_counts(
+            golden_aln, id1, id2, seq1, seq2, var_arrays[id1], var_arrays[id2],
+            multi)
+        result['pairwise'][id_set] = matrix
+        result['sp_scores'][id_set] = sp_score
+        for key, value in matrix.iteritems():
+            full[key] += value
+        for seq_id in [id1, id2]:
+            if seq_id not in wrong_cols:
+                wrong_cols[seq_id] = np.zeros(len(wrong), dtype=np.int64)
+            wrong_cols[seq_id] += wrong
     return result
 
 
-def get_max_aln_score(gold_alns):
+def merge_pair_results(result, partial):
+    """
+    Add results for a chunk of pairs to the results of calc_scores_3dm
+    """
+    result['pairwise'].update(partial['pairwise'])
+    result['sp_scores'].update(partial['sp_scores'])
+    # add the values to the matrix with overall scores
+    for key, value in partial['full'].iteritems():
+        result['full'][key] += value
+    for seq_id, counts in partial['wrong_cols'].iteritems():
+        result['wrong_cols'][seq_id] += counts
+
+
+def get_max_aln_score(gold_alns, score_table=None):
+    """
+    :param score_table: ScoreTable with values of the score categories (the
+        default scores if None)
+    """
+    score_table = get_score_table(score_table)
     max_score = 0
     pseq_ppos_max_scores = {}
     per_core_pos_max_scores = {}
@@ -286,11 +366,7 @@ def get_max_aln_score(gold_alns):
                     # this is a penalty, doesn't add up to the max score
                     continue
 
-                if score_category.startswith("m"):
-                    value = get_m_score(score_category)
-                else:
-                    value = SCORE_MODS[score_category]
-
+                value = score_table[score_category]
                 if pos not in ppos_scores:
                     ppos_scores[pos] = value
                 elif ppos_scores[pos] < value:
@@ -312,24 +388,79 @@ def get_statistical_measures(confusion_matrix):
     return accuracy, specificity, sensitivity
 
 
-def calc_scores_3dm_complex(gold_aln_data, test_aln, mode="strict"):
+def get_residue_counts_complex(core_scores, var_scores, max_scores, full_score, strict):
+    """
+    Contributions of every residue to the confusion matrix (columns in the
+    order of result_processor.MATRIX_FIELDS), to the overall score and to the
+    max score, as they're added up in compare_seq_cores_complex,
+    compare_vars_complex and get_max_aln_score
+
+    :param core_scores: per_residue_scores of compare_cores_complex
+    :param var_scores: per_residue_scores of compare_vars_complex
+    :param max_scores: max scores of the positions (pseq_ppos_max_scores of
+        get_max_aln_score)
+    :return: (residues x 4) float array, array of the scores, array of the
+        max scores
+    """
+    counts = []
+    scores = []
+    residue_max_scores = []
+    for seq_id, seq_scores in core_scores.iteritems():
+        seq_max_scores = max_scores.get(seq_id, {})
+        for res, (found, score) in seq_scores.iteritems():
+            residue_max_scores.append(seq_max_scores.get(str(res), 0))
+            if found:
+                counts.append((abs(score) / full_score, 0, 0, 0))
+                scores.append(score)
+            elif score is not None:
+                # misaligned
+                counts.append((0, full_score, 0, 0))
+                scores.append(score)
+            else:
+                counts.append((full_score, 0, 0, 0))
+                scores.append(0)
+    for seq_id, seq_scores in var_scores.iteritems():
+        seq_max_scores = max_scores.get(seq_id, {})
+        for res, (not_aligned, score) in seq_scores.iteritems():
+            residue_max_scores.append(seq_max_scores.get(str(res), 0))
+            counts.append((0, 0, 0, 1) if not_aligned else (0, 0, 1, 0))
+            scores.append(score if strict else 0)
+    return (np.array(counts, dtype=np.float64).reshape(len(counts), 4),
+            np.array(scores, dtype=np.float64),
+            np.array(residue_max_scores, dtype=np.float64))
+
+
+def calc_scores_3dm_complex(gold_aln_data, test_aln, mode="strict", jobs=1,
+                            bootstrap=None, confidence=0.95):
     """
     Calculate alignment scores based on a json alignment
     (we call it complex because there are partial scores,
     and multi-solution alignments as opposed to the simple mode where each pair
     of aligned residues gets the same score or penalty and can be aligned only in one way)
+
+    :param jobs: number of processes used to compare the sequences
+    :param bootstrap: number of bootstrap resamples of the residues, the
+        confidence intervals of the overall score, mcc and sensitivity are
+        added to the result (see result_processor.bootstrap_intervals)
     """
     target_id = gold_aln_data["target"]
     gold_alns = gold_aln_data["alns"]
+    gold_scores = gold_aln_data.get("compiled")
+    if gold_scores is None:
+        score_table = gold_aln_data.get("score_table")
+        if score_table is None:
+            score_table = ScoreTable(gold_aln_data.get("score_modifiers"))
+        gold_scores = compile_gold_json(gold_alns, score_table)
 
-    max_aln_score, pseq_ppos_max_scores, per_core_pos_max_score = get_max_aln_score(gold_alns)
+    max_aln_score, pseq_ppos_max_scores, per_core_pos_max_score = get_max_aln_score(
+        gold_alns, gold_scores.score_table)
 
-    result_cores = compare_cores_complex(gold_alns, target_id, test_aln)
+    result_cores = compare_cores_complex(gold_scores, target_id, test_aln, jobs)
     overall_score = result_cores["overall_score"]
     per_residue_scores = result_cores["per_residue_scores"]
 
     # this is to penalize false negatives, only done in the strict mode
-    result_vars = compare_vars_complex(gold_alns, target_id, test_aln)
+    result_vars = compare_vars_complex(gold_scores, target_id, test_aln)
 
     # combined confusion matrices from cores and vars - one from cores contains
     # only TPs and FPs, and the one from vars only FNs and TNs
@@ -337,12 +468,24 @@ def calc_scores_3dm_complex(gold_aln_data, test_aln, mode="strict"):
     confusion_matrix.update(result_vars["confusion_matrix"])
     accuracy, specificity, sensitivity = get_statistical_measures(confusion_matrix)
 
+    intervals = None
+    if bootstrap:
+        _log.info("Calculating bootstrap confidence intervals")
+        # the max scores of the residues add up to max_aln_score, so the
+        # score of a resample is normalized by the max scores of its residues
+        counts, scores, max_scores = get_residue_counts_complex(
+            result_cores["per_residue_scores"],
+            result_vars["per_residue_scores"], pseq_ppos_max_scores,
+            gold_scores.score_table["a"], mode == "strict")
+        intervals = bootstrap_intervals(counts, scores, bootstrap, confidence,
+                                        score_norms=max_scores)
+
     if mode == "strict":
         overall_score += result_vars["overall_score"]
         per_residue_scores = merge_nested_dicts(per_residue_scores, result_vars["per_residue_scores"])
 
     overall_score /= max_aln_score
-    return {
+    result = {
         "overall_score": overall_score,
         "per_residue_scores": per_residue_scores,
         "max_scores": pseq_ppos_max_scores,
@@ -352,85 +495,59 @@ def calc_scores_3dm_complex(gold_aln_data, test_aln, mode="strict"):
         "sensitivity": sensitivity,
         "specificity": specificity
     }
+    if intervals is not None:
+        # the overall score is the SP score of the complex mode
+        result["confidence"] = confidence
+        result["confidence_intervals"] = intervals
+    return result
 
 
-def compare_cores_complex(gold_alns, target_id, test_aln):
+def compare_cores_complex(gold_alns, target_id, test_aln, jobs=1,
+                          score_table=None):
+    """
+    Check the aligned residues in the test alignment (FPs and TPs)
+
+    :param gold_alns: gold alignments from the json file (compiled or not)
+    :param jobs: number of processes to compare the sequences in
+    :param score_table: ScoreTable of the gold file (its score_modifiers)
+        used to compile gold_alns, the default scores if None
+    """
+    gold_scores = compile_gold_json(gold_alns, score_table)
     # number of comparisons for score normalization
     n = 0
     overall_score = 0
 
     per_residue_scores = {}
     per_core_position_scores = {}
-    # check the aligned ones in test alignment (FPs and TPs)
-    test_target_aln = test_aln["cores"][target_id]
-
     confusion_matrix = {"TP": 0, "FP": 0}
 
-    full_score = SCORE_MODS["a"]
-
-    for seq_id, aln in test_aln["cores"].iteritems():
-        if seq_id == target_id:
-            continue
-
-        gold_aln = gold_alns[seq_id]
-
-        pairwise_score = 0
-
-        per_residue_scores[seq_id] = {}
-
-        for i, res_number in enumerate(aln):
-            if res_number == '-':
-                continue
-            # alignment scores on this position
-            gold_residue_scores = gold_aln[str(res_number)]
-
-            # target residue aligned with residue 'res_number' from sequence 'seq_id'
-            test_target_res = str(test_target_aln[i])
-
-            found_aln = False
-            res_score = None
-
-            # iterate over alignment solutions (usually there is just one so in
-            # most cases this loop will just have one iteration)
-            for res_number_gold, score_category in gold_residue_scores.iteritems():
-                if res_number_gold == '*':
-                    # means this residue should not be aligned with anything,
-                    # will give a penalty after exiting this loop ( because
-                    # found_aln will not be set to True)
-                    break
-
-                if res_number_gold == test_target_res:
-                    n += 1
-                    found_aln = True
-                    if score_category.startswith('m'):
-                        res_score = get_m_score(score_category)
-                    else:
-                        res_score = SCORE_MODS[score_category]
-                    pairwise_score += res_score
-                    break
-
-            # find what score should be added to the confusion matrix
-            if res_score is not None:
-                confusion_mat_score = float(abs(res_score)) / full_score
-            else:
-                confusion_mat_score = full_score
-
-            if not found_aln and test_target_res != '-':
-                # means this residue is incorrectly aligned (FP)
-                n += 1
-                res_score = SCORE_MODS["u"]
-                pairwise_score += res_score
-                confusion_matrix["FP"] += confusion_mat_score
-            else:
-                # it's a true positive
-                confusion_matrix["TP"] += confusion_mat_score
-
-            per_residue_scores[seq_id][res_number] = (found_aln, res_score)
-            if i + 1 not in per_core_position_scores:
-                per_core_position_scores[i + 1] = 0
-            per_core_position_scores[i + 1] += res_score
-
-        overall_score += pairwise_score
+    seq_ids = [seq_id for seq_id in test_aln["cores"] if seq_id != target_id]
+    test_cores = {seq_id: grounded_to_array(seq)
+                  for seq_id, seq in test_aln["cores"].iteritems()}
+    costs = [np.count_nonzero(test_cores[seq_id]) for seq_id in seq_ids]
+    chunks = chunk_by_cost(seq_ids, costs, jobs * 4)
+    shared = {
+        'gold_scores': gold_scores,
+        'test_target_aln': test_cores[target_id],
+        'test_cores': test_cores
+    }
+    seq_results = {}
+    for chunk_results in pool_map(compare_seq_chunk_complex, chunks, jobs, shared):
+        seq_results.update(chunk_results)
+
+    # merge in the order of the test alignment, so that the (float) sums do
+    # not depend on the number of jobs
+    for seq_id in seq_ids:
+        seq_result = seq_results[seq_id]
+        n += seq_result["n"]
+        overall_score += seq_result["overall_score"]
+        per_residue_scores[seq_id] = seq_result["per_residue_scores"]
+        for key, value in seq_result["confusion_matrix"].iteritems():
+            confusion_matrix[key] += value
+        for pos, res_score in seq_result["per_core_position_scores"].iteritems():
+            if pos not in per_core_position_scores:
+                per_core_position_scores[pos] = 0
+            per_core_position_scores[pos] += res_score
 
     return {
         "n": n, "overall_score": overall_score,
@@ -440,74 +557,106 @@ def compare_cores_complex(gold_alns, target_id, test_aln):
     }
 
 
-def get_m_score(m):
+def compare_seq_chunk_complex(seq_ids):
     """
-    Get a score for a position with multiple solutions
-    :param m: m modifier name, m + int
-    :return: score (float)
+    Compare a chunk of sequences (worker of compare_cores_complex)
     """
+    shared = get_shared()
+    return {
+        seq_id: compare_seq_cores_complex(
+            shared['gold_scores'][seq_id], shared['test_target_aln'],
+            shared['test_cores'][seq_id])
+        for seq_id in seq_ids
+    }
 
-    mscore = float("0." + str(m.strip('m'))) * SCORE_MODS["a"]
-
-    return mscore
 
+def compare_seq_cores_complex(gold_scores, test_target_aln, aln):
+    """
+    Compare aligned residues of one sequence with the gold alignment to the
+    target sequence
 
-def get_score_mod_value(mod_name):
-    if mod_name.startswith('m'):
-        return get_m_score(mod_name)
-    else:
-        return SCORE_MODS[mod_name]
+    :param gold_scores: CompiledSeqScores of the sequence
+    :param test_target_aln: target sequence from the test alignment (array,
+        0 for gaps)
+    :param aln: the sequence from the test alignment (array, 0 for gaps)
+    """
+    full_score = gold_scores.score_table["a"]
+
+    positions = np.flatnonzero(aln)
+    residues = aln[positions]
+    # target residues aligned with the residues of this sequence
+    test_targets = test_target_aln[positions]
+    found, scores = gold_scores.match(residues, test_targets)
+    # residues aligned with a target residue they shouldn't be aligned with
+    misaligned = ~found & (test_targets != 0)
+
+    res_scores = np.full(len(positions), None, dtype=object)
+    res_scores[found] = scores[found].tolist()
+    res_scores[misaligned] = gold_scores.score_table["u"]
+    scored = found | misaligned
+    # scores of correctly aligned residues are added to the confusion matrix
+    # relative to the full score, unaligned residues count as full TPs
+    tp_scores = np.where(found, np.abs(scores) / full_score, full_score)
+
+    # the sums are taken in the order of the alignment (like adding up the
+    # scores residue by residue) so that float results are reproducible
+    overall_score = sum(res_scores[scored].tolist())
+    res_scores = res_scores.tolist()
+    return {
+        "n": int(np.count_nonzero(scored)),
+        "overall_score": overall_score,
+        "per_residue_scores": dict(zip(residues.tolist(),
+                                       zip(found.tolist(), res_scores))),
+        "confusion_matrix": {
+            "TP": sum(tp_scores[~misaligned].tolist()),
+            "FP": sum([full_score] * np.count_nonzero(misaligned))
+        },
+        "per_core_position_scores": dict(zip((positions + 1).tolist(),
+                                             res_scores))
+    }
 
 
-def compare_vars_complex(gold_alns, target_id, test_aln):
+def compare_vars_complex(gold_alns, target_id, test_aln, score_table=None):
     """
     Check if the residues not aligned in gold are also not aligned in test aln
+
+    :param gold_alns: gold alignments from the json file (compiled or not)
+    :param score_table: ScoreTable of the gold file (its score_modifiers)
+        used to compile gold_alns, the default scores if None
     """
     # number of comparisons for score normalization
     n = 0
     overall_score = 0
     per_residue_scores = {}
 
-    alrights = 0
     confusion_matrix = {"FN": 0, "TN": 0}
-    for seq_id, gold_aln in gold_alns.iteritems():
+    gold_alns = compile_gold_json(gold_alns, score_table)
+    for seq_id, gold_scores in gold_alns.iteritems():
         if seq_id not in test_aln["var"]:
             continue
-        per_residue_scores[seq_id] = {}
-
-        test_seq_nonaligned = test_aln["var"][seq_id]
-
-        for test_res_number in test_seq_nonaligned:
-            test_res_number = str(test_res_number)
-            if test_res_number not in gold_aln:
-                alrights += 1
-                confusion_matrix["TN"] += 1
-                # residue not aligned in gold one, OK
-                assert test_res_number not in per_residue_scores[seq_id]
-                per_residue_scores[seq_id][int(test_res_number)] = (True, 0.0)
-                continue
-
-            scores = gold_aln[test_res_number]
-            if scores.keys()[0] == '*':
-                confusion_matrix["TN"] += 1
-                alrights += 1
-                # residue not aligned in gold one, OK
-                # means residue should not be aligned with anything, also OK
-                assert test_res_number not in per_residue_scores[seq_id]
-                per_residue_scores[seq_id][int(test_res_number)] = (True, 0.0)
-                continue
-
-            # if we're here that means the residue is not aligned in the
-            # test alignment and aligned in gold
-            # the penalty is the average score you could get on this position
-            # in case of multiple solutions, if there is just one solution than
-            # that is the sore for this one solution
-            penalty = sum([get_score_mod_value(i) for i in scores.values()]) / len(scores)
-            # confusion_matrix["FN"] += abs(float(penalty) / SCORE_MODS["u"])
-            confusion_matrix["FN"] += 1
+
+        test_seq_nonaligned = grounded_to_array(test_aln["var"][seq_id])
+        # residues not aligned in the test alignment and aligned in gold are
+        # FNs, the rest (not in gold or '*' - not to be aligned with
+        # anything) are OK
+        # the penalty is the average score you could get on this position
+        # in case of multiple solutions, if there is just one solution than
+        # that is the sore for this one solution
+        aligned, penalties = gold_scores.unaligned_penalties(
+            test_seq_nonaligned)
+        aligned_no = int(np.count_nonzero(aligned))
+        # confusion_matrix["FN"] += abs(float(penalty) / score_table["u"])
+        confusion_matrix["FN"] += aligned_no
+        confusion_matrix["TN"] += len(aligned) - aligned_no
+        n += aligned_no
+        for penalty in penalties[aligned].tolist():
             overall_score -= penalty
-            per_residue_scores[seq_id][int(test_res_number)] = (False, -penalty)
-            n += 1
+
+        res_scores = [(False, -penalty) if is_aligned else (True, 0.0)
+                      for is_aligned, penalty in zip(aligned.tolist(),
+                                                     penalties.tolist())]
+        per_residue_scores[seq_id] = dict(zip(test_seq_nonaligned.tolist(),
+                                              res_scores))
     return {
         "n": n, "overall_score": overall_score,
         "per_residue_scores": per_residue_scores,
@@ -1,21 +1,79 @@
+"""
+The test alignment is rebuilt so that the master sequence is complete and has
+no gaps. What happens to the columns is first worked out on the master
+sequence as a column plan:
+    (columns, lowercase, added)
+columns are the columns of the new alignment - indexes of the input columns,
+or -(k + 1) for the k-th added column; added are the master residues of the
+added columns (the other sequences get gaps there) and lowercase is a set of
+input columns that become lowercase (neighbours of removed columns).
+The plan is then applied to every sequence in one pass.
+"""
 import logging
 import re
 
+import numpy as np
+
 _log = logging.getLogger("__main__")
 
 
+def make_remove_plan(aln_len, positions_to_remove):
+    """
+    Column plan removing positions_to_remove, residues next to the removed
+    columns become lowercase
+    """
+    removed = set(positions_to_remove)
+    columns = [i for i in xrange(aln_len) if i not in removed]
+    lowercase = set(i for i in columns
+                    if i - 1 in removed or i + 1 in removed)
+    return columns, lowercase, []
+
+
+def make_fill_in_plan(columns, positions_to_fill_in):
+    """
+    Add columns with the master residues from positions_to_fill_in to a
+    column plan
+
+    :param columns: columns of the plan (of the alignment after removing
+        columns), the position of an added column is an index in this list
+    """
+    inserts = {}
+    added = []
+    for pos, master_res in positions_to_fill_in:
+        added.append(master_res)
+        inserts.setdefault(pos, []).append(-len(added))
+    new_columns = []
+    for pos, col in enumerate(columns):
+        new_columns.extend(inserts.get(pos, []))
+        new_columns.append(col)
+    new_columns.extend(inserts.get(len(columns), []))
+    return new_columns, added
+
+
+def apply_column_plan(aln_dict, plan, master_id=None):
+    """
+    Rebuild all sequences of the alignment according to the column plan
+    """
+    columns, lowercase, added = plan
+    columns = np.array(columns, dtype=np.int64)
+    lowercase = np.array(sorted(lowercase), dtype=np.int64)
+    for seq_id, seq in aln_dict.iteritems():
+        if seq_id == master_id:
+            extra = "".join(added)
+        else:
+            extra = "-" * len(added)
+        chars = np.array(list(seq + extra), dtype='S1')
+        chars[lowercase] = np.char.lower(chars[lowercase])
+        # added columns are after the residues of the sequence
+        index = np.where(columns >= 0, columns, len(seq) - columns - 1)
+        aln_dict[seq_id] = chars[index].tostring()
+
+
 def remove_positions(aln_dict, positions_to_remove):
-    for i in sorted(positions_to_remove, reverse=True):
-        for seq_id, seq in aln_dict.iteritems():
-            if i == 0:
-                new_seq = seq[1].lower() + seq[i+2:]
-            elif i == 1:
-                new_seq = seq[0].lower() + seq[i+1].lower() + seq[i+2:]
-            elif i < len(seq) - 1:
-                new_seq = seq[:i-1] + seq[i-1].lower() + seq[i+1].lower() + seq[i+2:]
-            else:
-                new_seq = seq[:i-1] + seq[i-1].lower()
-            aln_dict[seq_id] = new_seq
+    if not aln_dict:
+        return
+    aln_len = max(len(seq) for seq in aln_dict.itervalues())
+    apply_column_plan(aln_dict, make_remove_plan(aln_len, positions_to_remove))
 
 
 def find_positions_to_remove(master_aln_seq):
@@ -71,23 +129,13 @@ def make_master_seq_regex(master_full_seq):
 
 
 def fill_in_gaps(aln_dict, positions_to_fill_in, master_id, master_full_seq):
-    # need to reverse positions order, to change the alignment starting
-    # from C-terminus (then we don't need to update the alignment positions
-    # to fill in)
-    # rev_gap_positions = sorted(positions_to_fill_in, reverse=True, key=lambda x: x[0])
-    rev_gap_positions = positions_to_fill_in[::-1]
-
-    for pos_tuple in rev_gap_positions:
-        # aln_position = pos_tuple[0] + 1
-        aln_position = pos_tuple[0]
-        master_res = pos_tuple[1]
-        for seq_id, seq in aln_dict.iteritems():
-            if seq_id == master_id:
-                new_seq = seq[:aln_position] + master_res + seq[aln_position:]
-            else:
-                new_seq = seq[:aln_position] + "-" + seq[aln_position:]
-            aln_dict[seq_id] = new_seq
+    columns, added = make_fill_in_plan(range(len(aln_dict[master_id])),
+                                       positions_to_fill_in)
+    apply_column_plan(aln_dict, (columns, set(), added), master_id)
+    check_master_seq(aln_dict, master_id, master_full_seq)
+
 
+def check_master_seq(aln_dict, master_id, master_full_seq):
     # there should be no residues missing in the master seq now,
     # we can make it all uppercase
     aln_dict[master_id] = aln_dict[master_id].upper()
@@ -119,13 +167,17 @@ def make_master_seq_full(aln_dict, full_seqs, gold_ids, master_id):
         # alignment ok, master sequence is full and there are no gaps in it
         return aln_dict
 
+    # plan the removal and the filling in on the master sequence, then
+    # rebuild all sequences at once
     positions_to_remove = find_positions_to_remove(master_aln_seq)
-    remove_positions(aln_dict, positions_to_remove)
-
-    master_aln_seq = aln_dict[master_id]
+    columns, lowercase, _ = make_remove_plan(len(master_aln_seq),
+                                             positions_to_remove)
+    master_aln_seq = "".join([master_aln_seq[i] for i in columns])
     positions_to_fill_in = find_positions_to_fill_in(master_full_seq, master_aln_seq)
+    columns, added = make_fill_in_plan(columns, positions_to_fill_in)
 
-    fill_in_gaps(aln_dict, positions_to_fill_in, master_id, master_full_seq)
+    apply_column_plan(aln_dict, (columns, lowercase, added), master_id)
+    check_master_seq(aln_dict, master_id, master_full_seq)
 
     # make sure that the new alnseq contains the whole master sequence
     assert aln_dict[master_id].replace("-", "") == master_full_seq
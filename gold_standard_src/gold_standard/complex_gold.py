@@ -0,0 +1,219 @@
+"""
+Compiled gold standard alignments for the complex (--gold_json) scoring mode
+
+In the json gold standard every residue of a structure maps target residues
+(as strings, or '*' meaning "should not be aligned") to score categories:
+    {seq_id: {"12": {"10": "a"}, "13": {"*": "u"}, "14": {"11": "m5", "12": "m5"}}}
+
+Scoring looked these up residue by residue with string conversions, here
+every structure is compiled once into arrays in CSR layout: the entries of
+residue r are entries[indptr[r]:indptr[r + 1]] (in the order of the json
+dict), each with a target residue number (STAR for '*') and a score
+category code. The test alignment can then be checked with array lookups.
+
+Values of the score categories are kept in a ScoreTable built once per gold
+file from its "score_modifiers".
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+
+SCORE_MODS = {
+    "a": 1.0,
+    "b": 0.8,
+    "c": 0.5,
+    "u": -1.0,
+    "d": 0.0
+}
+
+# target of '*' entries (residue numbers are 1-based, 0 is a gap)
+STAR = -1
+
+
+def get_m_score(m):
+    """
+    Get a score for a position with multiple solutions
+    :param m: m modifier name, m + int
+    :return: score (float)
+    """
+
+    mscore = float("0." + str(m.strip('m'))) * SCORE_MODS["a"]
+
+    return mscore
+
+
+# categories of positions with multiple solutions ('m' + digit), their
+# default value is relative to the full score (see get_m_score)
+M_CATEGORIES = ['m{}'.format(i) for i in range(10)]
+
+
+class ScoreTable(object):
+    """
+    Values of the score categories ('a', 'u', ..., 'mN' for positions with
+    multiple solutions); the defaults are SCORE_MODS and get_m_score,
+    score_modifiers from the gold json override them
+
+    Categories are encoded as small ints (see code), values[code] is the
+    value of a category. All codes are assigned when the table is built, so
+    a table (e.g. DEFAULT_SCORE_TABLE) doesn't change while it's used.
+    """
+    def __init__(self, score_modifiers=None):
+        values = OrderedDict(SCORE_MODS)
+        for category, value in (score_modifiers or {}).iteritems():
+            values[category] = float(value)
+        for category in M_CATEGORIES:
+            if category not in values:
+                values[category] = (float("0." + category.strip('m')) *
+                                    values["a"])
+        self.codes = {category: code for code, category in enumerate(values)}
+        self._values = values.values()
+        self.values = np.array(self._values, dtype=float)
+
+    def code(self, category):
+        return self.codes[category]
+
+    def __getitem__(self, category):
+        return self._values[self.code(category)]
+
+
+DEFAULT_SCORE_TABLE = ScoreTable()
+
+
+def get_score_mod_value(mod_name):
+    return DEFAULT_SCORE_TABLE[mod_name]
+
+
+def get_score_table(score_table=None):
+    """
+    Return score_table, or the default table if it's None
+    """
+    return DEFAULT_SCORE_TABLE if score_table is None else score_table
+
+
+class CompiledSeqScores(object):
+    """
+    Gold alignment scores of one structure
+
+    :param res_scores: {res_number (str): {target_res (str) or '*': category}}
+    :param score_table: ScoreTable with values of the categories
+    """
+    def __init__(self, res_scores, score_table):
+        self.score_table = score_table
+        max_res = max([int(res) for res in res_scores] or [0])
+        self.in_gold = np.zeros(max_res + 1, dtype=bool)
+        # first entry is '*' - residue should not be aligned
+        self.star = np.zeros(max_res + 1, dtype=bool)
+        # average score of the entries, penalty for not aligning the residue
+        self.penalty = np.zeros(max_res + 1, dtype=float)
+        self.indptr = np.zeros(max_res + 2, dtype=np.int64)
+        targets = []
+        codes = []
+        for res in xrange(1, max_res + 1):
+            entries = res_scores.get(str(res))
+            if entries is not None:
+                self.in_gold[res] = True
+                self.star[res] = entries.keys()[0] == '*' if entries else False
+                entry_codes = [score_table.code(category)
+                               for category in entries.values()]
+                if entry_codes:
+                    self.penalty[res] = (
+                        sum([score_table.values[code] for code in entry_codes]) /
+                        len(entry_codes))
+                targets.extend(STAR if target == '*' else int(target)
+                               for target in entries)
+                codes.extend(entry_codes)
+            self.indptr[res + 1] = len(targets)
+        self.targets = np.array(targets, dtype=np.int32)
+        self.codes = np.array(codes, dtype=np.int16)
+
+    def contains(self, residues):
+        """
+        Bool array, which of the residues are in the gold alignment
+        """
+        in_range = residues < len(self.in_gold)
+        result = np.zeros(len(residues), dtype=bool)
+        result[in_range] = self.in_gold[residues[in_range]]
+        return result
+
+    def match(self, residues, test_targets):
+        """
+        Look up the gold scores of residues aligned with test_targets in the
+        test alignment; the entries of each residue are checked in order up
+        to the first one with a matching target or a '*'
+
+        :param residues: int array of residue numbers (no gaps)
+        :param test_targets: int array of target residues aligned with them
+            (0 for gaps)
+        :return: (bool array - alignment found in gold, array of its scores)
+        """
+        in_gold = self.contains(residues)
+        if not in_gold.all():
+            raise KeyError(str(residues[~in_gold][0]))
+        starts = self.indptr[residues]
+        lengths = self.indptr[residues + 1] - starts
+        # all entries of all residues, 'owner' is the index of the residue
+        owner = np.repeat(np.arange(len(residues)), lengths)
+        entry = (np.arange(lengths.sum()) +
+                 np.repeat(starts - (np.cumsum(lengths) - lengths), lengths))
+        entry_targets = self.targets[entry]
+        hit = ((entry_targets == test_targets[owner]) |
+               (entry_targets == STAR))
+        # first hit of every residue
+        hit_owner, first = np.unique(owner[hit], return_index=True)
+        hit_entry = entry[hit][first]
+        matched = self.targets[hit_entry] != STAR
+
+        found = np.zeros(len(residues), dtype=bool)
+        scores = np.zeros(len(residues), dtype=float)
+        found[hit_owner[matched]] = True
+        scores[hit_owner[matched]] = self.score_table.values[
+            self.codes[hit_entry[matched]]]
+        return found, scores
+
+    def unaligned_penalties(self, residues):
+        """
+        Check residues not aligned in the test alignment
+
+        :return: (bool array - residue is aligned in gold, array of penalties)
+        """
+        aligned = self.contains(residues)
+        aligned[aligned] = ~self.star[residues[aligned]]
+        penalties = np.zeros(len(residues), dtype=float)
+        penalties[aligned] = self.penalty[residues[aligned]]
+        return aligned, penalties
+
+
+class CompiledGold(object):
+    """
+    Compiled json gold alignments of all structures (in the order of the
+    json dict)
+
+    :param gold_alns: "alignments" from the gold json file
+    :param score_table: ScoreTable with values of the score categories (the
+        default scores if None)
+    """
+    def __init__(self, gold_alns, score_table=None):
+        self.score_table = get_score_table(score_table)
+        self.seqs = OrderedDict(
+            (seq_id, CompiledSeqScores(res_scores, self.score_table))
+            for seq_id, res_scores in gold_alns.iteritems())
+
+    def __getitem__(self, seq_id):
+        return self.seqs[seq_id]
+
+    def __contains__(self, seq_id):
+        return seq_id in self.seqs
+
+    def iteritems(self):
+        return self.seqs.iteritems()
+
+
+def compile_gold_json(gold_alns, score_table=None):
+    """
+    Return gold_alns as CompiledGold, compile them only if they're not
+    compiled already
+    """
+    if isinstance(gold_alns, CompiledGold):
+        return gold_alns
+    return CompiledGold(gold_alns, score_table)
@@ -0,0 +1,151 @@
+import bz2
+import gzip
+import os
+import tempfile
+import zlib
+
+from contextlib import contextmanager
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# magic bytes and the file name suffix of the supported compressions
+COMPRESSIONS = {
+    'gzip': ('\x1f\x8b', '.gz'),
+    'bz2': ('BZh', '.bz2'),
+    'xz': ('\xfd7zXZ\x00', '.xz')
+}
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Open a temporary file next to path for writing and rename it to path when
+    the block finishes without an exception, so that path is never left half
+    written (e.g. when a batch run is interrupted)
+    """
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix="." + basename + ".",
+                                    suffix=".tmp", dir=dirname)
+    try:
+        with os.fdopen(fd, mode) as out:
+            yield out
+        # mkstemp creates the file readable only by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _check_lzma():
+    if lzma is None:
+        raise IOError("xz compressed files need the lzma module "
+                      "(backports.lzma in Python 2)")
+
+
+def detect_compression(path):
+    """
+    Compression of the file from its magic bytes ('gzip', 'bz2', 'xz' or None)
+    """
+    with open(path, 'rb') as a:
+        start = a.read(max(len(magic) for magic, _ in COMPRESSIONS.values()))
+    for compression, (magic, _) in COMPRESSIONS.iteritems():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def strip_compression_suffix(path):
+    """
+    path without the .gz, .bz2 or .xz suffix
+    """
+    for _, suffix in COMPRESSIONS.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def open_input(path):
+    """
+    Open a text input file for reading, gzip, bz2 and xz compressed files are
+    decompressed while they're read (the compression is detected from the
+    content, not from the file name)
+
+    Plain and bz2 files are read with universal newlines, lines of other
+    compressed files keep '\\r' of the windows line endings.
+    """
+    compression = detect_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(path, 'rU')
+    elif compression == 'xz':
+        _check_lzma()
+        return lzma.LZMAFile(path, 'rb')
+    return open(path, 'rU')
+
+
+def get_compressor(compression):
+    if compression == 'gzip':
+        # wbits 16 + 15 - zlib stream with the gzip header
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Compressor()
+    elif compression == 'xz':
+        _check_lzma()
+        return lzma.LZMACompressor()
+    raise ValueError("Unknown compression: {}".format(compression))
+
+
+class CompressedWriter(object):
+    """
+    Compresses everything written to it into the file object out
+    """
+    def __init__(self, out, compression):
+        self.out = out
+        self.compressor = get_compressor(compression)
+
+    def write(self, data):
+        self.out.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.out.flush()
+
+    def finish(self):
+        self.out.write(self.compressor.flush())
+
+
+def get_output_path(path, compression=None):
+    """
+    path with the suffix of the compression (path if compression is None)
+    """
+    if compression is None:
+        return path
+    return path + COMPRESSIONS[compression][1]
+
+
+@contextmanager
+def open_output(path, compression=None):
+    """
+    atomic_write to path, if compression ('gzip', 'bz2' or 'xz') is given,
+    the output is compressed and the suffix of the compression is added to
+    path (see get_output_path)
+    """
+    if compression is None:
+        with atomic_write(path) as out:
+            yield out
+        return
+    with atomic_write(get_output_path(path, compression), 'wb') as out:
+        writer = CompressedWriter(out, compression)
+        yield writer
+        writer.finish()
@@ -0,0 +1,205 @@
+"""
+Compiled (binary) gold standard files
+
+Parsing the text gold standard (a multiple .Var file, or a directory of
+pairwise .Var files) and building the GoldIndex arrays is repeated in every
+run. A compiled gold file keeps the result: it's a single .npy file with a
+uint8 array that is loaded with numpy.load(mmap_mode='r'), so loading takes
+only the time to read the header and the arrays are shared by all processes
+through the page cache.
+
+Layout of the uint8 array:
+    8 bytes          length of the json header (little endian uint64)
+    json header      format version, content hash of the source files, ids,
+                     full sequences and the offset, dtype and length of each
+                     array
+    arrays           GoldIndex.arrays() of every gold alignment (one in the
+                     multi mode, one per pair in the pairwise mode), each
+                     aligned to 8 bytes
+
+The content hash of the source files is checked on loading, a stale compiled
+file is rebuilt from the sources (see load_gold_cached).
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from .file_utils import atomic_write, strip_compression_suffix
+from .gold_index import GoldIndex, get_gold_index
+from .pair_store import PairDict
+from .parsers.error_types import ParserError
+from .parsers.gold import parse_gold_multi, parse_gold_pairwise
+
+_log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+ARRAY_KINDS = ('cores', 'columns', 'var')
+ALIGNMENT = 8
+
+
+class StaleGoldError(ParserError):
+    """
+    The compiled gold file was built from different source files
+    """
+
+
+def get_source_paths(gold_path, multi):
+    """
+    Text files the gold standard is parsed from (the .Var file in the multi
+    mode, all .Var files in the gold directory otherwise)
+    """
+    if multi:
+        return [gold_path]
+    if not os.path.isdir(gold_path):
+        raise ParserError("No such directory: {}".format(gold_path))
+    return sorted(os.path.join(gold_path, x) for x in os.listdir(gold_path)
+                  if strip_compression_suffix(x).endswith(".Var"))
+
+
+def hash_sources(source_paths):
+    """
+    Content hash of the source files (names and contents, not paths, so the
+    gold directory can be moved)
+    """
+    sha = hashlib.sha1()
+    for path in sorted(source_paths, key=os.path.basename):
+        sha.update(os.path.basename(path) + "\0")
+        with open(path, 'rb') as a:
+            sha.update(hashlib.sha1(a.read()).digest())
+    return sha.hexdigest()
+
+
+def _pad(size):
+    return -size % ALIGNMENT
+
+
+def write_compiled_gold(gold_in, multi, source_hash, out_path):
+    """
+    Write parsed gold standard alignments (parse_gold_multi or
+    parse_gold_pairwise result) to a compiled gold file
+    """
+    if multi:
+        indexes = [(None, get_gold_index(gold_in['alns'], multi))]
+    else:
+        indexes = [(sorted(pair), get_gold_index(aln))
+                   for pair, aln in gold_in['alns'].iteritems()]
+
+    offset = 0
+    chunks = []
+    entries = []
+    for pair, gold_index in indexes:
+        arrays = gold_index.arrays()
+        entry = {'ids': pair}
+        for kind in ARRAY_KINDS:
+            entry[kind] = {}
+            for seq_id, array in arrays[kind].iteritems():
+                array = np.ascontiguousarray(array)
+                entry[kind][seq_id] = [offset, array.dtype.str, len(array)]
+                data = array.tobytes()
+                chunks.append(data + "\0" * _pad(len(data)))
+                offset += len(data) + _pad(len(data))
+        entries.append(entry)
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'source_hash': source_hash,
+        'multi': multi,
+        'ids': gold_in['ids'],
+        'full_seq': dict(gold_in['full_seq']),
+        'alns': entries
+    })
+    header += " " * _pad(8 + len(header))
+    blob = np.frombuffer(
+        np.array([len(header)], dtype='<u8').tobytes() + header +
+        "".join(chunks), dtype=np.uint8)
+    with atomic_write(out_path, 'wb') as o:
+        np.save(o, blob)
+    _log.info("Created the compiled gold file: %s", out_path)
+
+
+def read_compiled_header(blob):
+    header_len = int(blob[:8].view('<u8')[0])
+    header = json.loads(blob[8:8 + header_len].tobytes())
+    if header.get('version') != FORMAT_VERSION:
+        raise StaleGoldError("Unsupported compiled gold version: {}".format(
+            header.get('version')))
+    return header, 8 + header_len
+
+
+def load_compiled_gold(path, source_hash=None):
+    """
+    Load a compiled gold file, the arrays are memory-mapped
+
+    :param source_hash: expected content hash of the sources (not checked if
+        None)
+    :return: dict like parse_gold_multi / parse_gold_pairwise, alignments
+        are GoldIndex objects
+    """
+    blob = np.load(path, mmap_mode='r')
+    header, start = read_compiled_header(blob)
+    if source_hash is not None and header['source_hash'] != source_hash:
+        raise StaleGoldError("Compiled gold {} is out of date".format(path))
+
+    def get_array(offset, dtype, length):
+        dtype = np.dtype(str(dtype))
+        begin = start + offset
+        return blob[begin:begin + length * dtype.itemsize].view(dtype)
+
+    multi = header['multi']
+    indexes = []
+    for entry in header['alns']:
+        # json gives unicode strings, sequence ids are str everywhere else
+        arrays = {kind: {str(seq_id): get_array(*location)
+                         for seq_id, location in entry[kind].iteritems()}
+                  for kind in ARRAY_KINDS}
+        indexes.append((map(str, entry['ids'] or []),
+                        GoldIndex.from_arrays(arrays, multi)))
+
+    if multi:
+        alns = indexes[0][1]
+    else:
+        alns = PairDict()
+        for pair, gold_index in indexes:
+            alns[frozenset(pair)] = gold_index
+    return {
+        'alns': alns,
+        'ids': map(str, header['ids']),
+        'full_seq': {str(seq_id): str(seq)
+                     for seq_id, seq in header['full_seq'].iteritems()}
+    }
+
+
+def parse_gold_sources(gold_path, multi):
+    if multi:
+        return parse_gold_multi(gold_path)
+    return parse_gold_pairwise(gold_path)
+
+
+def compile_gold(gold_path, multi, out_path):
+    """
+    Parse the text gold standard (.Var file in the multi mode, directory with
+    pairwise .Var files otherwise) and write it to a compiled gold file
+    """
+    source_hash = hash_sources(get_source_paths(gold_path, multi))
+    gold_in = parse_gold_sources(gold_path, multi)
+    write_compiled_gold(gold_in, multi, source_hash, out_path)
+    return gold_in
+
+
+def load_gold_cached(gold_path, multi, compiled_path):
+    """
+    Load the gold standard from compiled_path if it was compiled from the
+    current sources, otherwise parse the sources and (re)write compiled_path
+    """
+    source_hash = hash_sources(get_source_paths(gold_path, multi))
+    if os.path.exists(compiled_path):
+        try:
+            return load_compiled_gold(compiled_path, source_hash)
+        except StaleGoldError as e:
+            _log.warning("%s, compiling it again", e)
+    gold_in = parse_gold_sources(gold_path, multi)
+    write_compiled_gold(gold_in, multi, source_hash, compiled_path)
+    return gold_in
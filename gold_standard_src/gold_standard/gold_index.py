@@ -0,0 +1,169 @@
+"""
+Inverse indexes for grounded gold standard alignments
+
+A grounded gold alignment maps alignment columns to residue numbers; for
+scoring we mostly need the opposite: given a residue number, which column is
+it in. Looking that up with list.index is linear in the alignment length, so
+the gold alignment is compiled once into per-sequence residue -> column
+mappings (and, in the multi mode, a var region membership set).
+
+For the vectorized scoring engine the same index is also available as numpy
+arrays (see GoldIndex.arrays), this requires integer residue numbers.
+"""
+import numpy as np
+
+
+class GoldIndex(object):
+    """
+    Constant-time residue lookups in a grounded gold alignment
+
+    :param golden_aln: pairwise gold alignment ({seq_id: grounded_seq}) or,
+        in the multi mode, {"cores": {seq_id: grounded_seq},
+        "var": {seq_id: [res_num, ...]}}
+    :param multi: True if golden_aln is a multiple alignment with var regions
+    """
+    def __init__(self, golden_aln, multi=False):
+        self.multi = multi
+        if multi:
+            self._cores = golden_aln['cores']
+            self._var = {seq_id: set(var)
+                         for seq_id, var in golden_aln['var'].iteritems()}
+        else:
+            self._cores = golden_aln
+            self._var = {}
+        self._columns = None
+        self._arrays = None
+
+    @classmethod
+    def from_arrays(cls, arrays, multi=False):
+        """
+        Create the index from its array representation (see arrays), e.g.
+        loaded from a compiled gold file; the list and dict representations
+        are created from the arrays when they're needed
+        """
+        index = cls.__new__(cls)
+        index.multi = multi
+        index._cores = None
+        index._var = None
+        index._columns = None
+        index._arrays = arrays
+        return index
+
+    @property
+    def cores(self):
+        if self._cores is None:
+            self._cores = {seq_id: array_to_grounded(seq)
+                           for seq_id, seq in self._arrays['cores'].iteritems()}
+        return self._cores
+
+    @property
+    def var(self):
+        if self._var is None:
+            self._var = {}
+            if self.multi:
+                self._var = {seq_id: set(np.flatnonzero(var).tolist())
+                             for seq_id, var in self._arrays['var'].iteritems()}
+        return self._var
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {seq_id: self.make_inverse_index(seq)
+                             for seq_id, seq in self.cores.iteritems()}
+        return self._columns
+
+    def to_aln(self):
+        """
+        The gold alignment in the form GoldIndex was created from
+        """
+        if self.multi:
+            return {'cores': self.cores,
+                    'var': {seq_id: sorted(var)
+                            for seq_id, var in self.var.iteritems()}}
+        return self.cores
+
+    def arrays(self):
+        """
+        Array representation of the index, built on first use:
+            cores: {seq_id: int32 array of residue numbers, 0 for gaps}
+            columns: {seq_id: int32 array, residue number -> column, -1 if
+                the residue is not in the cores}
+            var: {seq_id: bool array, residue number -> in var region}
+        """
+        if self._arrays is None:
+            self._arrays = {'cores': {}, 'columns': {}, 'var': {}}
+            for seq_id, seq in self.cores.iteritems():
+                cores = grounded_to_array(seq)
+                max_res = max(cores.max() if len(cores) else 0,
+                              max(self.var.get(seq_id) or [0]))
+                columns = np.full(max_res + 1, -1, dtype=np.int32)
+                # assign in reverse so that the first column wins (list.index)
+                res_cols = np.flatnonzero(cores)[::-1]
+                columns[cores[res_cols]] = res_cols
+                var = np.zeros(max_res + 1, dtype=bool)
+                var[list(self.var.get(seq_id, []))] = True
+                self._arrays['cores'][seq_id] = cores
+                self._arrays['columns'][seq_id] = columns
+                self._arrays['var'][seq_id] = var
+        return self._arrays
+
+    @staticmethod
+    def make_inverse_index(grounded_seq):
+        """
+        Map each residue in the grounded sequence to its (first) column
+        """
+        inverse = {}
+        for col, res in enumerate(grounded_seq):
+            if res != '-' and res not in inverse:
+                inverse[res] = col
+        return inverse
+
+    def get_aligned_res(self, res_num, query_id, id2):
+        """
+        Get residue from sequence id2 aligned to residue res_num from sequence
+        query_id in the gold alignment ('-' if it's not aligned)
+        """
+        aln_pos = self.columns[query_id].get(res_num)
+        if aln_pos is not None:
+            return self.cores[id2][aln_pos]
+        if not self.multi:
+            raise ValueError("{} is not in list".format(res_num))
+        if res_num in self.var[query_id]:
+            return '-'
+        raise Exception("Residue {} from sequence {} is not present in "
+                        "the gold alignment".format(res_num, query_id))
+
+
+def get_gold_index(golden_aln, multi=False):
+    """
+    Return golden_aln as a GoldIndex, compile it only if it's not one already
+    """
+    if isinstance(golden_aln, GoldIndex):
+        return golden_aln
+    return GoldIndex(golden_aln, multi)
+
+
+def grounded_to_array(grounded_seq):
+    """
+    Convert a grounded sequence (list of residue numbers and '-') to an int32
+    array with 0 on gap positions (residue numbers are 1-based)
+    """
+    return np.array([0 if res == '-' else res for res in grounded_seq],
+                    dtype=np.int32)
+
+
+def array_to_grounded(seq_array):
+    """
+    Inverse of grounded_to_array
+    """
+    return ['-' if res == 0 else res for res in seq_array.tolist()]
+
+
+def gold_index_to_aln(golden_aln):
+    """
+    Return the gold alignment in the parsed form (as it's used e.g. for the
+    html output) if it's a GoldIndex
+    """
+    if isinstance(golden_aln, GoldIndex):
+        return golden_aln.to_aln()
+    return golden_aln
@@ -2,52 +2,15 @@ import copy
 import logging
 import os
 
-from .aln_analyzer import get_score_mod_value
+from .complex_gold import get_score_table
+from .file_utils import open_output
 
 from .paths import TEMPLATE
 
 
 _log = logging.getLogger("__main__")
 
-
-class HtmlHandler(object):
-    def __init__(self, long_len=20):
-        self.long_len = long_len
-
-    def write_html(self, quality_data, outname, mode="cores"):
-        if mode in ["var", "var_short"]:
-            outtxt = self.aln_to_html_var(quality_data, mode)
-        elif mode in ["var_complex", "var_short_complex"]:
-            outtxt = self.aln_to_html_var(quality_data, mode)
-
-        elif mode == "pairwise":
-            outtxt = self.aln_to_html_pairwise(
-                    quality_data['aa_aln'], quality_data["gold_aln"], quality_data["full"],
-                    quality_data['wrong_cols'], quality_data["order"])
-
-        elif mode == "pairwise_complex":
-            outtxt = self.aln_to_html_pairwise_complex(quality_data)
-
-        elif mode == "cores":
-            outtxt = self.aln_to_html(
-                quality_data['aa_aln'], quality_data['wrong_cols'], quality_data["order"])
-
-        elif mode == "cores_complex":
-            outtxt = self.complex_aln_to_html(
-                    quality_data['aa_aln'], quality_data["num_aln"],
-                    quality_data["gold_aln"], quality_data['wrong_cols'],
-                    quality_data["order"], quality_data["target_id"],
-                    quality_data["full"])
-        else:
-            return
-
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        tmpl_full_path = '/'.join(list(os.path.split(script_dir)[:-1]) +
-                                  [TEMPLATE])
-        with open(tmpl_full_path) as a:
-            template_fmt = a.read()
-
-        css = """
+CSS = """
         <style>
         monospacediv {
             font-family: monospace;
@@ -100,8 +63,71 @@ class HtmlHandler(object):
         }
         </style>
         """
-        with open(outname + ".html", 'w') as out:
-            out.write(template_fmt.format(css, outtxt))
+
+
+class HtmlHandler(object):
+    def __init__(self, long_len=20, compression=None):
+        self.long_len = long_len
+        # compression of the html files (see file_utils.open_output)
+        self.compression = compression
+
+    def iter_html(self, quality_data, mode="cores"):
+        """
+        Generator of the html body of the mode (None if the mode is unknown)
+        """
+        if mode in ["var", "var_short", "var_complex", "var_short_complex"]:
+            return self.iter_aln_to_html_var(quality_data, mode)
+
+        elif mode == "pairwise":
+            return self.iter_aln_to_html_pairwise(
+                    quality_data['aa_aln'], quality_data["gold_aln"], quality_data["full"],
+                    quality_data['wrong_cols'], quality_data["order"])
+
+        elif mode == "pairwise_complex":
+            return self.iter_aln_to_html_pairwise_complex(quality_data)
+
+        elif mode == "cores":
+            return self.iter_aln_to_html(
+                quality_data['aa_aln'], quality_data['wrong_cols'], quality_data["order"])
+
+        elif mode == "cores_complex":
+            return self.iter_complex_aln_to_html(
+                    quality_data['aa_aln'], quality_data["num_aln"],
+                    quality_data["gold_aln"], quality_data['wrong_cols'],
+                    quality_data["order"], quality_data["target_id"],
+                    quality_data["full"], quality_data.get("score_table"))
+        return None
+
+    @staticmethod
+    def get_template_parts():
+        """
+        The html template split around its placeholders: (head, between the
+        css and the body, tail)
+        """
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        tmpl_full_path = '/'.join(list(os.path.split(script_dir)[:-1]) +
+                                  [TEMPLATE])
+        with open(tmpl_full_path) as a:
+            head, middle, tail = a.read().split("{}")
+        return head, middle, tail
+
+    def write_html(self, quality_data, outname, mode="cores"):
+        """
+        Write the html file of the mode, the template, css and the lines of
+        the body are streamed to the (buffered) output file
+        """
+        body = self.iter_html(quality_data, mode)
+        if body is None:
+            return
+
+        head, middle, tail = self.get_template_parts()
+        with open_output(outname + ".html", self.compression) as out:
+            out.write(head)
+            out.write(CSS)
+            out.write(middle)
+            for chunk in body:
+                out.write(chunk)
+            out.write(tail)
 
     @staticmethod
     def get_insertion_positions(num_aln):
@@ -112,8 +138,11 @@ class HtmlHandler(object):
         insertion_positions = self.get_insertion_positions(num_aln)
 
     def aln_to_html_var(self, quality_data, mode):
+        return "".join(self.iter_aln_to_html_var(quality_data, mode))
+
+    def iter_aln_to_html_var(self, quality_data, mode):
         short_var = mode in ["var_short", "var_short_complex"]
-        html_out = "<div class=monospacediv style='font-family:monospace;'>\n<br>"
+        yield "<div class=monospacediv style='font-family:monospace;'>\n<br>"
         aln_length = len(quality_data['aa_aln'])
         # quality_data["core_indexes"] = [0, 4]
         num_aln_c = self.split_cores(quality_data['num_aln'],
@@ -138,9 +167,7 @@ class HtmlHandler(object):
                 html_seq = self.make_html_var_seq(
                     seq, quality_data['wrong_cols'][seq_id], var_lengths,
                     aln_length, short_var)
-            html_sequence = "{}    {}".format(seq_id, html_seq)
-            html_out += html_sequence + "\n"
-        return html_out
+            yield "{}    {}\n".format(seq_id, html_seq)
 
     def get_max_var_lengths(self, num_aln, short_var):
         max_lengths = []
@@ -170,22 +197,22 @@ class HtmlHandler(object):
         raise RuntimeError("Did not find full seq pos for core index %d in seq: %s" % (core_index, merged_corvar_seq))
 
     def make_html_var_seq_complex(self, corvar_seq, wrong, max_lengths, aln_length, short_var=False):
-        html_seq = ""
-        r_index = 0
-        corvar_merged = ""
+        html_seq = []
+        # 0-based position in the full sequence of the next residue (the
+        # same as get_full_seq_pos of the merged var and core regions, but
+        # counted as the regions are added)
+        full_seq_pos = 0
         for c, core in enumerate(corvar_seq["cores"]):
             var = corvar_seq["var"][c].lower()
-            full_var = var
+            full_seq_pos += len(var)
             if short_var:
                 var = self.make_short_var(var)
-            corvar_merged += full_var + core
             var = " " + var + " " * (max_lengths[c] - len(var)) + " "
-            html_seq += var
-            for i, res in enumerate(core):
+            html_seq.append(var)
+            for res in core:
                 if res == "-":
                     new_res = "<span>-</span>"
                 else:
-                    full_seq_pos = self.get_full_seq_pos(corvar_merged, r_index)
                     score = wrong[full_seq_pos + 1]
                     if score[0] and score[1] == 1:
                         new_res = "<span class=featOK>{}</span>".format(res)
@@ -193,26 +220,26 @@ class HtmlHandler(object):
                         level = self.get_level_cmplx(score[1])
                         new_res = "<span class=featWRONG{}>{}</span>".format(
                                 level, res)
-                r_index += 1
-                html_seq += new_res
+                    full_seq_pos += 1
+                html_seq.append(new_res)
         var = corvar_seq["var"][-1].lower()
         if short_var:
             var = self.make_short_var(var)
-        html_seq += " " + var + " " * (max_lengths[-1] - len(var))
-        return html_seq
+        html_seq.append(" " + var + " " * (max_lengths[-1] - len(var)))
+        return "".join(html_seq)
 
     def make_html_var_seq(self, corvar_seq, wrong, max_lengths, aln_length, short_var=False):
-        html_seq = ""
+        html_seq = []
         r_index = 0
         for c, core in enumerate(corvar_seq["cores"]):
             var = corvar_seq["var"][c].lower()
             if short_var:
                 var = self.make_short_var(var)
             var = " " + var + " " * (max_lengths[c] - len(var)) + " "
-            html_seq += var
+            html_seq.append(var)
             for res in core:
                 if res != "-" and res != " ":
-                    if r_index in wrong.keys():
+                    if r_index in wrong:
                         level = self.get_level(wrong[r_index], aln_length)
                         new_res = "<span class=featWRONG{}>{}</span>".format(
                             level, res)
@@ -221,12 +248,12 @@ class HtmlHandler(object):
                 else:
                     new_res = "<span class=noFeat>" + res + "</span>"
                 r_index += 1
-                html_seq += new_res
+                html_seq.append(new_res)
         var = corvar_seq["var"][-1].lower()
         if short_var:
             var = self.make_short_var(var)
-        html_seq += " " + var + " " * (max_lengths[-1] - len(var))
-        return html_seq
+        html_seq.append(" " + var + " " * (max_lengths[-1] - len(var)))
+        return "".join(html_seq)
 
     def make_short_var(self, var):
         if len(var) > self.long_len:
@@ -242,32 +269,32 @@ class HtmlHandler(object):
     @staticmethod
     def make_html_target_sequence(target_seq, target_id):
         header = "<span style='color:gray;'><b>    TARGET</b> {}   </span>".format(target_id)
-        sequence = ""
+        sequence = [header]
         for i, res_i in enumerate(target_seq, start=1):
             if i % 10 == 0:
                 res_i = "<b>" + res_i + "</b>"
                 res_i = "<span class=noFeat style='color:black;'>{}</span>".format(res_i)
             else:
                 res_i = "<span class=noFeat style='color:gray;'>{}</span>".format(res_i)
-            sequence += res_i
-        html_target_sequence = header + sequence
-        return html_target_sequence
+            sequence.append(res_i)
+        return "".join(sequence)
 
     @staticmethod
     def make_ruler(target_sequence, spaces_no=19):
-        ruler = " " * spaces_no
-        ticks = " " * spaces_no
-        for i in range(1, len(target_sequence) + 1):
-            if i % 10 == 0:
-                new_number = " " * (10 - len(str(i))) + str(i)
-                new_number = "<span class=noFeat style='color:gray;'>{}</span>".format(new_number)
-                ruler += new_number
-                new_tick = "<span class=noFeat style='color:gray;'>{}</span>".format(9 * " " + "|")
-                ticks += new_tick
+        ruler = [" " * spaces_no]
+        ticks = [" " * spaces_no]
+        new_tick = "<span class=noFeat style='color:gray;'>{}</span>".format(9 * " " + "|")
+        for i in range(10, len(target_sequence) + 1, 10):
+            new_number = " " * (10 - len(str(i))) + str(i)
+            ruler.append("<span class=noFeat style='color:gray;'>{}</span>".format(new_number))
+            ticks.append(new_tick)
 
-        return ruler, ticks
+        return "".join(ruler), "".join(ticks)
 
     def aln_to_html_pairwise_complex(self, quality_data):
+        return "".join(self.iter_aln_to_html_pairwise_complex(quality_data))
+
+    def iter_aln_to_html_pairwise_complex(self, quality_data):
         num_aln = quality_data["num_aln"]
         aa_aln = quality_data["aa_aln"]
         gold_aln = quality_data["gold_aln"]
@@ -276,28 +303,29 @@ class HtmlHandler(object):
         order = quality_data["order"]
         target_id = quality_data["target_id"]
         gold_corvar = quality_data["gold_corvar"]["alns"]
+        score_table = quality_data.get("score_table")
 
         target_seq = full[target_id]
         gold_lowercase_residues = self.find_residues_neighbouring_insertions(gold_corvar["cores"], full)
 
-        html_out = "<div class=monospacediv style='font-family:monospace;'>\n<br>"
+        yield "<div class=monospacediv style='font-family:monospace;'>\n<br>"
 
         _log.info("Creating pairiwse html")
         master_num_seq = num_aln["cores"][target_id]
         html_target_sequence = self.make_html_target_sequence(target_seq, target_id)
 
         ruler, ticks = self.make_ruler(target_seq)
-        html_out += ruler + "\n"
-        html_out += ticks + "\n"
+        yield ruler + "\n"
+        yield ticks + "\n"
 
         for i, seq_id in enumerate(order, start=1):
             if seq_id not in gold_aln:
                 _log.warning("Sequence %s from the test aln is not present in the gold aln", seq_id)
                 continue
             number = " " * (3 - len(str(i))) + str(i)
-            html_sequence = "<b>{} TEST   {}</b>   ".format(number, seq_id)
-            html_gold_sequence = "<b>    GOLD   {}</b>   ".format(seq_id)
-            asterisk_line = "<span class=asteriskBlank>         {}</span>".format(" " * len(seq_id))
+            html_sequence = ["<b>{} TEST   {}</b>   ".format(number, seq_id)]
+            html_gold_sequence = ["<b>    GOLD   {}</b>   ".format(seq_id)]
+            asterisk_line = ["<span class=asteriskBlank>         {}</span>".format(" " * len(seq_id))]
 
             pairwise_gold_aln = gold_aln[seq_id]
             num_seq = num_aln["cores"][seq_id]
@@ -339,7 +367,7 @@ class HtmlHandler(object):
                         new_res = "<span class=noFeat>" + res + "</span>"
                         new_gold_res = "<span class=noFeat>" + gold_aa + "</span>"
                     elif res == "-":
-                        master_score = self.get_master_score(master_index, gold_aln[seq_id])
+                        master_score = self.get_master_score(master_index, gold_aln[seq_id], score_table)
                         level = self.get_level_cmplx(master_score)
                         new_res = "<span class=featWRONG{}>{}</span>".format(
                                 level, res)
@@ -349,37 +377,38 @@ class HtmlHandler(object):
                     else:
                         raise RuntimeError("res: {}; gold res: {}".format(res, gold_aa))
                 if add_asterisk:
-                    asterisk_line += "<span class=asteriskFull>*</span>"
+                    asterisk_line.append("<span class=asteriskFull>*</span>")
                 else:
-                    asterisk_line += "<span class=asteriskBlank> </span>"
-
-                html_sequence += new_res
-                html_gold_sequence += new_gold_res
-            # html_out += asterisk_line + "\n"
-            html_out += html_target_sequence + "\n"
-            html_out += html_sequence + "\n"
-            html_out += html_gold_sequence + "\n"
-            html_out += "<br>"
-        html_out += "</div>"
+                    asterisk_line.append("<span class=asteriskBlank> </span>")
+
+                html_sequence.append(new_res)
+                html_gold_sequence.append(new_gold_res)
+            # yield "".join(asterisk_line) + "\n"
+            yield html_target_sequence + "\n"
+            yield "".join(html_sequence) + "\n"
+            yield "".join(html_gold_sequence) + "\n"
+            yield "<br>"
+        yield "</div>"
         _log.info("Finished creating pairwise html")
-        return html_out
 
     @staticmethod
-    def get_master_score(master_index, gold_aln):
+    def get_master_score(master_index, gold_aln, score_table=None):
         """
         Find what's the score for alignment of this residue from the master sequence
         (this is for false negatives)
         :param master_index: 1-based position in the mnaster sequence
         :param gold_aln: pairwise alignment (like in the final_core.json file)
+        :param score_table: ScoreTable from the gold json (default scores if None)
         :return:
         """
+        score_table = get_score_table(score_table)
         # this master residue might have multiple alns allowed, find all then take the one
         # with the highest score
         highest_score = -1000
         found = False
         for res_i, alns in gold_aln.iteritems():
             if str(master_index) in alns:
-                score = get_score_mod_value(alns[str(master_index)])
+                score = score_table[alns[str(master_index)]]
                 if score > highest_score:
                     highest_score = score
                     found = True
@@ -468,7 +497,10 @@ class HtmlHandler(object):
         return lowercase_res
 
     def aln_to_html_pairwise(self, aa_aln, gold_aln, full, wrong, order):
-        html_out = "<div class=monospacediv style='font-family:monospace;'>\n<br>"
+        return "".join(self.iter_aln_to_html_pairwise(aa_aln, gold_aln, full, wrong, order))
+
+    def iter_aln_to_html_pairwise(self, aa_aln, gold_aln, full, wrong, order):
+        yield "<div class=monospacediv style='font-family:monospace;'>\n<br>"
         aln_length = len(aa_aln)
 
         _log.info("Creating pairiwse html")
@@ -479,9 +511,10 @@ class HtmlHandler(object):
                 continue
 
             seq = aa_aln[seq_id]
-            html_sequence = "<b>TEST</b> {}    ".format(seq_id)
-            html_gold_sequence = "<b>GOLD</b> {}    ".format(seq_id)
-            asterisk_line = "<span class=asteriskBlank>         {}</span>".format(" " * len(seq_id))
+            html_sequence = ["<b>TEST</b> {}    ".format(seq_id)]
+            html_gold_sequence = ["<b>GOLD</b> {}    ".format(seq_id)]
+            asterisk_line = ["<span class=asteriskBlank>         {}</span>".format(" " * len(seq_id))]
+            wrong_cols = wrong[seq_id]
 
             gold_seq = gold_aln["cores"][seq_id]
             if len(gold_seq) != len(seq):
@@ -498,8 +531,8 @@ class HtmlHandler(object):
                 else:
                     gold_aa = "-"
                 if res != "-" and res != " ":
-                    if r in wrong[seq_id].keys():
-                        level = self.get_level(wrong[seq_id][r], aln_length)
+                    if r in wrong_cols:
+                        level = self.get_level(wrong_cols[r], aln_length)
                         new_res = "<span class=featWRONG{}>{}</span>".format(
                                 level, res)
                         new_gold_res = "<span class=featWRONG{}>{}</span>".format(
@@ -519,31 +552,34 @@ class HtmlHandler(object):
                         raise RuntimeError("res: {}; gold res: {}".format(res, gold_aa))
 
                 if res.upper() != gold_aa.upper() and new_res != "-":
-                    asterisk_line += "<span class=asteriskFull>*</span>"
+                    asterisk_line.append("<span class=asteriskFull>*</span>")
                 else:
-                    asterisk_line += "<span class=asteriskBlank> </span>"
-
-                html_sequence += new_res
-                html_gold_sequence += new_gold_res
-            html_out += asterisk_line + "\n"
-            html_out += html_sequence + "\n"
-            html_out += html_gold_sequence + "\n"
-            html_out += "<br>"
-        html_out += "</div>"
+                    asterisk_line.append("<span class=asteriskBlank> </span>")
+
+                html_sequence.append(new_res)
+                html_gold_sequence.append(new_gold_res)
+            yield "".join(asterisk_line) + "\n"
+            yield "".join(html_sequence) + "\n"
+            yield "".join(html_gold_sequence) + "\n"
+            yield "<br>"
+        yield "</div>"
         _log.info("Finished creating pairwise html")
-        return html_out
 
-    def complex_aln_to_html(self, aa_aln, num_aln, gold_aln, wrong, order, target_id, full):
-        html_out = "<div class=monospacediv style='font-family:monospace;'>\n<br>"
+    def complex_aln_to_html(self, aa_aln, num_aln, gold_aln, wrong, order, target_id, full, score_table=None):
+        return "".join(self.iter_complex_aln_to_html(aa_aln, num_aln, gold_aln, wrong, order, target_id, full,
+                                                     score_table))
+
+    def iter_complex_aln_to_html(self, aa_aln, num_aln, gold_aln, wrong, order, target_id, full, score_table=None):
+        yield "<div class=monospacediv style='font-family:monospace;'>\n<br>"
 
         ruler, ticks = self.make_ruler(aa_aln[target_id], spaces_no=9)
-        html_out += ruler + "\n"
-        html_out += ticks + "\n"
+        yield ruler + "\n"
+        yield ticks + "\n"
 
         master_num_seq = num_aln["cores"][target_id]
         for seq_id in order:
             seq = aa_aln[seq_id]
-            html_sequence = "{}    ".format(seq_id)
+            html_sequence = ["{}    ".format(seq_id)]
             num_seq = num_aln["cores"][seq_id]
             pairwise_gold_aln = gold_aln[seq_id]
             for r, res in enumerate(seq):
@@ -567,23 +603,24 @@ class HtmlHandler(object):
                         if gold_aa == "-":
                             new_res = "<span class=noFeat>" + res + "</span>"
                         else:
-                            master_score = self.get_master_score(master_index, gold_aln[seq_id])
+                            master_score = self.get_master_score(master_index, gold_aln[seq_id], score_table)
                             level = self.get_level_cmplx(master_score)
                             new_res = "<span class=featWRONG{}>{}</span>".format(
                                     level, res)
                 else:
                     new_res = "<span class=noFeat>" + res + "</span>"
-                html_sequence += new_res
-            html_out += html_sequence + "\n"
-        return html_out
+                html_sequence.append(new_res)
+            yield "".join(html_sequence) + "\n"
 
     def aln_to_html(self, aa_aln, wrong, order):
-        # html_out = ""
-        html_out = "<div class=monospacediv style='font-family:monospace;'>\n<br>"
+        return "".join(self.iter_aln_to_html(aa_aln, wrong, order))
+
+    def iter_aln_to_html(self, aa_aln, wrong, order):
+        yield "<div class=monospacediv style='font-family:monospace;'>\n<br>"
 
         ruler, ticks = self.make_ruler(aa_aln[order[0]], spaces_no=9)
-        html_out += ruler + "\n"
-        html_out += ticks + "\n"
+        yield ruler + "\n"
+        yield ticks + "\n"
 
         aln_length = len(aa_aln)
         longest_seq_id = max(map(len, order))
@@ -593,20 +630,20 @@ class HtmlHandler(object):
                 continue
 
             seq = aa_aln[seq_id]
-            html_sequence = "{}{}    ".format(seq_id, " " * (longest_seq_id - len(seq_id)))
+            html_sequence = ["{}{}    ".format(seq_id, " " * (longest_seq_id - len(seq_id)))]
+            wrong_cols = wrong[seq_id]
             for r, res in enumerate(seq):
                 if res != "-" and res != " ":
-                    if r in wrong[seq_id].keys():
-                        level = self.get_level(wrong[seq_id][r], aln_length)
+                    if r in wrong_cols:
+                        level = self.get_level(wrong_cols[r], aln_length)
                         new_res = "<span class=featWRONG{}>{}</span>".format(
                             level, res)
                     else:
                         new_res = "<span class=featOK>{}</span>".format(res)
                 else:
                     new_res = "<span class=noFeat>" + res + "</span>"
-                html_sequence += new_res
-            html_out += html_sequence + "\n"
-        return html_out
+                html_sequence.append(new_res)
+            yield "".join(html_sequence) + "\n"
 
     @staticmethod
     def get_level_cmplx(number):
@@ -644,21 +681,13 @@ class HtmlHandler(object):
         corvar_aln = {seq_id: {'cores': [], 'var': []} for
                       seq_id in num_aln['cores'].keys()}
         for seq_id, cores in num_aln['cores'].iteritems():
+            seq = full_seq[seq_id]
             for c in cores:
-                new_core = ""
-                for res in c:
-                    if res == '-':
-                        new_res = '-'
-                    else:
-                        new_res = full_seq[seq_id][res - 1]
-                    new_core += new_res
+                new_core = "".join(['-' if res == '-' else seq[res - 1]
+                                    for res in c])
                 corvar_aln[seq_id]["cores"].append(new_core)
             for v in num_aln['var'][seq_id]:
-                new_var = ""
-                for res in v:
-                    if res != '-':
-                        new_res = full_seq[seq_id][res - 1]
-                        new_var += new_res
+                new_var = "".join([seq[res - 1] for res in v if res != '-'])
                 corvar_aln[seq_id]["var"].append(new_var)
         return corvar_aln
 
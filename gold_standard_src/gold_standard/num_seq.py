@@ -3,9 +3,15 @@ all numerical sequences are 1-based
 """
 import logging
 import re
+import string
 
 from copy import deepcopy
 
+import numpy as np
+
+from .file_utils import open_input
+from .gold_index import array_to_grounded, grounded_to_array
+
 
 _log = logging.getLogger(__name__)
 
@@ -14,26 +20,72 @@ class ParsingError(Exception):
     pass
 
 
+# character classes of the corvar lines: uppercase residues are in the
+# cores, lowercase in the var regions; digits (core separators) and
+# whitespace are skipped
+CORE, VAR, GAP, SKIP, INVALID = range(5)
+CORVAR_CLASSES = np.full(256, INVALID, dtype=np.uint8)
+CORVAR_CLASSES[[ord(c) for c in string.ascii_uppercase]] = CORE
+CORVAR_CLASSES[[ord(c) for c in string.ascii_lowercase]] = VAR
+CORVAR_CLASSES[ord('-')] = GAP
+CORVAR_CLASSES[[ord(c) for c in string.digits + string.whitespace]] = SKIP
+
+
+def classify_corvar(corvar_line):
+    """
+    :return: (uint8 array of the characters, array of their classes)
+    """
+    chars = np.frombuffer(corvar_line, dtype=np.uint8)
+    return chars, CORVAR_CLASSES[chars]
+
+
+def decode_corvar(corvar_line):
+    """
+    Decode a corvar line to arrays, residues are numbered (1-based) in the
+    order of the line
+
+    :return: dict, 'cores' - int32 array of the core residues with 0 on gap
+        positions, 'var' - int32 array of the var residues, 'full' - full
+        sequence
+    """
+    chars, classes = classify_corvar(corvar_line)
+    invalid = np.flatnonzero(classes == INVALID)
+    if len(invalid):
+        raise ParsingError("Incorrect character ({}) in the corvar line "
+                           "({})".format(corvar_line[invalid[0]], corvar_line))
+    used = classes != SKIP
+    chars = chars[used]
+    classes = classes[used]
+    is_residue = classes != GAP
+    numbers = np.cumsum(is_residue, dtype=np.int32)
+    cores = np.where(is_residue, numbers, 0)[classes != VAR]
+    return {
+        'cores': cores.astype(np.int32),
+        'var': numbers[classes == VAR],
+        'full': chars[is_residue].tobytes().upper()
+    }
+
+
 def corvar_to_num(corvar_line):
-    aln = {'cores': [], 'var': [], 'full': ''}
-    # remove numbers and whitespaces form the corvar line
-    sequence = re.sub(r'[0-9\s]', '', corvar_line)
-    aln['full'] = re.sub('-', '', sequence).upper()
-    count = 1
-    for res_i in sequence:
-        # add 1 to count because it needs to be 1-based
-        if res_i.isupper():
-            aln['cores'].append(count)
-            count += 1
-        elif res_i == '-':
-            aln['cores'].append('-')
-        elif res_i.islower():
-            aln['var'].append(count)
-            count += 1
-        else:
-            raise ParsingError("Incorrect character ({}) in the corvar line "
-                               "({})".format(res_i, corvar_line))
-    return aln
+    """
+    decode_corvar with the grounded cores and var residues as lists
+    """
+    decoded = decode_corvar(corvar_line)
+    return {
+        'cores': array_to_grounded(decoded['cores']),
+        'var': decoded['var'].tolist(),
+        'full': decoded['full']
+    }
+
+
+def add_sequence_to_error(error, seq_id, full_seq, aligned_seq):
+    """
+    Prepend the sequence that couldn't be converted to the message of a
+    ParsingError
+    """
+    msg = "There was an error processing sequence <b>%s</b>.\n<b>full sequence:</b>\n%s\n" \
+          "<b>aligned sequence:</b>\n%s" % (seq_id, full_seq, aligned_seq)
+    error.message = msg + "\n" + error.message
 
 
 def core_aln_to_num(aln_dict, full_seq, golden_ids=None):
@@ -56,23 +108,85 @@ def core_aln_to_num(aln_dict, full_seq, golden_ids=None):
                 seq, full_seq[seq_id])
             num_corvar_aln[seq_id] = res_cores
             core_indexes = core_indexes.union(set(core_indexes_tmp))
-            aln_3dm["var"][seq_id] = get_var_pos(aln_3dm["cores"][seq_id],
-                                                 full_seq[seq_id])
         except ParsingError as e:
-            msg = "There was an error processing sequence <b>%s</b>.\n<b>full sequence:</b>\n%s\n<b>aligned sequence:</b>\n%s" % ( seq_id, full_seq[seq_id], seq)
-            e.message = msg + "\n" + e.message
+            add_sequence_to_error(e, seq_id, full_seq[seq_id], seq)
             raise e
+    aln_3dm["var"] = get_unaligned_residues(
+        aln_3dm["cores"],
+        {seq_id: len(full_seq[seq_id]) for seq_id in aln_3dm["cores"]})
 
     return aln_3dm, list(core_indexes), num_corvar_aln
 
 
+def a3m_to_num(a3m_seq, full_seq):
+    """
+    Grounded sequence of an A3M sequence, lowercase insertions are var
+    regions (as in corvar lines) so the cores don't need to be searched for,
+    only the start of the aligned residues in the full sequence
+
+    :return: grounded sequence of the match columns
+    """
+    aln = corvar_to_num(a3m_seq)
+    offset = find_core(aln['full'], full_seq) if aln['full'] else 0
+    if offset < 0:
+        raise ParsingError("Didn't find the aligned residues {} in the full "
+                           "sequence".format(aln['full']))
+    return [res if res == '-' else res + offset for res in aln['cores']]
+
+
+def a3m_aln_to_num(aln_dict, full_seq, golden_ids=None):
+    """
+    core_aln_to_num for A2M/A3M alignments (see a3m_to_num)
+
+    :return: dict with core alignment (num) and var, list of core indexes
+    """
+    _log.info("Converting A3M alignment to grounded sequences")
+    aln_3dm = {"cores": {}, "var": {}}
+    core_indexes = set()
+    for seq_id, seq in aln_dict.iteritems():
+        if golden_ids and seq_id not in golden_ids:
+            continue
+        try:
+            aln_3dm["cores"][seq_id] = a3m_to_num(seq, full_seq[seq_id])
+        except ParsingError as e:
+            add_sequence_to_error(e, seq_id, full_seq[seq_id], seq)
+            raise e
+        core_indexes.update(
+            get_core_indexes_from_grounded(aln_3dm["cores"][seq_id]))
+    aln_3dm["var"] = get_unaligned_residues(
+        aln_3dm["cores"],
+        {seq_id: len(full_seq[seq_id]) for seq_id in aln_3dm["cores"]})
+    return aln_3dm, list(core_indexes)
+
+
+def get_unaligned_residues(grounded_seqs, seq_lengths):
+    """
+    Find residues that are not in the grounded sequences (var regions) of
+    all sequences at once, with a coverage mask over the full sequences
+
+    :param grounded_seqs: {seq_id: grounded sequence}
+    :param seq_lengths: {seq_id: length of the full sequence}
+    :return: {seq_id: sorted list of unaligned residue numbers (1-based)}
+    """
+    seq_ids = grounded_seqs.keys()
+    max_len = max([seq_lengths[seq_id] for seq_id in seq_ids] or [0])
+    # covered[a, res] - residue res of the a-th sequence is in the grounded
+    # sequence, residues beyond the end of the full sequence count as covered
+    covered = np.zeros((len(seq_ids), max_len + 1), dtype=bool)
+    covered[:, 0] = True
+    for a, seq_id in enumerate(seq_ids):
+        residues = grounded_to_array(grounded_seqs[seq_id])
+        covered[a, residues[residues <= max_len]] = True
+        covered[a, seq_lengths[seq_id] + 1:] = True
+    return {seq_id: np.flatnonzero(~covered[a]).tolist()
+            for a, seq_id in enumerate(seq_ids)}
+
+
 def get_var_pos(num_seq, full_seq):
     """
     Returns position missing in the core num seq
     """
-    full_num = range(1, len(full_seq) + 1)
-    var_pos = [i for i in full_num if i not in num_seq]
-    return var_pos
+    return get_unaligned_residues({0: num_seq}, {0: len(full_seq)})[0]
 
 
 def aln_seq_to_num(aln_seq):
@@ -88,7 +202,7 @@ def aln_seq_to_num(aln_seq):
 
 
 def get_core_indexes(final_core_file):
-    with open(final_core_file) as a:
+    with open_input(final_core_file) as a:
         final_core = a.read().splitlines()[0].split()
     if len(final_core[0]) == 5:
         cores = final_core[1:]
@@ -231,109 +345,137 @@ def get_next_core(aligned_seq, start):
     return {"core": core, "core_start": core_start}
 
 
-def res_or_x(residue):
-    if residue != 'X':
-        return residue
-    else:
-        return '.'
+def find_core_prefixes(core, full_seq, start=0):
+    """
+    Find the first occurrence of every prefix of the core in full_seq[start:]
+    (bit-parallel shift-and matching, one pass over the sequence)
 
+    'X' is a wildcard: if the searched sequence contains an X it matches any
+    residue of the core, otherwise an X in the core matches any residue
 
-def make_core_regex(core_seq, full_seq):
-    if 'X' in full_seq:
-        core_regex = "".join(["[{}X]".format(res_i) for res_i in core_seq])
-    elif 'X' in core_seq:
-        core_regex = "".join([res_or_x(res_i) for res_i in core_seq])
+    :return: list, item L is the position (relative to start) of
+        core[:L], -1 if it wasn't found
+    """
+    core_len = len(core)
+    first = [-1] * (core_len + 1)
+    first[0] = 0
+    all_bits = (1 << core_len) - 1
+    core_masks = {}
+    for i, res in enumerate(core):
+        core_masks[res] = core_masks.get(res, 0) | (1 << i)
+    if full_seq.find('X', start) != -1:
+        masks = {res: core_masks.get(res, 0) for res in set(full_seq[start:])}
+        masks['X'] = all_bits
     else:
-        core_regex = core_seq
-    return re.compile(core_regex)
+        x_bits = core_masks.get('X', 0)
+        masks = {res: core_masks.get(res, 0) | x_bits
+                 for res in set(full_seq[start:])}
+
+    # bit i of state is set if core[:i + 1] ends at the current position
+    state = 0
+    seen = 0
+    for pos in xrange(start, len(full_seq)):
+        if seen == all_bits:
+            break
+        state = ((state << 1) | 1) & masks[full_seq[pos]]
+        new = state & ~seen
+        if new:
+            seen |= new
+            while new:
+                low = new & -new
+                i = low.bit_length() - 1
+                first[i + 1] = pos - start - i
+                new ^= low
+    return first
+
+
+def find_core(core, full_seq, start=0):
+    """
+    Position (relative to start) of the first occurrence of core in
+    full_seq[start:] (with X wildcards), -1 if it's not there
+    """
+    if 'X' not in core and full_seq.find('X', start) == -1:
+        pos = full_seq.find(core, start)
+        return pos - start if pos != -1 else -1
+    return find_core_prefixes(core, full_seq, start)[len(core)]
 
 
 def split_core(core, full_seq, add_index=0):
     """
-    Recursively splits up a core into multiple cores
+    Splits up a core into multiple cores found in the full sequence
+
+    The core is searched for in the full sequence, if it's not there the
+    longest prefix of the core that is there becomes a separate core and the
+    rest of the core is searched for after it (and split up further if
+    needed)
     :param core: core to split up
     :param full_seq: sequence in which we want find the cores
-    :param add_index: only changed when called from inside this function,
-    indicates by how many residues was the full_seq trimmed to adjust
-    the position accordingly
+    :param add_index: position in full_seq to start the search from
     :return: list of dicts cores [{"core": string [core's aa seq],
     "pos": int [position in the full sequence]}]
     """
     _log.debug("Splitting up a core: %s\n full seq: %s\
             add_index: %s", core, full_seq, add_index)
     new_cores = []
+    while True:
+        first = find_core_prefixes(core, full_seq, add_index)
+        if first[len(core)] != -1 and len(core) != 1:
+            new_cores.append({'pos': first[len(core)] + add_index,
+                              'seq': core})
+            return new_cores
+
+        split = False
+        for i in xrange(1, len(core)):
+            prefix_len = len(core) - i
+            core1_pos = first[prefix_len]
+            if core1_pos == -1 and "X" in core:
+                # try a shorter prefix
+                core1_pos = first[max(prefix_len - i, 0)]
+            if core1_pos == -1:
+                continue
+
+            core2_pos = find_core(core[-i:], full_seq,
+                                  add_index + core1_pos + prefix_len)
+            if core2_pos != -1:
+                # means all cores are split up
+                new_cores.extend([
+                    {"seq": core[:-i],
+                     "pos": core1_pos + add_index},
+                    {"seq": core[-i:],
+                     "pos": core2_pos + add_index + core1_pos + prefix_len}])
+                _log.debug("Split up core into: %s", new_cores)
+                return new_cores
 
-    full_seq_remainder = full_seq[add_index:]
-    core_regex = make_core_regex(core, full_seq_remainder)
-    core_found = core_regex.search(full_seq_remainder)
-    if core_found and len(core) != 1:
-        return [{'pos': core_found.start() + add_index,
-                 'seq': core}]
-
-    for i in xrange(1, len(core)):
-        core_regex = make_core_regex(core[:-i], full_seq_remainder)
-        core_found = core_regex.search(full_seq_remainder)
-        if core_found:
-            core1_pos = core_found.start()
-        else:
-            core1_pos = -1
-
-        if not core_found and core.find("X") != -1:
-            tmp_core = core[:-i]
-            core_regex = make_core_regex(tmp_core[:-i], full_seq_remainder)
-            core_found = core_regex.search(full_seq_remainder)
-            if core_found:
-                core1_pos = core_found.start()
-            else:
-                core1_pos = -1
-
-        full_seq_remainder2 = full_seq[add_index + core1_pos + len(core[:-i]):]
-        core2_regex = make_core_regex(core[-i:], full_seq_remainder2)
-        core2_found = core2_regex.search(full_seq_remainder2)
-        if core2_found:
-            core2_pos = core2_found.start()
-        else:
-            core2_pos = -1
-
-        if core1_pos != -1 and core2_pos != -1:
-            # means all cores are split up, can exit the function
-            new_cores = [
-                {"seq": core[:-i],
-                 "pos": core1_pos + add_index},
-                {"seq": core[-i:],
-                 "pos": core2_pos + add_index + core1_pos + len(core[:-i])}]
-            break
-
-        elif core1_pos != -1:
             # core1 was found, core2 not, so core 2 needs to be split up
-            # further - call split_core on core2 now
+            # further
             position = core1_pos + add_index
             new_cores.append({"seq": core[:-i],
                               "pos": position})
-            add_index = position + len(core[:-i])
-            new_cores.extend(split_core(core[-i:], full_seq,
-                                        add_index))
+            add_index = position + prefix_len
+            core = core[-i:]
+            split = True
+            break
+
+        if not split:
             break
 
-    _log.debug("Split up core %s in two cores: %s", core, new_cores)
-    if not new_cores:
-        # we only allow a core of length one if we didn't find any larger cores
-        if full_seq[add_index:].find(core) != -1 and len(core) == 1:
-            return [{'pos': full_seq[add_index:].find(core) + add_index,
-                     'seq': core}]
-        raise ParsingError(
-            "Didn't find the segment {} in the remaining sequence. There is probably "
-            "an error in the input sequence right before this segment\nremaining "
-            "sequence[{}:]: {} newcores: {}\n".format(core, add_index, full_seq[add_index:], new_cores))
-    return new_cores
+    # we only allow a core of length one if we didn't find any larger cores
+    if full_seq[add_index:].find(core) != -1 and len(core) == 1:
+        new_cores.append({'pos': full_seq[add_index:].find(core) + add_index,
+                          'seq': core})
+        return new_cores
+    raise ParsingError(
+        "Didn't find the segment {} in the remaining sequence. There is probably "
+        "an error in the input sequence right before this segment\nremaining "
+        "sequence[{}:]: {} newcores: {}\n".format(core, add_index, full_seq[add_index:], []))
+
 
 def convert_3ssp_to_gold_aln(num_aln_dict, full_seq):
     gold_aln = {
         'var': {},
         'cores': deepcopy(num_aln_dict)
     }
-    for seq_id, num_aln in num_aln_dict.iteritems():
-        all_res = range(1, len(full_seq) + 1)
-        unaligned = list(set(all_res).difference(num_aln))
-        gold_aln['var'][seq_id] = unaligned
+    gold_aln['var'] = get_unaligned_residues(
+        num_aln_dict,
+        {seq_id: len(full_seq[seq_id]) for seq_id in num_aln_dict})
     return gold_aln
@@ -0,0 +1,201 @@
+"""
+Compact storage of per-pair results
+
+Sequence ids are interned to integers and a value for the pair of sequences
+(i, j), i < j, is stored at position j * (j - 1) / 2 + i of a flat list or
+array (the lower triangle of the N x N pair matrix, row by row). Because this
+position does not depend on the number of sequences, new ids can be added
+without moving the stored values.
+
+The stores can be used as dicts keyed by frozensets of two sequence ids
+(which is how pairwise results used to be kept), tuples (id1, id2) work too.
+"""
+from collections import MutableMapping
+
+import numpy as np
+
+
+CONFUSION_KEYS = ("TP", "FP", "FN", "TN")
+
+
+class IdInterner(object):
+    """
+    Assigns consecutive integers to sequence ids
+    """
+    def __init__(self, ids=()):
+        self.ids = []
+        self.index = {}
+        for seq_id in ids:
+            self.intern(seq_id)
+
+    def intern(self, seq_id):
+        i = self.index.get(seq_id)
+        if i is None:
+            i = len(self.ids)
+            self.index[seq_id] = i
+            self.ids.append(seq_id)
+        return i
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def tri_index(i, j):
+    """
+    Position of the pair (i, j) in the flat triangular store
+    """
+    if i > j:
+        i, j = j, i
+    return j * (j - 1) // 2 + i
+
+
+def tri_size(n):
+    """
+    Number of pairs of n sequences
+    """
+    return n * (n - 1) // 2
+
+
+class PairMapping(MutableMapping):
+    """
+    Base class of the pair stores: maps pair keys to slots, subclasses keep
+    the values (_get_slot, _set_slot and _resize)
+    """
+    def __init__(self, ids=(), interner=None):
+        self.interner = interner if interner is not None else IdInterner(ids)
+        self._present = np.zeros(0, dtype=bool)
+        self._reserve(tri_size(len(self.interner)))
+
+    def _reserve(self, size):
+        if size <= len(self._present):
+            return
+        capacity = max(size, 2 * len(self._present))
+        present = np.zeros(capacity, dtype=bool)
+        present[:len(self._present)] = self._present
+        self._present = present
+        self._resize(capacity)
+
+    def _slot(self, key, add=False):
+        try:
+            id1, id2 = key
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        if id1 == id2:
+            raise KeyError(key)
+        if add:
+            i = self.interner.intern(id1)
+            j = self.interner.intern(id2)
+            self._reserve(tri_size(len(self.interner)))
+        else:
+            i = self.interner.index.get(id1)
+            j = self.interner.index.get(id2)
+            if i is None or j is None:
+                raise KeyError(key)
+        return tri_index(i, j)
+
+    def __getitem__(self, key):
+        slot = self._slot(key)
+        if not self._present[slot]:
+            raise KeyError(key)
+        return self._get_slot(slot)
+
+    def __setitem__(self, key, value):
+        slot = self._slot(key, add=True)
+        self._set_slot(slot, value)
+        self._present[slot] = True
+
+    def __delitem__(self, key):
+        slot = self._slot(key)
+        if not self._present[slot]:
+            raise KeyError(key)
+        self._present[slot] = False
+
+    def __contains__(self, key):
+        try:
+            return bool(self._present[self._slot(key)])
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        ids = self.interner.ids
+        for j in xrange(1, len(ids)):
+            start = tri_size(j)
+            for i in np.flatnonzero(self._present[start:start + j]):
+                yield frozenset([ids[i], ids[j]])
+
+    def __len__(self):
+        return int(np.count_nonzero(self._present))
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, dict(self.iteritems()))
+
+
+class PairDict(PairMapping):
+    """
+    Pair store for arbitrary python objects
+    """
+    def _resize(self, capacity):
+        values = getattr(self, '_values', [])
+        self._values = values + [None] * (capacity - len(values))
+
+    def _get_slot(self, slot):
+        return self._values[slot]
+
+    def _set_slot(self, slot, value):
+        self._values[slot] = value
+
+
+class PairArray(PairMapping):
+    """
+    Pair store for numbers (fields=None) or records of numbers, e.g.
+    confusion matrices (fields=CONFUSION_KEYS) - these are kept as rows of
+    a 2D array and returned as dicts {field: value}
+    """
+    def __init__(self, ids=(), interner=None, fields=None, dtype=float):
+        self.fields = fields
+        self.dtype = np.dtype(dtype)
+        super(PairArray, self).__init__(ids, interner)
+
+    def _resize(self, capacity):
+        shape = (capacity,) if self.fields is None else (capacity, len(self.fields))
+        values = np.zeros(shape, dtype=self.dtype)
+        old_values = getattr(self, '_values', None)
+        if old_values is not None:
+            values[:len(old_values)] = old_values
+        self._values = values
+
+    def _get_slot(self, slot):
+        if self.fields is None:
+            return self._values[slot].item()
+        return {field: value.item()
+                for field, value in zip(self.fields, self._values[slot])}
+
+    def _set_slot(self, slot, value):
+        if self.fields is None:
+            self._values[slot] = value
+        else:
+            self._values[slot] = [value[field] for field in self.fields]
+
+    def set_square(self, values, mask):
+        """
+        Set values of many pairs at once
+
+        :param values: array of shape (n, n) ((n, n, len(fields)) for records),
+            value for the pair of the a-th and b-th interned id is in
+            values[b, a] for a < b
+        :param mask: bool array (n, n), pairs to set
+        """
+        n = len(self.interner)
+        rows, cols = np.tril_indices(n, -1)
+        # slots of the lower triangle are consecutive, row by row
+        self._reserve(tri_size(n))
+        size = tri_size(n)
+        selected = mask[rows, cols]
+        self._values[:size][selected] = values[rows, cols][selected]
+        self._present[:size] |= selected
+
+    def as_array(self):
+        """
+        Values of all stored pairs (in the order of iteration)
+        """
+        return self._values[:len(self._present)][self._present]
@@ -0,0 +1,103 @@
+"""
+Helpers for scoring chunks of pairs / sequences in a process pool
+
+Data that is the same for all chunks (gold alignment, test alignment) is not
+sent with every chunk, it is handed to the workers once when the pool starts
+and the worker functions read it with get_shared().
+"""
+import logging
+import multiprocessing
+
+
+_log = logging.getLogger(__name__)
+
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
+
+
+def get_shared():
+    return _shared
+
+
+def chunk_by_cost(items, costs, chunks_no):
+    """
+    Split items in chunks_no chunks, the most expensive items (e.g. longest
+    sequences) go to the first chunks so that they are scheduled first
+    Items with the same cost keep their order, so the chunks are deterministic
+
+    :param items: list of items to split up
+    :param costs: list of costs (e.g. sequence lengths) of the items
+    :return: list of chunks (lists of items)
+    """
+    if not items:
+        return []
+    order = sorted(range(len(items)), key=lambda i: -costs[i])
+    chunks_no = max(1, min(chunks_no, len(items)))
+    chunk_size = -(-len(items) // chunks_no)
+    return [[items[i] for i in order[start:start + chunk_size]]
+            for start in xrange(0, len(items), chunk_size)]
+
+
+def chunk_in_order(items, chunks_no):
+    """
+    Split items in chunks_no chunks of consecutive items, so that the results
+    of the chunks (returned by pool_map in the order of chunks) are in the
+    order of items whatever the number of chunks
+
+    :param items: list of items to split up
+    :return: list of chunks (lists of items)
+    """
+    if not items:
+        return []
+    chunks_no = max(1, min(chunks_no, len(items)))
+    chunk_size = -(-len(items) // chunks_no)
+    return [items[start:start + chunk_size]
+            for start in xrange(0, len(items), chunk_size)]
+
+
+def pool_map(func, chunks, jobs, shared):
+    """
+    Apply func to every chunk in a pool of 'jobs' processes (in this process
+    if jobs is 1), results are returned in the order of chunks
+
+    :param shared: dict available to func through get_shared()
+    """
+    return list(pool_imap(func, chunks, jobs, shared))
+
+
+def pool_imap(func, chunks, jobs, shared):
+    """
+    Like pool_map, but the results are yielded (in the order of chunks) as
+    soon as they're ready, so they can be processed while the next chunks
+    are computed
+    """
+    if jobs <= 1 or len(chunks) <= 1:
+        # restore the outer shared data when pool_map is called from a chunk
+        # of another pool_map (e.g. batch scoring of many alignments)
+        outer_shared = dict(_shared)
+        try:
+            for chunk in chunks:
+                # the shared data is set for every chunk, the consumer of
+                # the results can call pool_map in between
+                _init_worker(shared)
+                result = func(chunk)
+                _init_worker(outer_shared)
+                yield result
+        finally:
+            _init_worker(outer_shared)
+        return
+
+    _log.info("Processing %s chunks in %s processes", len(chunks), jobs)
+    pool = multiprocessing.Pool(jobs, _init_worker, (shared,))
+    try:
+        # chunksize=1 so that the chunks are handed out in order, most
+        # expensive first
+        for result in pool.imap(func, chunks, chunksize=1):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,37 @@
+import logging
+import os
+import re
+
+from .error_types import ParserError
+from .fasta import iter_fasta
+
+_log = logging.getLogger(__name__)
+
+
+def parse_a3m(aln_path, golden_ids=None):
+    """
+    Parse an A3M (or A2M) alignment: uppercase residues and '-' are the
+    match columns, lowercase residues are insertions; insert gaps ('.', only
+    in A2M) are removed, so both formats are returned as A3M
+
+    :param golden_ids: only sequences with these ids are kept
+    :return: (aln_dict, strcts_order), the sequences keep their case
+    """
+    _log.info("Parsing A3M alignment: %s", aln_path)
+    if not os.path.exists(aln_path):
+        raise ParserError("File doesn't exist: {}".format(aln_path))
+    aln_dict = {}
+    strcts_order = []
+    for seq_id, seq in iter_fasta(aln_path, golden_ids, keep_case=True):
+        if seq_id in aln_dict:
+            raise ParserError("Sequence {} is duplicated".format(seq_id))
+        aln_dict[seq_id] = seq.replace('.', '')
+        strcts_order.append(seq_id)
+    return aln_dict, strcts_order
+
+
+def get_match_columns(a3m_seq):
+    """
+    A3M sequence without the insertions (the aligned part)
+    """
+    return re.sub('[a-z]', '', a3m_seq)
@@ -1,12 +1,22 @@
 import os
 
+from ..file_utils import open_input
 from .error_types import ParserError
 
 
+def sniff_3SSP(head):
+    """
+    Check the beginning of a file (a few KB) for a 3SSP line: uppercase
+    sequence id and sequence separated by whitespace
+    """
+    first_line = head.split('\n', 1)[0].rstrip('\r')
+    return first_line.isupper() and len(first_line.split()) > 2
+
+
 def parse_3SSP(aln_path):
     if not os.path.exists(aln_path):
         raise ParserError("File not found: {}".format(aln_path))
-    with open(aln_path) as a:
+    with open_input(aln_path) as a:
         infile = a.read().splitlines()
     seq_dict = {}
     strcts_order = []
@@ -0,0 +1,62 @@
+import logging
+import os
+
+from ..file_utils import open_input
+from .error_types import ParserError
+
+_log = logging.getLogger(__name__)
+
+# first words of the header line (muscle -clw writes its own name)
+HEADERS = ("CLUSTAL", "MUSCLE", "PROBCONS")
+
+
+def sniff_clustal(head):
+    """
+    Check the beginning of a file (a few KB) for the Clustal header
+    """
+    return head.startswith(HEADERS)
+
+
+def parse_clustal(aln_path, golden_ids=None):
+    """
+    Parse a Clustal (.aln) alignment, the sequences are split in blocks
+    separated by empty lines and conservation lines (which start with
+    whitespace)
+
+    :param golden_ids: only sequences with these ids are kept
+    :return: (aln_dict, strcts_order)
+    """
+    _log.info("Parsing Clustal alignment: %s", aln_path)
+    if not os.path.exists(aln_path):
+        raise ParserError("File doesn't exist: {}".format(aln_path))
+    if golden_ids is not None:
+        golden_ids = set(golden_ids)
+    chunks = {}
+    strcts_order = []
+    found_header = False
+    with open_input(aln_path) as a:
+        for l in a:
+            if not l.strip():
+                continue
+            if not found_header:
+                if not l.startswith(HEADERS):
+                    raise ParserError("Incorrect format, no Clustal header "
+                                      "found.")
+                found_header = True
+            elif not l[0].isspace():
+                fields = l.split()
+                # the sequence can be followed by the residue count
+                if len(fields) not in (2, 3):
+                    raise ParserError("Incorrect Clustal line: {}".format(l))
+                seq_id = fields[0]
+                if golden_ids is not None and seq_id not in golden_ids:
+                    continue
+                if seq_id not in chunks:
+                    chunks[seq_id] = []
+                    strcts_order.append(seq_id)
+                chunks[seq_id].append(fields[1])
+    if not found_header:
+        raise ParserError("Incorrect format, no Clustal header found.")
+    aln_dict = {seq_id: ''.join(seq_chunks).upper()
+                for seq_id, seq_chunks in chunks.iteritems()}
+    return aln_dict, strcts_order
@@ -1,12 +1,31 @@
+import csv
 import logging
 import os
-import re
 
+import numpy as np
+
+from ..file_utils import open_input
+from ..gold_index import array_to_grounded
+from ..num_seq import GAP, SKIP, classify_corvar, get_unaligned_residues
 from .error_types import ParserError
 
 
 _log = logging.getLogger(__name__)
 
+EMPTY_VAR = ord('0')
+
+
+def get_csv_row_fields(row):
+    """
+    Sequence id and the corvar line of a csv row (None if the row has neither
+    2 nor 4 fields)
+    """
+    if len(row) == 4:
+        return ''.join(row[1:3]).upper(), row[3]
+    elif len(row) == 2:
+        return row[0].upper(), row[1]
+    return None
+
 
 def parse_csv_alignment(inpath, gold_ids, with_identities=False):
     """
@@ -14,81 +33,72 @@ def parse_csv_alignment(inpath, gold_ids, with_identities=False):
     second line is the template sequence:
     All lines contain sequence and sequence id:
         "sequence_id", "alnsequence"
+
+    The file is read row by row and the sequence id is checked first, only
+    rows of the gold structures are converted to grounded sequences (core
+    indexes are taken from the first row with cores)
     """
     _log.info("Parsing the input alignment [csv]")
     if not os.path.exists(inpath):
         raise ParserError("File not found: {}".format(inpath))
-    # read the file
-    with open(inpath) as a:
-        in_csv = a.read().splitlines()
-        num_aln = {'cores': {}, 'var': {}}
-    core_indexes = []
-    core_indexes_i = []
+    gold_ids = set(gold_ids)
+    num_aln = {'cores': {}, 'var': {}}
+    core_indexes = set()
     aa_aln = {}
-    for line in in_csv:
-        if "alnsequence" in line:
-            continue
-        # split up the line (comma delimiter) and remove quotes
-        # and join it again in one line
-        # only take fields 1,2 cause field one is proteinid
-        tmp_line = ','.join([re.sub('"', '', x) for x in line.split(',')])
-        tmp_line_split = tmp_line.split(',')
-        if len(tmp_line_split) == 4:
-            corvar_line = tmp_line_split[3]
-            seq_id = ''.join(tmp_line_split[1:3]).upper()
-        elif len(tmp_line_split) == 2:
-            corvar_line = tmp_line_split[1]
-            seq_id = tmp_line_split[0].upper()
-        new_seq_aa, new_seq_num, core_indexes_i = csv_corvar_to_num(corvar_line)
-        # new_seq, core_indexes_i = process_sequence(tmp_line)
-        if not core_indexes:
-            core_indexes = core_indexes_i
-        # assert core_indexes == core_indexes_i
-        if seq_id in gold_ids:
-            # if new_seq.keys()[0] in gold_ids:
-            # num_aln.update(new_seq)
-            num_aln['cores'][seq_id] = new_seq_num['cores']
-            num_aln['var'][seq_id] = new_seq_num['var']
-            aa_aln[seq_id] = new_seq_aa
+    with open_input(inpath) as a:
+        for row in csv.reader(a, skipinitialspace=True):
+            if any("alnsequence" in field for field in row):
+                continue
+            fields = get_csv_row_fields(row)
+            if fields is None:
+                continue
+            seq_id, corvar_line = fields
+            if not core_indexes:
+                core_indexes = get_csv_core_indexes(corvar_line.split())
+            if seq_id in gold_ids:
+                new_seq_aa, new_seq_num, _ = csv_corvar_to_num(corvar_line)
+                num_aln['cores'][seq_id] = new_seq_num['cores']
+                num_aln['var'][seq_id] = new_seq_num['var']
+                aa_aln[seq_id] = new_seq_aa
     return aa_aln, num_aln, core_indexes
 
 
+def get_csv_core_indexes(segments):
+    """
+    Indexes of the first column of every core (odd segments are the cores)
+    """
+    core_lengths = [len(segment) for segment in segments[1::2]]
+    return set(np.cumsum([0] + core_lengths[:-1]).tolist()) \
+        if core_lengths else set()
+
+
 def csv_corvar_to_num(corvar_line):
+    """
+    Convert a corvar line (var and core segments separated by whitespace,
+    even segments are var regions, '-' and '0' are empty positions) to the
+    grounded cores, all residues of the line are numbered in order
+
+    :return: (list of core characters, {'cores': grounded cores, 'var':
+        residues not in the cores, 'full': full sequence}, core indexes)
+    """
     aln = {'cores': [], 'var': [], 'full': ''}
-    # remove numbers and whitespaces form the corvar line
-    sequence = re.sub(r'[0-9\s]', '', corvar_line)
-    seq_split = corvar_line.split()
-    aln['full'] = re.sub('-', '', sequence).upper()
-    count = 1
-    ex = False
-    core_indexes = set()
-    # total length of cores up to now
-    # cores_len = 0
-    prev = 'var'
-    aa_seq = []
-    for j, seg_j in enumerate(seq_split):
-        for res_i in seg_j:
-            if j % 2 == 0:
-                # if res_i.isupper():
-                #     ex = True
-                if res_i != '-' and res_i != '0':
-                    # even segments are vars
-                    aln['var'].append(count)
-                    count += 1
-                prev = 'var'
-            else:
-                if prev == 'var':
-                    core_indexes.add(len(aln['cores']))
-                # if res_i.islower():
-                #     ex = True
-                if res_i == '-':
-                    aln['cores'].append('-')
-                else:
-                    aln['cores'].append(count)
-                    count += 1
-                aa_seq.append(res_i)
-                prev = 'core'
-            if ex:
-                raise ParserError("Core and var regions are not in the "
-                                  "right order")
-    return aa_seq, aln, core_indexes
+    segments = corvar_line.split()
+
+    chars, classes = classify_corvar(''.join(segments))
+    # without numbers and gaps
+    aln['full'] = chars[(classes != GAP) &
+                        (classes != SKIP)].tobytes().upper()
+    # segment index of every character
+    segment_no = np.repeat(np.arange(len(segments)),
+                           [len(segment) for segment in segments])
+    in_core = segment_no % 2 == 1
+    is_residue = (classes != GAP) & (in_core | (chars != EMPTY_VAR))
+    # residues are numbered in the order of the line, var regions included
+    numbers = np.cumsum(is_residue)
+
+    aln['cores'] = array_to_grounded(np.where(is_residue, numbers, 0)[in_core])
+    aa_seq = list(chars[in_core].tobytes())
+    count = int(numbers[-1]) + 1 if len(numbers) else 1
+    # residues not in the cores are in the var regions
+    aln['var'] = get_unaligned_residues({0: aln['cores']}, {0: count - 1})[0]
+    return aa_seq, aln, get_csv_core_indexes(segments)
@@ -3,37 +3,67 @@ import os
 import re
 import tempfile
 
+from ..file_utils import open_input
 from .error_types import ParserError
 
 _log = logging.getLogger(__name__)
 
 
-def parse_fasta(aln_path, golden_ids=None):
-    with open(aln_path) as a:
-        aln_lines = a.read().splitlines()
+def get_fasta_id(header):
+    """
+    Sequence id from a fasta header line: the part before the first '|' or
+    the whole header without whitespace characters
+    """
+    if '|' in header:
+        return header.lstrip('>').split('|')[0]
+    # remove the fasta header symbol and whitespace characters
+    return re.sub(r'\s', '', header.lstrip('>'))
 
-    aln_dict = {}
-    seq_id = ""
+
+def iter_fasta(aln_path, golden_ids=None, keep_case=False):
+    """
+    Read the fasta file record by record, only the current record is kept in
+    memory, so big alignments can be filtered in constant memory
+
+    :param golden_ids: only sequences with these ids are returned (lines of
+        other records are skipped without storing them)
+    :param keep_case: don't convert the sequences to uppercase (lowercase
+        residues are insertions in the A2M/A3M formats)
+    :return: generator of (seq_id, sequence) in the order of the file,
+        sequences are uppercase without the trailing '*'
+    """
+    if golden_ids is not None:
+        golden_ids = set(golden_ids)
+    seq_id = None
+    chunks = None
     found_fasta_headers = False
-    for l in aln_lines:
-        if l.startswith(">"):
-            found_fasta_headers = True
-            if '|' in l:
-                seq_id = l.lstrip('>').split('|')[0]
-            else:
-                # remove the fasta header symbol
-                seq_id = l.lstrip('>')
-                # remove whitespace characters
-                seq_id = re.sub(r'\s', '', seq_id)
-            if seq_id in aln_dict.keys():
-                raise ParserError("Sequence {} is duplicated".format(seq_id))
-            if golden_ids is None or seq_id in golden_ids:
-                aln_dict[seq_id] = ""
-        elif seq_id and (golden_ids is None or seq_id in golden_ids):
-            aln_dict[seq_id] += l.upper().rstrip("*")
+    with open_input(aln_path) as a:
+        for l in a:
+            l = l.rstrip('\r\n')
+            if l.startswith(">"):
+                found_fasta_headers = True
+                if chunks is not None:
+                    yield seq_id, ''.join(chunks)
+                seq_id = get_fasta_id(l)
+                keep = golden_ids is None or seq_id in golden_ids
+                chunks = [] if keep else None
+            elif seq_id and chunks is not None:
+                chunks.append((l if keep_case else l.upper()).rstrip("*"))
+    if chunks is not None:
+        yield seq_id, ''.join(chunks)
     if not found_fasta_headers:
         raise ParserError("Incorrect format, no fasta headers found.")
 
+
+def parse_fasta(aln_path, golden_ids=None):
+    """
+    :return: dict {seq_id: sequence} (see iter_fasta)
+    """
+    aln_dict = {}
+    for seq_id, seq in iter_fasta(aln_path, golden_ids):
+        if seq_id in aln_dict:
+            raise ParserError("Sequence {} is duplicated".format(seq_id))
+        aln_dict[seq_id] = seq
     return aln_dict
 
 
@@ -1,6 +1,7 @@
 import logging
 import os
 
+from ..file_utils import open_input
 from .error_types import ParserError
 
 _log = logging.getLogger(__name__)
@@ -10,7 +11,7 @@ def parse_fatcat(aln_path, golden_ids=None):
     _log.info("Parsing FATCAT output file: %s", aln_path)
     if not os.path.exists(aln_path):
         raise ParserError("File doesn't exist: {}".format(aln_path))
-    with open(aln_path) as a:
+    with open_input(aln_path) as a:
         aln_file = a.read().splitlines()
     aln_dict = {}
     seq_id = ""
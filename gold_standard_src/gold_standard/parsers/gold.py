@@ -1,8 +1,12 @@
 import json
 import logging
 import os
+from collections import Mapping
 from copy import deepcopy
 
+from ..complex_gold import ScoreTable, compile_gold_json
+from ..file_utils import open_input, strip_compression_suffix
+from ..pair_store import PairDict
 from .error_types import ParserError
 from .var_file import parse_var_file
 
@@ -10,12 +14,18 @@ _log = logging.getLogger(__name__)
 fs = frozenset
 
 
-def parse_gold_json(gold_path, corvar_path):
+def parse_gold_json(gold_path, corvar_path, compiled=False):
+    """
+    :param compiled: also return the alignments compiled for scoring
+        (complex_gold.CompiledGold) as 'compiled'
+    :return: dict, 'score_table' is a complex_gold.ScoreTable built from the
+        'score_modifiers'
+    """
     _log.info("Getting gold standard alignments")
     if not os.path.exists(gold_path):
         raise ParserError("File not fund: {}".format(gold_path))
     # get all ".Var" files in the given directory
-    with open(gold_path) as a:
+    with open_input(gold_path) as a:
         final_core_json = json.load(a)
 
     gold_alns = final_core_json["alignments"]
@@ -26,37 +36,127 @@ def parse_gold_json(gold_path, corvar_path):
     var = parse_var_file(corvar_path, multi=True)
     full_seq = var['full_seq']
 
-    return {
+    result = {
         'alns': gold_alns,
         'ids': gold_ids,
         'full_seq': full_seq,
         'target': target,
-        'score_modifiers': final_core_json['score_modifiers']
+        'score_modifiers': final_core_json['score_modifiers'],
+        'score_table': ScoreTable(final_core_json['score_modifiers'])
     }
+    if compiled:
+        result['compiled'] = compile_gold_json(gold_alns,
+                                               result['score_table'])
+    return result
+
+
+def get_var_file_ids(filename):
+    """
+    Ids of the structures in a pairwise .Var file, from its name
+    (<id1>_<id2>.<...>.Var), None if the name doesn't have this form
+    """
+    ids = filename.split('.')[0].split('_')
+    if len(ids) == 2 and all(ids) and ids[0] != ids[1]:
+        return ids
+    return None
+
+
+class PairwiseGoldAlns(PairDict):
+    """
+    Pairwise gold alignments of a gold directory, each .Var file is parsed
+    when its alignment (or a full sequence from it) is needed for the first
+    time
+
+    In the multi-process scoring every worker parses the files of the pairs
+    it scores, so when many pairs are needed they're parsed in parallel.
+
+    :param var_files: list of (file name, ids) in the directory order
+    """
+    def __init__(self, gold_dir, var_files):
+        super(PairwiseGoldAlns, self).__init__()
+        self.gold_dir = gold_dir
+        self.files = PairDict(interner=self.interner)
+        # the last file with a sequence (like dict.update of all full
+        # sequences)
+        self.seq_files = {}
+        self.full_seqs = {}
+        for filename, ids in var_files:
+            self.files[fs(ids)] = filename
+            self[fs(ids)] = None
+            for seq_id in ids:
+                self.seq_files[seq_id] = filename
+
+    def parse_file(self, filename):
+        if filename not in self.full_seqs:
+            _log.debug("Parsing gold alignment %s", filename)
+            var = parse_var_file(os.path.join(self.gold_dir, filename))
+            ids = get_var_file_ids(filename)
+            if ids is not None and fs(ids) != fs(var['ids']):
+                raise ParserError("Sequence ids in {} ({}) don't match the "
+                                  "file name".format(filename, var['ids']))
+            self.full_seqs[filename] = var['full_seq']
+            if self.files.get(fs(var['ids'])) == filename:
+                self[fs(var['ids'])] = var['alns']
+
+    def _get_slot(self, slot):
+        if self._values[slot] is None:
+            self.parse_file(self.files._values[slot])
+        return self._values[slot]
+
+
+class PairwiseGoldSeqs(Mapping):
+    """
+    Full sequences of a gold directory (read from the .Var files on demand)
+    """
+    def __init__(self, gold_alns):
+        self.gold_alns = gold_alns
+
+    def __getitem__(self, seq_id):
+        filename = self.gold_alns.seq_files[seq_id]
+        self.gold_alns.parse_file(filename)
+        return self.gold_alns.full_seqs[filename][seq_id]
+
+    def __iter__(self):
+        return iter(self.gold_alns.seq_files)
+
+    def __len__(self):
+        return len(self.gold_alns.seq_files)
 
 
 def parse_gold_pairwise(gold_dir):
+    """
+    Index the pairwise gold alignments in gold_dir, pairs of structures are
+    taken from the .Var file names and the files are parsed when they're
+    needed (files with other names are parsed right away)
+
+    :return: dict, 'alns' (PairwiseGoldAlns) and 'full_seq' are filled in
+        lazily
+    """
     _log.info("Getting gold standard alignments")
     if not os.path.exists(gold_dir):
         raise ParserError("No such directory: {}".format(gold_dir))
     # get all ".Var" files in the given directory
-    var_list = [x for x in os.listdir(gold_dir) if x.endswith(".Var")]
+    var_list = [x for x in os.listdir(gold_dir)
+                if strip_compression_suffix(x).endswith(".Var")]
     _log.info("Got %s var files", len(var_list))
-    gold_alns = {}
-    gold_ids = []
-    full_seq = {}
+    var_files = []
+    parsed = {}
     for v in var_list:
-        var = parse_var_file(os.path.join(gold_dir, v))
-        gold_ids.extend(var['ids'])
-        aln_ids = fs(var['ids'])
-        gold_alns[aln_ids] = var['alns']
-        full_seq.update(var['full_seq'])
-    _log.info("Finished parsing .Var files")
+        ids = get_var_file_ids(v)
+        if ids is None:
+            parsed[v] = parse_var_file(os.path.join(gold_dir, v))
+            ids = parsed[v]['ids']
+        var_files.append((v, ids))
+    gold_alns = PairwiseGoldAlns(gold_dir, var_files)
+    for v, var in parsed.iteritems():
+        gold_alns.full_seqs[v] = var['full_seq']
+        if gold_alns.files[fs(var['ids'])] == v:
+            gold_alns[fs(var['ids'])] = var['alns']
 
     return {
         'alns': gold_alns,
-        'ids': gold_ids,
-        'full_seq': full_seq
+        'ids': [seq_id for _, ids in var_files for seq_id in ids],
+        'full_seq': PairwiseGoldSeqs(gold_alns)
     }
 
 
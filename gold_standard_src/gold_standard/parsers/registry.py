@@ -0,0 +1,170 @@
+"""
+Registry of the test alignment formats
+
+Every format is an InputFormat with its parser, the file extensions and a
+sniff function that recognizes the format from the beginning of the file
+(at most SNIFF_SIZE bytes are read). The extensions are checked only for
+formats without a sniff function and only if no sniff function recognizes
+the file. A new format only needs to be registered with register_format.
+
+The detected format of a file is cached by its path and modification time.
+"""
+import logging
+import os
+
+from ..file_utils import open_input, strip_compression_suffix
+from ..num_seq import a3m_aln_to_num
+from .a3m import get_match_columns, parse_a3m
+from .aln3SSP import parse_3SSP, sniff_3SSP
+from .clustal import parse_clustal, sniff_clustal
+from .csv_parser import parse_csv_alignment
+from .error_types import ParserError
+from .fasta import parse_fasta
+from .fatcat import parse_fatcat
+from .stockholm import parse_stockholm, sniff_stockholm
+
+_log = logging.getLogger(__name__)
+
+SNIFF_SIZE = 4096
+# format of files that aren't recognized by any sniff function
+DEFAULT_FORMAT = "3dm"
+
+
+class InputFormat(object):
+    """
+    :param name: name of the format (--input_format)
+    :param parse: function(aln_path, gold_ids) returning (aln_dict,
+        strcts_order) of aligned sequences, which are filled in and grounded
+        by calc_alignment_quality
+    :param sniff: function(head) checking the beginning of a file, None if
+        the format can't be detected
+    :param extensions: file extensions of the format (lowercase), files are
+        detected by their extension only if there's no sniff function
+    :param grounded: the format has its own core / var regions, parse is
+        function(aln_path, gold_ids, full_seq) returning (aln_dict,
+        strcts_order, num_aln_dict, core_indexes)
+    :param pairwise_html: pairwise html output can be created
+    """
+    def __init__(self, name, parse, sniff=None, extensions=(), grounded=False,
+                 pairwise_html=True):
+        self.name = name
+        self.parse = parse
+        self.sniff = sniff
+        self.extensions = extensions
+        self.grounded = grounded
+        self.pairwise_html = pairwise_html
+
+
+# formats in the order of sniffing
+_formats = []
+_format_cache = {}
+
+
+def register_format(input_format):
+    """
+    Add a format to the registry (a format with the same name is replaced)
+    """
+    for i, registered in enumerate(_formats):
+        if registered.name == input_format.name:
+            _formats[i] = input_format
+            break
+    else:
+        _formats.append(input_format)
+    _format_cache.clear()
+
+
+def get_format(name):
+    for input_format in _formats:
+        if input_format.name == name:
+            return input_format
+    raise ParserError("Invalid input format: {}".format(name))
+
+
+def get_format_names():
+    return [input_format.name for input_format in _formats]
+
+
+def read_head(aln_path, size=SNIFF_SIZE):
+    """
+    First size bytes of the file (decompressed)
+    """
+    with open_input(aln_path) as a:
+        return a.read(size)
+
+
+def _detect_format(aln_path):
+    # the content goes first, e.g. 3dm files are often named .aln
+    head = read_head(aln_path)
+    for input_format in _formats:
+        if input_format.sniff is not None and input_format.sniff(head):
+            return input_format.name
+
+    # formats with a sniff function don't match by the extension alone
+    extension = os.path.splitext(
+        strip_compression_suffix(aln_path))[1].lower()
+    for input_format in _formats:
+        if input_format.sniff is None and extension in input_format.extensions:
+            return input_format.name
+    return DEFAULT_FORMAT
+
+
+def detect_format(aln_path):
+    """
+    Name of the format of the test alignment, from the beginning of the file
+    or, for formats that can't be sniffed, the file extension
+    (DEFAULT_FORMAT if it's not recognized)
+    """
+    key = os.path.abspath(aln_path)
+    mtime = os.stat(aln_path).st_mtime
+    cached = _format_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    name = _detect_format(aln_path)
+    _log.debug("Detected input format of %s: %s", aln_path, name)
+    _format_cache[key] = (mtime, name)
+    return name
+
+
+def _parse_fasta(aln_path, gold_ids):
+    return parse_fasta(aln_path, gold_ids), []
+
+
+def _parse_3SSP(aln_path, gold_ids):
+    return parse_3SSP(aln_path)
+
+
+def _parse_csv(aln_path, gold_ids, full_seq):
+    aln_dict, num_aln_dict, core_indexes = parse_csv_alignment(aln_path,
+                                                               gold_ids)
+    return aln_dict, [], num_aln_dict, core_indexes
+
+
+def _parse_a3m(aln_path, gold_ids, full_seq):
+    aln_dict, strcts_order = parse_a3m(aln_path, gold_ids)
+    # insertions (lowercase) are the var regions, so the cores don't need
+    # to be searched for and the master sequence doesn't need to be
+    # filled in
+    num_aln_dict, core_indexes = a3m_aln_to_num(aln_dict, full_seq,
+                                                golden_ids=gold_ids)
+    aln_dict = {seq_id: get_match_columns(seq)
+                for seq_id, seq in aln_dict.iteritems()}
+    return aln_dict, strcts_order, num_aln_dict, core_indexes
+
+
+register_format(InputFormat("stockholm", parse_stockholm, sniff_stockholm,
+                            ('.sto', '.stk', '.sth')))
+register_format(InputFormat("clustal", parse_clustal, sniff_clustal,
+                            ('.aln', '.clw')))
+# 3SSP - sequence id and sequence (corvar) on one line
+register_format(InputFormat("3SSP", _parse_3SSP, sniff_3SSP))
+# 3dm - fasta format but variable regions are not in the alignment
+register_format(InputFormat("3dm", parse_fatcat))
+# fatcat - 'final_core'-like format
+register_format(InputFormat("fatcat", parse_fatcat))
+register_format(InputFormat("fasta", _parse_fasta))
+register_format(InputFormat("csv", _parse_csv, grounded=True))
+# a2m, a3m - fasta format, lowercase insertions are the variable regions
+register_format(InputFormat("a2m", _parse_a3m, extensions=('.a2m',),
+                            grounded=True, pairwise_html=False))
+register_format(InputFormat("a3m", _parse_a3m, extensions=('.a3m',),
+                            grounded=True, pairwise_html=False))
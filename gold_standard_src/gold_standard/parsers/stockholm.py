@@ -0,0 +1,69 @@
+import logging
+import os
+import re
+
+from ..file_utils import open_input
+from .error_types import ParserError
+
+_log = logging.getLogger(__name__)
+
+# sequence names in Pfam-like alignments: <id>/<start>-<end>
+RANGE_SUFFIX = re.compile(r'/\d+-\d+$')
+
+
+def get_stockholm_id(name):
+    return RANGE_SUFFIX.sub('', name)
+
+
+def sniff_stockholm(head):
+    """
+    Check the beginning of a file (a few KB) for the Stockholm header
+    """
+    return head.startswith("# STOCKHOLM")
+
+
+def parse_stockholm(aln_path, golden_ids=None):
+    """
+    Parse the first alignment in a Stockholm file, the sequences can be split
+    in blocks; markup lines (#=GF, #=GS, #=GR, #=GC) are skipped
+    Insert gaps ('.') are converted to '-' and the sequences to uppercase
+
+    :param golden_ids: only sequences with these ids are kept
+    :return: (aln_dict, strcts_order)
+    """
+    _log.info("Parsing Stockholm alignment: %s", aln_path)
+    if not os.path.exists(aln_path):
+        raise ParserError("File doesn't exist: {}".format(aln_path))
+    if golden_ids is not None:
+        golden_ids = set(golden_ids)
+    chunks = {}
+    strcts_order = []
+    found_header = False
+    with open_input(aln_path) as a:
+        for l in a:
+            l = l.strip()
+            if not l:
+                continue
+            if not found_header:
+                if not l.startswith("# STOCKHOLM"):
+                    raise ParserError("Incorrect format, no Stockholm header "
+                                      "found.")
+                found_header = True
+            elif l == "//":
+                break
+            elif not l.startswith("#"):
+                fields = l.split()
+                if len(fields) != 2:
+                    raise ParserError("Incorrect Stockholm line: {}".format(l))
+                seq_id = get_stockholm_id(fields[0])
+                if golden_ids is not None and seq_id not in golden_ids:
+                    continue
+                if seq_id not in chunks:
+                    chunks[seq_id] = []
+                    strcts_order.append(seq_id)
+                chunks[seq_id].append(fields[1])
+    if not found_header:
+        raise ParserError("Incorrect format, no Stockholm header found.")
+    aln_dict = {seq_id: ''.join(seq_chunks).replace('.', '-').upper()
+                for seq_id, seq_chunks in chunks.iteritems()}
+    return aln_dict, strcts_order
@@ -1,6 +1,7 @@
 import logging
 import re
 
+from ..file_utils import open_input
 from ..num_seq import (aln_seq_to_num, corvar_to_num)
 from .error_types import ParserError
 
@@ -55,7 +56,10 @@ def convert_multi_var_to_aln(var_file):
     """
     multi_aln = {"cores": {}, "var": {}}
     full = {}
-    aln_dict = {i.split(',')[0]: i.split(',')[1] for i in var_file}
+    aln_dict = {}
+    for line in var_file:
+        fields = line.split(',')
+        aln_dict[fields[0]] = fields[1]
     for seq_id, seq in aln_dict.iteritems():
         aln = corvar_to_num(seq)
         multi_aln["cores"][seq_id] = aln["cores"]
@@ -66,7 +70,7 @@ def convert_multi_var_to_aln(var_file):
 
 def parse_var_file(file_path, multi=False):
     _log.debug("Parsing var file: %s; multi: %s", file_path, multi)
-    with open(file_path) as a:
+    with open_input(file_path) as a:
         var_file = a.read().splitlines()
     ids = [i.split(',')[0] for i in var_file]
 
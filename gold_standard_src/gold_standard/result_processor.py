@@ -1,80 +1,475 @@
+import csv
+import json
 import logging
-from numpy import sqrt
+import shutil
+import tempfile
+
+import numpy as np
+
+from .file_utils import atomic_write, get_output_path, open_output
 
 _log = logging.getLogger("__main__")
 
+MATRIX_FIELDS = ('TP', 'FP', 'FN', 'TN')
+STAT_FIELDS = ('specificity', 'sensitivity', 'ppv', 'npv', 'mcc')
+STATS_DTYPE = np.dtype([(field, np.float64) for field in STAT_FIELDS])
+
+
+def matrices_to_array(confusion_matrices, m_ids):
+    """
+    (len(m_ids) x 4) int64 array of the confusion matrices, columns in the
+    order of MATRIX_FIELDS
+    """
+    return np.array([[confusion_matrices[m_id][field]
+                      for field in MATRIX_FIELDS] for m_id in m_ids],
+                    dtype=np.int64).reshape(len(m_ids), len(MATRIX_FIELDS))
+
+
+def _ratio(numerator, denominator):
+    result = np.full(len(numerator), np.nan)
+    defined = denominator != 0
+    result[defined] = (numerator[defined].astype(np.float64) /
+                       denominator[defined])
+    return result
+
+
+def calc_stats_array(counts):
+    """
+    Stats of all confusion matrices at once
+
+    :param counts: (n x 4) array of confusion matrices (see
+        matrices_to_array), integer or float (the complex mode) counts
+    :return: structured array (STATS_DTYPE) with a row per matrix, NaN where
+        the denominator of a stat is 0
+    """
+    counts = np.asarray(counts)
+    if counts.dtype.kind != 'f':
+        counts = counts.astype(np.int64)
+    tp, fp, fn, tn = counts.T
+    stats = np.zeros(len(tp), dtype=STATS_DTYPE)
+    stats['specificity'] = _ratio(tn, tn + fp)
+    stats['sensitivity'] = _ratio(tp, tp + fn)
+    stats['ppv'] = _ratio(tp, tp + fp)
+    stats['npv'] = _ratio(tn, tn + fn)
+
+    up = tp * tn - fp * fn
+    # both products are exact, so down is rounded only once (as float() of
+    # the exact product would be)
+    down = (((tp + fp) * (tp + fn)).astype(np.float64) *
+            ((tn + fp) * (tn + fn)).astype(np.float64))
+    defined = down != 0
+    stats['mcc'] = np.nan
+    stats['mcc'][defined] = up[defined] / np.sqrt(down[defined])
+    return stats
+
+
+def stats_to_dict(stats_row):
+    """
+    Legacy dict of one row of calc_stats_array: None for undefined stats,
+    mcc 0.0 if it's undefined (all values are Python floats)
+    """
+    result = {field: None if np.isnan(stats_row[field])
+              else float(stats_row[field])
+              for field in ('specificity', 'sensitivity', 'ppv', 'npv')}
+    result['mcc'] = (0.0 if np.isnan(stats_row['mcc'])
+                     else float(stats_row['mcc']))
+    return result
+
 
 def calc_stats(confusion_matrices):
+    """
+    :return: {matrix id: {stat: value}} (see calc_stats_array)
+    """
     _log.info("Calculating stats")
-    stats = {}
-    for m_id, m in confusion_matrices.iteritems():
-        stats[m_id] = {'specificity': None, 'sensitivity': None,
-                       'ppv': None, 'npv': None}
-        if m['TN'] + m['FP'] != 0:
-            stats[m_id]['specificity'] = float(m['TN']) / (m['TN'] + m['FP'])
-        if m['TP'] + m['FN'] != 0:
-            stats[m_id]['sensitivity'] = float(m['TP']) / (m['TP'] + m['FN'])
-        if m['TP'] + m['FP'] != 0:
-            stats[m_id]['ppv'] = float(m['TP']) / (m['TP'] + m['FP'])
-        if m['TN'] + m['FN'] != 0:
-            stats[m_id]['npv'] = float(m['TN']) / (m['TN'] + m['FN'])
-
-        up = (m['TP'] * m['TN']) - (m['FP'] * m['FN'])
-        down = (m['TP'] + m['FP']) * (m['TP'] + m['FN']) * \
-            (m['TN'] + m['FP']) * (m['TN'] + m['FN'])
-
-        if down != 0:
-            stats[m_id]['mcc'] = up / sqrt(float(down))
+    m_ids = list(confusion_matrices)
+    stats = calc_stats_array(matrices_to_array(confusion_matrices, m_ids))
+    return {m_id: stats_to_dict(stats[i]) for i, m_id in enumerate(m_ids)}
+
+
+BOOTSTRAP_STATS = ('sp_score', 'mcc', 'sensitivity')
+# the resampling weights are built for blocks of resamples, so that a block
+# has at most this many (resamples x units) weights
+BOOTSTRAP_BLOCK_SIZE = 2 ** 22
+BOOTSTRAP_SEED = 0
+
+
+def iter_bootstrap_weights(units_no, resamples, seed=BOOTSTRAP_SEED):
+    """
+    Bootstrap resamples of units_no units (e.g. pairs) in blocks
+
+    :return: generator of (block size x units_no) arrays, how many times
+        each unit was drawn in each resample
+    """
+    random_state = np.random.RandomState(seed)
+    block = max(1, min(resamples, BOOTSTRAP_BLOCK_SIZE // max(units_no, 1)))
+    for start in range(0, resamples, block):
+        size = min(block, resamples - start)
+        drawn = random_state.randint(0, units_no, size=(size, units_no))
+        # the units drawn in the i-th resample are counted at
+        # i * units_no + unit
+        drawn += np.arange(size)[:, np.newaxis] * units_no
+        yield np.bincount(drawn.ravel(), minlength=size * units_no).reshape(
+            size, units_no)
+
+
+def bootstrap_intervals(counts, scores, resamples, confidence=0.95,
+                        score_norms=None, seed=BOOTSTRAP_SEED):
+    """
+    Percentile bootstrap confidence intervals of the SP score, mcc and
+    sensitivity
+
+    Units (pairs, or residues in the complex mode) are resampled with
+    replacement, the confusion matrix of a resample is the sum of the
+    matrices of the drawn units (as the full matrix is the sum of the pair
+    matrices) and the SP score is the sum of their scores divided by the sum
+    of their score_norms.
+
+    :param counts: (units x 4) array of confusion matrices (see
+        matrices_to_array)
+    :param scores: SP scores of the units
+    :param score_norms: the SP score normalization of the units, e.g. the max
+        scores of the residues (1 for every unit, i.e. the mean score, if
+        None)
+    :return: {stat: [lower, upper]} (BOOTSTRAP_STATS, None if the stat
+        isn't defined in the resamples)
+    """
+    counts = np.asarray(counts)
+    scores = np.asarray(scores, dtype=np.float64)
+    if score_norms is None:
+        score_norms = np.ones(len(scores))
+    score_norms = np.asarray(score_norms, dtype=np.float64)
+    matrices = []
+    sp_scores = []
+    for weights in iter_bootstrap_weights(len(scores), resamples, seed):
+        matrices.append(weights.dot(counts))
+        norms = weights.dot(score_norms)
+        # NaN if no drawn unit has a max score
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sp_scores.append(np.where(norms != 0, weights.dot(scores) / norms,
+                                      np.nan))
+    stats = calc_stats_array(np.vstack(matrices))
+    values = {
+        'sp_score': np.concatenate(sp_scores),
+        'mcc': stats['mcc'],
+        'sensitivity': stats['sensitivity']
+    }
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for stat in BOOTSTRAP_STATS:
+        stat_values = values[stat][~np.isnan(values[stat])]
+        if len(stat_values):
+            intervals[stat] = np.percentile(
+                stat_values, [tail, 100 - tail]).tolist()
         else:
-            stats[m_id]['mcc'] = 0
+            intervals[stat] = None
+    return intervals
 
-    return stats
 
+RESULT_FORMATS = ('txt', 'jsonl', 'csv', 'npz')
+# suffixes of the result files (added to the output path)
+RESULT_SUFFIXES = {'txt': '', 'jsonl': '.jsonl', 'csv': '.csv', 'npz': '.npz'}
+# formats compressed with the compression argument of process_results (the
+# text report is read by quality_results_to_csv.py, npz is compressed
+# always)
+COMPRESSED_FORMATS = ('jsonl', 'csv')
+CSV_COLUMNS = (('id1', 'id2') + MATRIX_FIELDS + STAT_FIELDS + ('sp_score',))
 
-def process_results(matrices, full_matrix, sp_scores, output, tmpl_no):
-    _log.info("Processing the results")
-    out_txt = ""
 
+def iter_pair_records(matrices, m_ids, stats, sp_scores):
+    """
+    Results of the pairs one by one
+
+    :param stats: calc_stats_array of the matrices (in the order of m_ids)
+    :return: generator of dicts, 'ids' (sorted, the order of a frozenset
+        depends on where it was built), 'matrix', 'stats' and 'sp_score'
+    """
+    for i, m_id in enumerate(m_ids):
+        yield {
+            'ids': sorted(m_id),
+            'matrix': matrices[m_id],
+            'stats': stats_to_dict(stats[i]),
+            'sp_score': sp_scores[m_id]
+        }
+
+
+def render_txt_summary(out, summary):
+    """
+    The text report: the whole alignment (the fields in the order of
+    MATRIX_FIELDS and STAT_FIELDS, so the report doesn't depend on how the
+    dicts were built)
+    """
+    full_matrix = summary['full_matrix']
     # FULL MATRIX #
-    out_txt += "#### RESULTS ####\n"
+    out.write("#### RESULTS ####\n")
     # sensitivity, specificity, ppv, npv
-    out_txt += ' '.join(["{}: {}".format(k, v)
-                         for k, v in full_matrix.iteritems()]) + '\n'
+    out.write(' '.join(["{}: {}".format(k, full_matrix[k])
+                        for k in MATRIX_FIELDS]) + '\n')
     # conf matrix rates (e.g. TP / total number of aa)
-    total = float(sum(full_matrix.values()))
-    rates = {key + 'r': val / total for key, val in full_matrix.iteritems()}
-    out_txt += ' '.join(["%s: %.3f" % (k, v)
-                         for k, v in rates.iteritems()]) + '\n'
+    out.write(' '.join(["%s: %.3f" % (k + 'r', summary['rates'][k + 'r'])
+                        for k in MATRIX_FIELDS]) + '\n')
     # FP, TP, FN, TN values
-    full_stats = calc_stats({'full': full_matrix})['full']
-    out_txt += ''.join(["{}: {}\n".format(k, v)
-                        for k, v in full_stats.iteritems()]) + '\n'
+    out.write(''.join(["{}: {}\n".format(k, summary['full_stats'][k])
+                       for k in STAT_FIELDS]) + '\n')
 
-    out_txt += 'aligned templates: {}\n'.format(tmpl_no)
+    out.write('aligned templates: {}\n'.format(summary['aligned_templates']))
     # average SP score
-    sp_score = sum(sp_scores.values()) / len(sp_scores)
-    out_txt += "SP score: {}\n".format(sp_score)
-    _log.debug("Overall SP score: %f", sp_score)
-    _log.debug("Conf matrix: %s", str(full_matrix))
+    out.write("SP score: {}\n".format(summary['sp_score']))
+    # bootstrap confidence intervals (process_results with bootstrap)
+    intervals = summary.get('confidence_intervals')
+    if intervals:
+        for stat in BOOTSTRAP_STATS:
+            out.write("{} {:g}% CI: {}\n".format(
+                stat, summary['confidence'] * 100,
+                ' '.join(map(str, intervals[stat] or [None, None]))))
 
-    # PAIRWISE stats
-    stats = calc_stats(matrices)
-    for s_id, s in stats.iteritems():
-        header = s_id if (s_id is str) else ' '.join(list(s_id))
-        out_txt += "# {}\n".format(header)
+
+def render_txt_pairs(out, pairs):
+    """
+    The text report: PAIRWISE stats
+    """
+    for pair in pairs:
+        out.write("# {}\n".format(' '.join(pair['ids'])))
         # sensitivity, specificity, ppv, npv
-        out_txt += ' '.join(["{}: {}".format(k, v)
-                             for k, v in matrices[s_id].iteritems()]) + '\n'
+        out.write(' '.join(["{}: {}".format(k, pair['matrix'][k])
+                            for k in MATRIX_FIELDS]) + '\n')
         # FP, TP, FN, TN values
-        out_txt += ''.join(["{}: {}\n".format(k, v)
-                            for k, v in s.iteritems()]) + '\n'
+        out.write(''.join(["{}: {}\n".format(k, pair['stats'][k])
+                           for k in STAT_FIELDS]) + '\n')
         # SP score
-        out_txt += "SP score: {}\n".format(sp_scores[s_id])
+        out.write("SP score: {}\n".format(pair['sp_score']))
+
+
+def get_flat_record(record_type, matrix, stats, sp_score):
+    result = {'type': record_type, 'sp_score': sp_score}
+    result.update((field, matrix[field]) for field in MATRIX_FIELDS)
+    result.update(stats)
+    return result
+
 
-    with open(output, 'w') as out:
-        out.write(out_txt)
-    _log.info("Created the output file: %s", output)
-    return {
+def render_jsonl_summary(out, summary):
+    """
+    JSON Lines: the first line is the summary of the whole alignment
+    """
+    record = get_flat_record('summary', summary['full_matrix'],
+                             summary['full_stats'], summary['sp_score'])
+    record['aligned_templates'] = summary['aligned_templates']
+    if summary.get('confidence_intervals'):
+        record['confidence'] = summary['confidence']
+        record['confidence_intervals'] = summary['confidence_intervals']
+    out.write(json.dumps(record) + '\n')
+
+
+def render_jsonl_pairs(out, pairs):
+    """
+    JSON Lines: one line per pair
+    """
+    for pair in pairs:
+        record = get_flat_record('pair', pair['matrix'], pair['stats'],
+                                 pair['sp_score'])
+        record['ids'] = pair['ids']
+        out.write(json.dumps(record) + '\n')
+
+
+def get_csv_value(value):
+    if value is None:
+        return ""
+    elif isinstance(value, float):
+        # str() of a float is rounded to 12 digits in Python 2
+        return repr(float(value))
+    return str(value)
+
+
+def get_csv_row(ids, matrix, stats, sp_score):
+    ids = (list(ids) + ["", ""])[:2]
+    return ids + [get_csv_value(v) for v in
+                  [matrix[f] for f in MATRIX_FIELDS] +
+                  [stats[f] for f in STAT_FIELDS] + [sp_score]]
+
+
+def render_csv_summary(out, summary):
+    """
+    CSV with a row per pair (CSV_COLUMNS), the first row (ids 'full') is the
+    whole alignment
+    """
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    writer.writerow(get_csv_row(['full'], summary['full_matrix'],
+                                summary['full_stats'], summary['sp_score']))
+
+
+def render_csv_pairs(out, pairs):
+    writer = csv.writer(out, lineterminator='\n')
+    for pair in pairs:
+        writer.writerow(get_csv_row(pair['ids'], pair['matrix'],
+                                    pair['stats'], pair['sp_score']))
+
+
+def render_npz(out, summary, ids, matrices, sp_scores):
+    """
+    NPZ with the arrays of all pairs: 'pairs' (ids separated by a space),
+    'matrices' (columns in the order of MATRIX_FIELDS), 'stats'
+    (calc_stats_array), 'sp_scores' and the same for the whole alignment
+    ('full_matrix', 'full_stats', 'sp_score', 'aligned_templates')
+    """
+    matrices = np.array(matrices, dtype=np.int64).reshape(
+        len(ids), len(MATRIX_FIELDS))
+    full_matrix = matrices_to_array({'full': summary['full_matrix']},
+                                    ['full'])
+    np.savez_compressed(
+        out,
+        pairs=np.array(ids, dtype=str),
+        matrices=matrices,
+        stats=calc_stats_array(matrices),
+        sp_scores=np.array(sp_scores, dtype=np.float64),
+        full_matrix=full_matrix[0],
+        full_stats=calc_stats_array(full_matrix)[0],
+        sp_score=summary['sp_score'],
+        aligned_templates=summary['aligned_templates'])
+
+
+# the text formats, the summary is written first and the pairs after it
+SUMMARY_RENDERERS = {
+    'txt': render_txt_summary,
+    'jsonl': render_jsonl_summary,
+    'csv': render_csv_summary
+}
+PAIR_RENDERERS = {
+    'txt': render_txt_pairs,
+    'jsonl': render_jsonl_pairs,
+    'csv': render_csv_pairs
+}
+
+
+class ResultWriter(object):
+    """
+    Writes the result files, the pairs are written as they're scored (see
+    the on_pairs argument of aln_analyzer.calc_scores_3dm) and the summary
+    of the whole alignment when scoring has finished
+
+    The pairs of the text formats go to temporary files which are copied
+    after the summary (which comes first in every format) by finish, the
+    npz arrays are collected as lists of numbers.
+
+    :param formats: RESULT_FORMATS to write (the text report if None)
+    :param compression: compression of the jsonl and csv files (see
+        file_utils.open_output)
+    """
+    def __init__(self, output, formats=None, compression=None):
+        self.output = output
+        self.formats = formats or ['txt']
+        self.compression = compression
+        self.spools = {result_format: tempfile.TemporaryFile()
+                       for result_format in self.formats
+                       if result_format in PAIR_RENDERERS}
+        self.npz_pairs = {'ids': [], 'matrices': [], 'sp_scores': []}
+
+    def write_pairs(self, matrices, sp_scores):
+        """
+        Write the results of scored pairs, in the order of their sorted ids
+        (calc_scores_3dm hands over the pairs in chunks of this order)
+
+        :param matrices: {pair: confusion matrix}
+        :param sp_scores: {pair: SP score}
+        """
+        # in the order of the sorted ids, the order of a dict of a chunk
+        # depends on where it was built
+        m_ids = sorted(matrices, key=sorted)
+        stats = calc_stats_array(matrices_to_array(matrices, m_ids))
+        for result_format, spool in self.spools.iteritems():
+            PAIR_RENDERERS[result_format](
+                spool, iter_pair_records(matrices, m_ids, stats, sp_scores))
+        if 'npz' in self.formats:
+            for m_id in m_ids:
+                self.npz_pairs['ids'].append(' '.join(sorted(m_id)))
+                self.npz_pairs['matrices'].append(
+                    [matrices[m_id][f] for f in MATRIX_FIELDS])
+                self.npz_pairs['sp_scores'].append(sp_scores[m_id])
+
+    def finish(self, summary):
+        """
+        Write the result files (the summary and the pairs written so far)
+        """
+        try:
+            for result_format in self.formats:
+                self._write_file(result_format, summary)
+        finally:
+            self.close()
+
+    def _write_file(self, result_format, summary):
+        path = self.output + RESULT_SUFFIXES[result_format]
+        if result_format in COMPRESSED_FORMATS:
+            result_file = open_output(path, self.compression)
+            path = get_output_path(path, self.compression)
+        else:
+            result_file = atomic_write(
+                path, 'wb' if result_format == 'npz' else 'w')
+        with result_file as out:
+            if result_format == 'npz':
+                render_npz(out, summary, **self.npz_pairs)
+            else:
+                SUMMARY_RENDERERS[result_format](out, summary)
+                spool = self.spools[result_format]
+                spool.seek(0)
+                shutil.copyfileobj(spool, out)
+        _log.info("Created the output file: %s", path)
+
+    def close(self):
+        for spool in self.spools.itervalues():
+            spool.close()
+
+
+def process_results(matrices, full_matrix, sp_scores, output, tmpl_no,
+                    formats=None, compression=None, bootstrap=None,
+                    confidence=0.95, writer=None):
+    """
+    Calculate stats of the confusion matrices and write the result files
+
+    :param formats: RESULT_FORMATS to write (the text report if None)
+    :param compression: compression of the jsonl and csv files (see
+        file_utils.open_output)
+    :param bootstrap: number of bootstrap resamples of the pairs, the
+        confidence intervals (see bootstrap_intervals) are added to the
+        result, the text report and the jsonl summary (not calculated if
+        None)
+    :param writer: ResultWriter the pairs were written to while they were
+        scored (formats and compression are not used then), the pairs are
+        written here if it's None
+    """
+    _log.info("Processing the results")
+    if writer is None:
+        writer = ResultWriter(output, formats, compression)
+        writer.write_pairs(matrices, sp_scores)
+
+    _log.info("Calculating stats")
+    full_stats = stats_to_dict(calc_stats_array(
+        matrices_to_array({'full': full_matrix}, ['full']))[0])
+    total = float(sum(full_matrix.values()))
+    sp_score = sum(sp_scores.values()) / len(sp_scores)
+    _log.debug("Overall SP score: %f", sp_score)
+    _log.debug("Conf matrix: %s", str(full_matrix))
+    summary = {
+        'full_matrix': full_matrix,
+        'rates': {key + 'r': val / total
+                  for key, val in full_matrix.iteritems()},
+        'full_stats': full_stats,
+        'aligned_templates': tmpl_no,
+        'sp_score': sp_score
+    }
+    result = {
         "full_stats": full_stats,
-        "full_matrix": full_matrix
+        "full_matrix": full_matrix,
+        "sp_score": sp_score
     }
+    if bootstrap:
+        _log.info("Calculating bootstrap confidence intervals")
+        m_ids = list(matrices)
+        intervals = bootstrap_intervals(
+            matrices_to_array(matrices, m_ids),
+            [sp_scores[m_id] for m_id in m_ids], bootstrap, confidence)
+        summary['confidence'] = confidence
+        summary['confidence_intervals'] = intervals
+        result['confidence'] = confidence
+        result['confidence_intervals'] = intervals
+
+    writer.finish(summary)
+    return result
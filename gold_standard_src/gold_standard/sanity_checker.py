@@ -9,10 +9,14 @@ def check_pairwise_score_3dm(sequences, var_regs, result, id1, id2):
                 var_regs[id2] if x != '-']
     _log.debug("%s %s", id1, id2)
     _log.debug(result['matrix'])
-    if len(res_only) != sum(result['matrix'].values()):
+    check_residue_count(len(res_only), result['matrix'])
+
+
+def check_residue_count(res_count, matrix):
+    if res_count != sum(matrix.values()):
         raise Exception("Sum of values in the confusion matrix({}) should be "
                         "equal to the total number of residues({})".format(
-                            len(res_only), sum(result['matrix'].values())))
+                            res_count, sum(matrix.values())))
 
 
 def check_pairwise_score(seq1, seq2, matrix):
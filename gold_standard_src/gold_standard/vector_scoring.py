@@ -0,0 +1,325 @@
+"""
+Vectorized (numpy) scoring of grounded alignments in the 3DM mode
+
+Same results as aln_analyzer.calc_pairwise_score_3dm (which is kept as the
+reference implementation) but all columns of a pair are scored at once with
+array masks. Grounded sequences are int32 arrays with 0 on gap positions.
+"""
+import logging
+
+import numpy as np
+
+from .gold_index import get_gold_index, grounded_to_array
+from .pair_store import CONFUSION_KEYS, PairArray
+from .sanity_checker import check_residue_count
+
+
+_log = logging.getLogger(__name__)
+
+
+def get_gold_aligned(gold_arrays, residues, query_id, id2, multi):
+    """
+    Vectorized GoldIndex.get_aligned_res
+
+    :param residues: int array of residue numbers from sequence query_id
+        (no gaps)
+    :return: int array of residues from id2 aligned with them in the gold
+        alignment (0 if not aligned)
+    """
+    columns = gold_arrays['columns'][query_id]
+    in_range = residues < len(columns)
+    cols = np.full(len(residues), -1, dtype=np.int32)
+    cols[in_range] = columns[residues[in_range]]
+    missing = cols < 0
+    if missing.any():
+        if not multi:
+            raise ValueError("{} is not in list".format(
+                residues[missing][0]))
+        var_mask = gold_arrays['var'][query_id]
+        in_var = np.zeros(len(residues), dtype=bool)
+        in_var[in_range] = var_mask[residues[in_range]]
+        not_found = missing & ~in_var
+        if not_found.any():
+            raise Exception("Residue {} from sequence {} is not present in "
+                            "the gold alignment".format(
+                                residues[not_found][0], query_id))
+    aligned = np.zeros(len(residues), dtype=np.int32)
+    aligned[~missing] = gold_arrays['cores'][id2][cols[~missing]]
+    return aligned
+
+
+def get_max_sp_score_np(gold_arrays, id1, id2, multi):
+    """
+    Vectorized aln_analyzer.get_max_sp_score - each residue in gold cores
+    (and var regions in the multi mode) is worth one point
+    """
+    score = (np.count_nonzero(gold_arrays['cores'][id1]) +
+             np.count_nonzero(gold_arrays['cores'][id2]))
+    if multi:
+        score += (np.count_nonzero(gold_arrays['var'][id1]) +
+                  np.count_nonzero(gold_arrays['var'][id2]))
+    return int(score)
+
+
+def score_pair_arrays(gold_index, id1, id2, seq1, seq2, var1, var2, multi):
+    """
+    Score one pair of grounded sequences (int32 arrays) against the gold
+    alignment
+
+    :param var1: int array of the var region residues of seq1
+    :return: per-column wrong mask, confusion matrix, unnormalized SP score
+    """
+    gold_arrays = gold_index.arrays()
+    res1 = seq1 != 0
+    res2 = seq2 != 0
+
+    # residue of the other sequence aligned in gold with each residue in
+    # the test alignment
+    gold2 = np.zeros(len(seq1), dtype=np.int32)
+    gold2[res1] = get_gold_aligned(gold_arrays, seq1[res1], id1, id2, multi)
+    gold1 = np.zeros(len(seq2), dtype=np.int32)
+    gold1[res2] = get_gold_aligned(gold_arrays, seq2[res2], id2, id1, multi)
+
+    both = res1 & res2
+    only1 = res1 & ~res2
+    only2 = res2 & ~res1
+    correct = both & (seq2 == gold2)
+    incorrect = both & ~correct
+    tn1 = only1 & (gold2 == 0)
+    tn2 = only2 & (gold1 == 0)
+    fn_cols = (only1 & ~tn1) | (only2 & ~tn2)
+
+    tp = 2 * int(np.count_nonzero(correct))
+    fp = 2 * int(np.count_nonzero(incorrect))
+    tn = int(np.count_nonzero(tn1)) + int(np.count_nonzero(tn2))
+    fn = int(np.count_nonzero(fn_cols))
+    sp_score = tp - fp + tn
+
+    # variable regions
+    for var_res, query_id, other_id in [(var1, id1, id2), (var2, id2, id1)]:
+        aligned = get_gold_aligned(gold_arrays, var_res, query_id, other_id,
+                                   multi)
+        var_fn = int(np.count_nonzero(aligned))
+        fn += var_fn
+        tn += len(var_res) - var_fn
+
+    matrix = {"TP": tp, "FP": fp, "FN": fn, "TN": tn}
+    return incorrect | fn_cols, matrix, sp_score
+
+
+def calc_pairwise_score_3dm_np(golden_aln, sequences, var_regs, multi):
+    """
+    Vectorized aln_analyzer.calc_pairwise_score_3dm, takes and returns the
+    same data structures
+    """
+    id1, id2 = sequences.keys()
+    seq1 = grounded_to_array(sequences[id1])
+    seq2 = grounded_to_array(sequences[id2])
+    if len(seq1) != len(seq2):
+        raise Exception("Aligned sequences {} and {} ({} and {}) are not of "
+                        "the same length: {} and {}".format(
+                            id1, id2, sequences[id1], sequences[id2],
+                            len(seq1), len(seq2)))
+    var1 = np.array(var_regs[id1], dtype=np.int32)
+    var2 = np.array(var_regs[id2], dtype=np.int32)
+    gold_index = get_gold_index(golden_aln, multi)
+    return calc_pairwise_score_arrays(gold_index, id1, id2, seq1, seq2, var1,
+                                      var2, multi)
+
+
+def calc_pairwise_score_arrays(gold_index, id1, id2, seq1, seq2, var1, var2,
+                               multi):
+    """
+    calc_pairwise_score_3dm_np for sequences already converted to arrays
+    """
+    wrong, matrix, sp_score = score_pair_counts(
+        gold_index, id1, id2, seq1, seq2, var1, var2, multi)
+    wrong_cols = wrong_cols_to_dict(wrong)
+    return {
+        "matrix": matrix,
+        "sp_score": sp_score,
+        "wrong_cols": {id1: wrong_cols, id2: dict(wrong_cols)}
+    }
+
+
+def score_pair_counts(gold_index, id1, id2, seq1, seq2, var1, var2, multi):
+    """
+    Score a pair of sequences converted to arrays, without building dicts
+    of wrong columns
+
+    :return: (bool array of wrong columns, confusion matrix, sp score)
+    """
+    wrong, matrix, sp_score = score_pair_arrays(
+        gold_index, id1, id2, seq1, seq2, var1, var2, multi)
+
+    # check output sanity
+    check_residue_count(np.count_nonzero(seq1) + np.count_nonzero(seq2) +
+                        len(var1) + len(var2), matrix)
+
+    sp_max = get_max_sp_score_np(gold_index.arrays(), id1, id2, multi)
+    return wrong, matrix, float(sp_score) / sp_max
+
+
+def wrong_cols_to_dict(counts):
+    """
+    Convert an array with the number of wrong pairs in each column to the
+    {column: count} dict (only wrong columns) used by the html and json
+    output
+    """
+    return {int(j): int(counts[j]) for j in np.flatnonzero(counts)}
+
+
+def get_gold_columns(gold_arrays, residues, seq_id, var_col):
+    """
+    Vectorized lookup of gold columns of residues from sequence seq_id (multi
+    mode), residues from the gold var regions get column var_col
+
+    :param residues: int array of residue numbers (0 - gap)
+    :return: int array of gold columns, -1 on gap positions
+    """
+    columns = gold_arrays['columns'][seq_id]
+    var_mask = gold_arrays['var'][seq_id]
+    has_res = residues != 0
+    in_range = residues < len(columns)
+    cols = np.full(len(residues), -1, dtype=np.int32)
+    cols[in_range] = columns[residues[in_range]]
+    in_var = np.zeros(len(residues), dtype=bool)
+    in_var[in_range] = var_mask[residues[in_range]]
+    in_var &= cols < 0
+    not_found = has_res & (cols < 0) & ~in_var
+    if not_found.any():
+        raise Exception("Residue {} from sequence {} is not present in "
+                        "the gold alignment".format(residues[not_found][0],
+                                                    seq_id))
+    cols[in_var] = var_col
+    return cols
+
+
+def calc_scores_3dm_batched(gold_index, test_aln, target_only=False,
+                            target_id=None, max_block_size=4000000):
+    """
+    Score all pairs of sequences against one (multi) gold alignment in one
+    batched computation
+
+    Test residues are mapped through the gold index to an N x L matrix of
+    gold columns, then for each block of columns the gold residues aligned
+    to them are compared with the test alignment for all N x N pairs at once.
+
+    :param max_block_size: max number of elements in the N x N x columns
+        arrays created for a block of columns
+    :return: same as aln_analyzer.calc_scores_3dm
+    """
+    gold_arrays = gold_index.arrays()
+    ids = test_aln["cores"].keys()
+    n = len(ids)
+    result = {
+        'pairwise': PairArray(ids, fields=CONFUSION_KEYS, dtype=np.int64),
+        'full': {'TP': 0, 'FP': 0, 'TN': 0, 'FN': 0},
+        'sp_scores': PairArray(ids),
+        'wrong_cols': {seq_id: {} for seq_id in ids}
+    }
+    if n < 2:
+        return result
+
+    aln_len = len(test_aln["cores"][ids[0]])
+    for seq_id in ids[1:]:
+        if len(test_aln["cores"][seq_id]) != aln_len:
+            raise Exception("Aligned sequences {} and {} ({} and {}) are not "
+                            "of the same length: {} and {}".format(
+                                ids[0], seq_id, test_aln["cores"][ids[0]],
+                                test_aln["cores"][seq_id], aln_len,
+                                len(test_aln["cores"][seq_id])))
+
+    # gold cores with an extra gap column, used as the 'gold column' of
+    # residues that are in the gold var regions
+    gold_len = len(gold_arrays['cores'][ids[0]])
+    gold = np.zeros((n, gold_len + 1), dtype=np.int32)
+    test = np.zeros((n, aln_len), dtype=np.int32)
+    cols = np.zeros((n, aln_len), dtype=np.int32)
+    for a, seq_id in enumerate(ids):
+        gold[a, :gold_len] = gold_arrays['cores'][seq_id]
+        test[a] = grounded_to_array(test_aln["cores"][seq_id])
+        cols[a] = get_gold_columns(gold_arrays, test[a], seq_id, gold_len)
+    has_res = test != 0
+
+    # pairs to score, [b, a]
+    pair_mask = ~np.eye(n, dtype=bool)
+    if target_only:
+        is_target = np.array([seq_id == target_id for seq_id in ids])
+        pair_mask &= is_target[:, None] | is_target[None, :]
+
+    tp = np.zeros((n, n), dtype=np.int64)
+    fp = np.zeros((n, n), dtype=np.int64)
+    # columns where only sequence a has a residue
+    tn_a = np.zeros((n, n), dtype=np.int64)
+    fn_a = np.zeros((n, n), dtype=np.int64)
+    wrong_cols = np.zeros((n, aln_len), dtype=np.int64)
+
+    block_size = max(1, max_block_size // (n * n))
+    for start in xrange(0, aln_len, block_size):
+        block = slice(start, start + block_size)
+        # aligned[b, a, j] - residue from b aligned in gold with the residue
+        # from a in column j of the test alignment
+        aligned = gold[:, np.where(cols[:, block] < 0, gold_len,
+                                   cols[:, block])]
+        res_a = has_res[None, :, block]
+        res_b = has_res[:, None, block]
+        match = aligned == test[:, None, block]
+        both = res_a & res_b
+        incorrect = both & ~match
+        only_a = res_a & ~res_b
+        only_a_fn = only_a & (aligned != 0)
+
+        tp += np.count_nonzero(both & match, axis=2)
+        fp += np.count_nonzero(incorrect, axis=2)
+        tn_a += np.count_nonzero(only_a & (aligned == 0), axis=2)
+        fn_a += np.count_nonzero(only_a_fn, axis=2)
+
+        wrong = incorrect | only_a_fn | only_a_fn.transpose(1, 0, 2)
+        wrong &= pair_mask[:, :, None]
+        wrong_cols[:, block] += np.count_nonzero(wrong, axis=0)
+
+    # variable regions of the test alignment
+    tn_var = np.zeros((n, n), dtype=np.int64)
+    fn_var = np.zeros((n, n), dtype=np.int64)
+    var_len = np.zeros(n, dtype=np.int64)
+    for a, seq_id in enumerate(ids):
+        var_res = grounded_to_array(test_aln["var"][seq_id])
+        var_len[a] = len(var_res)
+        var_cols = get_gold_columns(gold_arrays, var_res, seq_id, gold_len)
+        fn_var[:, a] = np.count_nonzero(gold[:, var_cols], axis=1)
+        tn_var[:, a] = len(var_res) - fn_var[:, a]
+
+    tn_core = tn_a + tn_a.T
+    matrices = {
+        'TP': 2 * tp,
+        'FP': 2 * fp,
+        'TN': tn_core + tn_var + tn_var.T,
+        'FN': fn_a + fn_a.T + fn_var + fn_var.T
+    }
+    sp = matrices['TP'] - matrices['FP'] + tn_core
+
+    # check output sanity
+    res_count = np.count_nonzero(has_res, axis=1) + var_len
+    pair_res_count = res_count[:, None] + res_count[None, :]
+    matrix_sum = sum(matrices.values())
+    wrong_sum = pair_mask & (pair_res_count != matrix_sum)
+    if wrong_sum.any():
+        b, a = np.argwhere(wrong_sum)[0]
+        check_residue_count(pair_res_count[b, a],
+                            {key: m[b, a] for key, m in matrices.iteritems()})
+
+    gold_count = (np.count_nonzero(gold, axis=1) +
+                  np.array([np.count_nonzero(gold_arrays['var'][seq_id])
+                            for seq_id in ids]))
+    sp_max = gold_count[:, None] + gold_count[None, :]
+    result['pairwise'].set_square(
+        np.dstack([matrices[key] for key in CONFUSION_KEYS]), pair_mask)
+    result['sp_scores'].set_square(sp / sp_max.astype(float), pair_mask)
+    lower_mask = np.tril(pair_mask, -1)
+    for key, m in matrices.iteritems():
+        result['full'][key] = int(m[lower_mask].sum())
+
+    for a, seq_id in enumerate(ids):
+        result['wrong_cols'][seq_id] = wrong_cols_to_dict(wrong_cols[a])
+    return result
@@ -1,97 +1,211 @@
 """
+Summarize the results of many runs in one csv table
+
 Input format:
 
 program, parameters, results paths
+
+A results path is the output path of calc_alignment_quality.py, the results
+are read from output.jsonl (--results jsonl, possibly compressed) or, for
+older runs, from the text report. Files are read in parallel (--jobs), the
+aligned templates are collected while reading, so they're counted without
+reading the files again.
+
+For every program the table has a row per metric with the values of all
+batches, their mean and standard deviation; the last rows are the means of
+every batch over all programs.
 """
 import argparse
-import re
-from sys import argv
-
-
-def parse_files(paths):
-    results = {}
-    uniq_tmpls = set()
-    for batch, p in enumerate(paths):
-        with open(p) as a:
-            result_lines = a.read().replace(', ', ',').splitlines()[3:]
-        # get unique aligned templates:
-        for l in result_lines:
-            if l.startswith("# "):
-                uniq_tmpls.add(l.split()[1])
-                uniq_tmpls.add(l.split()[2])
-
-        results[batch] = {
-            'sensitivity': result_lines[0].split(":")[1],
-            'specificity': result_lines[4].split(":")[1],
-            'mcc': result_lines[2].split(":")[1],
-            'npv': result_lines[1].split(":")[1],
-            'ppv': result_lines[3].split(":")[1],
-            'aligned templates': result_lines[6].split(":")[1]
-        }
-    return results, uniq_tmpls
-
-
-def get_string(s):
-    int_float_reg = r'^(?=.*\d)\d*(?:\.\d+)?$'
-    reg = re.compile(int_float_reg)
-    if isinstance(s, float):
-        return "%.2f" % s
-    elif isinstance(s, int):
-        return str(s)
-    elif reg.match(s.replace(' ', '')):
-        return "%.2f" % float(s)
-    else:
-        return s
-
-
-def get_line(values, key):
-    newline = ["", "", key]
-    for i in values:
-        newline.append(values[i][key])
-    return newline
-
-
-def convert_to_csv(inpath, outpath):
+import csv
+import json
+import logging
+import os
+
+import numpy as np
+
+from gold_standard.file_utils import (COMPRESSIONS, atomic_write,
+                                      get_output_path, open_input)
+from gold_standard.parallel import chunk_by_cost, pool_map
+
+
+_log = logging.getLogger(__name__)
+
+METRICS = ['sensitivity', 'specificity', 'ppv', 'npv', 'mcc', 'sp_score',
+           'aligned_templates']
+# metric names in the text report
+TEXT_KEYS = {
+    'aligned templates': 'aligned_templates',
+    'SP score': 'sp_score'
+}
+
+
+def parse_input(inpath):
+    """
+    :return: list of (program, parameters, list of results paths)
+    """
+    runs = []
     with open(inpath) as a:
-        filedata = []
-        for i in a.read().splitlines():
-            filedata.append((i.split(',')[0], i.replace(', ', ',').split(",")))
-
-    header = "program, transition modifiers, results, batch 1, batch 2, batch 3, batch 4, averages, total aligned templates"
-    csv_lines = [header]
-    for program, info in filedata:
-        paths = info[2:]
-        batches_no = len(paths)
-        program = info[0]
-        params = info[1]
-
-        r, uniq_tmpls = parse_files(paths)
-        newlines = [
-            get_line(r, "sensitivity"),
-            get_line(r, "specificity"),
-            get_line(r, "ppv"),
-            get_line(r, "npv"),
-            get_line(r, "mcc"),
-            get_line(r, "aligned templates")
-        ]
-        for i in range(len(newlines)):
-            av = sum(map(float, newlines[i][3:])) / batches_no
-            newlines[i].append(av)
-        newlines = map(lambda x: map(get_string, x), newlines)
-        newlines = map(lambda x: ",".join(x), newlines)
-
-        first_line = "{},{},,,,,,,{}".format(program, params, len(uniq_tmpls))
-        new_lines = [first_line] + newlines
-        csv_lines.extend(new_lines)
-
-    with open(outpath, 'w') as o:
-        o.write("\n".join(csv_lines))
+        for line in a.read().splitlines():
+            if not line.strip():
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            runs.append((fields[0], fields[1], fields[2:]))
+    return runs
+
+
+def find_jsonl(path):
+    """
+    The JSON Lines results of an output path (None if there are none)
+    """
+    if path.endswith('.jsonl') and os.path.exists(path):
+        return path
+    for compression in [None] + sorted(COMPRESSIONS):
+        jsonl_path = get_output_path(path + '.jsonl', compression)
+        if os.path.exists(jsonl_path):
+            return jsonl_path
+    return None
+
+
+def read_jsonl_result(path):
+    stats = {}
+    templates = set()
+    with open_input(path) as a:
+        for line in a:
+            record = json.loads(line)
+            if record['type'] == 'summary':
+                stats = {metric: record.get(metric) for metric in METRICS}
+            else:
+                templates.update(record['ids'])
+    return {'stats': stats, 'templates': templates}
+
+
+def read_text_result(path):
+    """
+    Read the text report (process_results), values of the whole alignment
+    are the 'key: value' lines before the first pair
+    """
+    stats = {}
+    templates = set()
+    with open_input(path) as a:
+        in_header = True
+        for line in a:
+            if line.startswith("# "):
+                in_header = False
+                templates.update(line.split()[1:])
+            elif in_header and line.count(':') == 1:
+                key, value = [x.strip() for x in line.split(':')]
+                key = TEXT_KEYS.get(key, key)
+                if key in METRICS:
+                    stats[key] = None if value == 'None' else float(value)
+    return {'stats': stats, 'templates': templates}
+
+
+def read_result(path):
+    jsonl_path = find_jsonl(path)
+    if jsonl_path is not None:
+        return read_jsonl_result(jsonl_path)
+    return read_text_result(path)
+
+
+def _read_chunk(chunk):
+    return [(path, read_result(path)) for path in chunk]
+
+
+def read_results(paths, jobs=1):
+    """
+    Read the results of all paths (in 'jobs' processes)
+
+    :return: dict {path: {'stats': {metric: value}, 'templates': set}}
+    """
+    paths = sorted(set(paths))
+    sizes = [os.path.getsize(p) if os.path.exists(p) else 0 for p in paths]
+    chunks = chunk_by_cost(paths, sizes, jobs * 4)
+    return dict(item for chunk_results in
+                pool_map(_read_chunk, chunks, jobs, {})
+                for item in chunk_results)
+
+
+def get_values_array(runs, results):
+    """
+    :return: array (programs x metrics x batches) of the values, NaN where a
+        value is missing (undefined stat or fewer batches)
+    """
+    batches_no = max([len(paths) for _, _, paths in runs] or [0])
+    values = np.full((len(runs), len(METRICS), batches_no), np.nan)
+    for i, (_, _, paths) in enumerate(runs):
+        for j, path in enumerate(paths):
+            stats = results[path]['stats']
+            values[i, :, j] = [np.nan if stats.get(metric) is None
+                               else stats[metric] for metric in METRICS]
+    return values
+
+
+def nan_mean_std(values, axis):
+    """
+    Mean and (population) standard deviation ignoring NaN values, NaN if all
+    values are NaN
+    """
+    defined = ~np.isnan(values)
+    counts = defined.sum(axis=axis)
+    zeroed = np.where(defined, values, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = zeroed.sum(axis=axis) / counts
+        deviations = np.where(defined, values - np.expand_dims(means, axis), 0)
+        stds = np.sqrt((deviations ** 2).sum(axis=axis) / counts)
+    return means, stds
+
+
+def get_string(value):
+    if np.isnan(value):
+        return ""
+    return "%.2f" % value
+
+
+def convert_to_csv(inpath, outpath, jobs=1):
+    runs = parse_input(inpath)
+    results = read_results([p for _, _, paths in runs for p in paths], jobs)
+    values = get_values_array(runs, results)
+    batches_no = values.shape[2]
+    # per program over the batches, per batch over the programs
+    program_means, program_stds = nan_mean_std(values, axis=2)
+    batch_means, batch_stds = nan_mean_std(values, axis=0)
+
+    header = (["program", "transition modifiers", "results"] +
+              ["batch {}".format(i + 1) for i in range(batches_no)] +
+              ["average", "std", "total aligned templates"])
+    rows = [header]
+    for i, (program, params, paths) in enumerate(runs):
+        templates = set()
+        for path in paths:
+            templates.update(results[path]['templates'])
+        rows.append([program, params] + [""] * (batches_no + 3) +
+                    [str(len(templates))])
+        for m, metric in enumerate(METRICS):
+            rows.append(["", "", metric] +
+                        map(get_string, values[i, m]) +
+                        [get_string(program_means[i, m]),
+                         get_string(program_stds[i, m])])
+    rows.append(["all programs", ""] + [""] * (batches_no + 3) +
+                [str(len(set().union(*[r['templates']
+                                       for r in results.values()])))])
+    for m, metric in enumerate(METRICS):
+        rows.append(["", "", metric + " (mean)"] +
+                    map(get_string, batch_means[m]))
+        rows.append(["", "", metric + " (std)"] +
+                    map(get_string, batch_stds[m]))
+
+    with atomic_write(outpath) as o:
+        csv.writer(o, lineterminator='\n').writerows(rows)
+    _log.info("Created the summary file: %s", outpath)
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="")
+    parser = argparse.ArgumentParser(description="Summarize results of many "
+                                                 "runs in one csv table")
     parser.add_argument("inpath")
     parser.add_argument("outpath")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of processes reading the results")
     args = parser.parse_args()
 
-    convert_to_csv(args.inpath, args.outpath)
+    convert_to_csv(args.inpath, args.outpath, args.jobs)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from gold_standard_src.batch_alignment_quality import expand_test_paths, \
+    get_output_prefixes, run_batch
+
+
+TESTDATA = "gold_standard_src/tests/testdata/complex_scoring/"
+
+
+def test_expand_test_paths():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        list_path = os.path.join(tmp_dir, "alns.txt")
+        with open(list_path, 'w') as o:
+            o.write("# test alignments\n{0}dummy_test_aln_v2.txt\n\n"
+                    "{0}dummy_test_aln.txt\n".format(TESTDATA))
+        paths = expand_test_paths([TESTDATA + "dummy_test_aln*.txt",
+                                   "@" + list_path, "other.fasta"])
+        eq_(paths, [TESTDATA + "dummy_test_aln.txt",
+                    TESTDATA + "dummy_test_aln_v2.txt", "other.fasta"])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_get_output_prefixes():
+    eq_(get_output_prefixes(["a/aln.fasta", "b/aln.fasta", "c/aln2.fasta"],
+                            "out"),
+        ["out/aln.fasta_1", "out/aln.fasta_2", "out/aln2.fasta"])
+
+
+def test_run_batch_complex():
+    args = argparse.Namespace(
+        gold_dir=None, gold_path=TESTDATA + "dummy_gold_aln.json",
+        final_core=None, gold_json=True, gold_3ssp=False, multi=False,
+        input_format="3SSP", json=True, dont_fill=False, target_only=False,
+        html=False, html_var=False, html_var_short=False, html_pair=False,
+        debug=False, compiled_gold=None, compress=None, results=None,
+        bootstrap=None, confidence=0.95)
+    aln_paths = [TESTDATA + "dummy_test_aln.txt",
+                 TESTDATA + "dummy_test_aln_v2.txt",
+                 TESTDATA + "missing_aln.txt"]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        rows = run_batch(aln_paths, tmp_dir, args)
+        eq_([r['status'] for r in rows], ['ok', 'ok', 'error'])
+        eq_(rows[0]['overall_score'], 1.0)
+        ok_(abs(rows[1]['overall_score'] - 0.7142857) < 0.0001)
+        eq_(sorted(os.listdir(tmp_dir)),
+            ["dummy_test_aln.txt.json", "dummy_test_aln_v2.txt.json",
+             "summary.tsv"])
+        with open(os.path.join(tmp_dir, "summary.tsv")) as a:
+            lines = a.read().splitlines()
+        eq_(lines[0].split("\t"), ["test_alignment", "status",
+                                   "overall_score", "aligned_templates",
+                                   "output"])
+        eq_(len(lines), 4)
+    finally:
+        shutil.rmtree(tmp_dir)
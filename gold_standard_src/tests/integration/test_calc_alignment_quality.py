@@ -5,13 +5,13 @@ from gold_standard_src.calc_alignment_quality import calculate_aln_quality_simpl
 from gold_standard_src.gold_standard.html_handler import HtmlHandler
 
 
-@patch('gold_standard_src.gold_standard.parsers.fatcat.open', mock_open(
+@patch('gold_standard_src.gold_standard.parsers.fatcat.open_input', mock_open(
     read_data="ID11 A A-CDEF\nID12 B ABCGHI\nID13 C ACDFGH\n"),
        create=True)
-@patch('gold_standard_src.gold_standard.num_seq.open', mock_open(
+@patch('gold_standard_src.gold_standard.num_seq.open_input', mock_open(
     read_data="ID11A, 0 A-C 0 DEF 0\nID12B, 0 ABC 0 GHI 0\nID13C, "
     "0 ACD 0 FGH 0\n"), create=True)
-@patch('gold_standard_src.gold_standard.parsers.var_file.open', mock_open(
+@patch('gold_standard_src.gold_standard.parsers.var_file.open_input', mock_open(
     read_data="ID11A, 0 A-C 0 DEF 0\nID12B, 0 ABC 0 GHI 0\nID13C, "
     "0 ACD 0 FGH 0"), create=True)
 @patch('gold_standard_src.gold_standard.parsers.fasta.os.path.exists')
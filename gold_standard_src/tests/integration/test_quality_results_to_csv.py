@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from gold_standard_src.gold_standard.result_processor import process_results
+from gold_standard_src.quality_results_to_csv import convert_to_csv, \
+    read_result
+
+
+def _write_results(output, tp, formats):
+    fs = frozenset
+    matrices = {
+        fs(['A', 'B']): {"TP": tp, "FN": 2, "TN": 4, "FP": 2},
+        fs(['A', 'C']): {"TP": 1, "FN": 1, "TN": 5, "FP": 1}
+    }
+    full_matrix = {"TP": tp + 1, "FN": 3, "TN": 9, "FP": 3}
+    sp_scores = {fs(['A', 'B']): 0.5, fs(['A', 'C']): 1.0}
+    process_results(matrices, full_matrix, sp_scores, output, 3,
+                    formats=formats)
+
+
+def test_read_result():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        output = os.path.join(tmp_dir, "out")
+        _write_results(output, 2, ['txt', 'jsonl'])
+        from_jsonl = read_result(output)
+        os.remove(output + ".jsonl")
+        from_txt = read_result(output)
+        eq_(from_jsonl['templates'], set(['A', 'B', 'C']))
+        eq_(from_txt['templates'], set(['A', 'B', 'C']))
+        eq_(from_jsonl['stats']['aligned_templates'], 3)
+        eq_(from_txt['stats']['aligned_templates'], 3)
+        for metric in ['sensitivity', 'specificity', 'mcc', 'sp_score']:
+            eq_(round(from_jsonl['stats'][metric], 2),
+                round(from_txt['stats'][metric], 2))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_convert_to_csv():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(tmp_dir, "out{}".format(i)) for i in range(3)]
+        for i, path in enumerate(paths):
+            _write_results(path, i + 1, ['jsonl'])
+        inpath = os.path.join(tmp_dir, "runs.txt")
+        with open(inpath, 'w') as o:
+            o.write("prog1, p, {}, {}\nprog2, q, {}\n".format(*paths))
+        outpath = os.path.join(tmp_dir, "summary.csv")
+        convert_to_csv(inpath, outpath, jobs=2)
+        with open(outpath) as a:
+            lines = a.read().splitlines()
+        eq_(lines[0], "program,transition modifiers,results,batch 1,"
+                      "batch 2,average,std,total aligned templates")
+        eq_(lines[1], "prog1,p,,,,,,3")
+        # sensitivity 2/5 and 3/6
+        eq_(lines[2], ",,sensitivity,0.40,0.50,0.45,0.05")
+        eq_(lines[9], "prog2,q,,,,,,3")
+        # the second batch of prog2 is missing
+        eq_(lines[10], ",,sensitivity,0.57,,0.57,0.00")
+        eq_(lines[17], "all programs,,,,,,,3")
+        eq_(lines[18], ",,sensitivity (mean),0.49,0.50")
+        eq_(lines[19], ",,sensitivity (std),0.09,0.00")
+    finally:
+        shutil.rmtree(tmp_dir)
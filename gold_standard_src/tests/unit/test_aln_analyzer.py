@@ -2,6 +2,8 @@ from nose.tools import eq_, ok_
 
 import gold_standard_src.gold_standard.aln_analyzer as aa
 
+from gold_standard_src.gold_standard.complex_gold import ScoreTable
+
 from gold_standard_src.gold_standard.parsers.aln3SSP import parse_3SSP
 from gold_standard_src.gold_standard.num_seq import core_aln_to_num
 
@@ -278,3 +280,56 @@ def test_calc_scores_3dm_complex_multi_solutions():
     gold_alns_multi_sol_v2 = eval(g)
     result_v4 = aa.calc_scores_3dm_complex(gold_alns_multi_sol_v2, num_aln_dict)
     ok_(result_v3["overall_score"] < result_v4["overall_score"])
+
+
+def test_compare_complex_score_table():
+    gold_alns = {"1ABC": {"4": {"3": "m5", "4": "m5"}, "5": {"5": "b"}}}
+    test_aln = {"cores": {"TGT": [1, 2, 3, 4, 5],
+                          "1ABC": ['-', '-', '-', '-', 5]},
+                "var": {"1ABC": [4]}}
+    score_table = ScoreTable({"m5": 0.4, "b": 0.7})
+    # the score modifiers are used for the json alignments
+    result = aa.compare_cores_complex(gold_alns, "TGT", test_aln,
+                                      score_table=score_table)
+    eq_(result["overall_score"], 0.7)
+    result = aa.compare_vars_complex(gold_alns, "TGT", test_aln,
+                                     score_table=score_table)
+    eq_(result["overall_score"], -0.4)
+    eq_(aa.compare_vars_complex(gold_alns, "TGT", test_aln)["overall_score"],
+        -0.5)
+
+
+def test_get_residue_counts_complex():
+    core_scores = {
+        # found (score 0.5), misaligned and not aligned with the target
+        'A': {1: (True, 0.5), 2: (False, -1.0), 3: (False, None)}
+    }
+    var_scores = {'A': {4: (True, 0.0), 5: (False, -0.5)}}
+    max_scores = {'A': {'1': 1.0, '2': 1.0, '5': 0.5}}
+    counts, scores, res_max_scores = aa.get_residue_counts_complex(
+        core_scores, var_scores, max_scores, 1.0, True)
+    eq_(counts.tolist(), [[0.5, 0, 0, 0], [0, 1, 0, 0], [1, 0, 0, 0],
+                          [0, 0, 0, 1], [0, 0, 1, 0]])
+    eq_(scores.tolist(), [0.5, -1.0, 0, 0, -0.5])
+    eq_(res_max_scores.tolist(), [1.0, 1.0, 0, 0, 0.5])
+    _, scores, _ = aa.get_residue_counts_complex(
+        core_scores, var_scores, max_scores, 1.0, False)
+    eq_(scores.tolist(), [0.5, -1.0, 0, 0, 0])
+
+
+def test_calc_scores_3dm_complex_bootstrap():
+    with open("gold_standard_src/tests/testdata/complex_scoring/gold_alns_datadict.txt") as a:
+        gold_alns = eval(a.read())
+    full_seq = gold_alns["full_seq"]
+    for suffix in ["", "_v4", "_v5"]:
+        aln_path = "gold_standard_src/tests/testdata/complex_scoring/" \
+                   "tautomerase_final_core{}.txt".format(suffix)
+        aln_dict, strcts_order = parse_3SSP(aln_path)
+        num_aln_dict, _, _ = core_aln_to_num(
+                aln_dict, full_seq, golden_ids=gold_alns["ids"])
+        result = aa.calc_scores_3dm_complex(gold_alns, num_aln_dict,
+                                            bootstrap=200)
+        lower, upper = result["confidence_intervals"]["sp_score"]
+        # the score of every resample is between the min score and 1
+        ok_(-1 - 1e-9 <= lower <= result["overall_score"] + 1e-9)
+        ok_(result["overall_score"] - 1e-9 <= upper <= 1 + 1e-9)
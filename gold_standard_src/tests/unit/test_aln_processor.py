@@ -221,3 +221,14 @@ def test_make_master_seq_full():
     eq_(result_dict, expected)
 
 
+def test_column_plan():
+    columns, lowercase, _ = ap.make_remove_plan(6, [0, 3])
+    eq_(columns, [1, 2, 4, 5])
+    eq_(lowercase, {1, 2, 4})
+    columns, added = ap.make_fill_in_plan(columns, [(0, 'M'), (2, 'S'), (4, 'R'), (4, 'A')])
+    eq_(columns, [-1, 1, 2, -2, 4, 5, -3, -4])
+    eq_(added, ['M', 'S', 'R', 'A'])
+
+    aln_dict = {"M": "-PI-VL", "S": "QPIKVL"}
+    ap.apply_column_plan(aln_dict, (columns, lowercase, added), "M")
+    eq_(aln_dict, {"M": "MpiSvLRA", "S": "-pi-vL--"})
@@ -0,0 +1,79 @@
+import numpy as np
+from nose.tools import eq_, ok_, raises
+
+from gold_standard_src.gold_standard.complex_gold import CompiledGold, \
+    DEFAULT_SCORE_TABLE, ScoreTable, compile_gold_json
+
+
+GOLD = {
+    "1ABC": {
+        "1": {"1": "a"},
+        "2": {"*": "u"},
+        "4": {"3": "m5", "4": "m5"},
+        "5": {"5": "b"}
+    }
+}
+
+
+def test_compile_gold_json():
+    gold = compile_gold_json(GOLD)
+    ok_(isinstance(gold, CompiledGold))
+    ok_(compile_gold_json(gold) is gold)
+    seq = gold["1ABC"]
+    eq_(list(seq.indptr), [0, 0, 1, 2, 2, 4, 5])
+    eq_(list(seq.contains(np.array([1, 3, 5, 9]))),
+        [True, False, True, False])
+
+
+def test_match():
+    seq = compile_gold_json(GOLD)["1ABC"]
+    found, scores = seq.match(np.array([1, 2, 4, 5, 4]),
+                              np.array([1, 2, 4, 0, 5]))
+    eq_(list(found), [True, False, True, False, False])
+    eq_(list(scores), [1.0, 0.0, 0.5, 0.0, 0.0])
+
+
+@raises(KeyError)
+def test_match_missing_residue():
+    seq = compile_gold_json(GOLD)["1ABC"]
+    seq.match(np.array([1, 3]), np.array([1, 2]))
+
+
+def test_unaligned_penalties():
+    seq = compile_gold_json(GOLD)["1ABC"]
+    aligned, penalties = seq.unaligned_penalties(np.array([2, 3, 4, 5, 7]))
+    eq_(list(aligned), [False, False, True, True, False])
+    eq_(list(penalties), [0.0, 0.0, 0.5, 0.8, 0.0])
+
+
+def test_score_table():
+    table = ScoreTable({"a": 2, "c": 0.3, "m1": 0.15})
+    eq_(table["a"], 2.0)
+    eq_(table["b"], 0.8)
+    eq_(table["c"], 0.3)
+    eq_(table["m1"], 0.15)
+    # not in the score modifiers, relative to the full score
+    eq_(table["m5"], 1.0)
+    eq_(table.values[table.code("m5")], 1.0)
+
+
+@raises(KeyError)
+def test_score_table_unknown_category():
+    ScoreTable()["x"]
+
+
+def test_default_score_table():
+    codes = dict(DEFAULT_SCORE_TABLE.codes)
+    compile_gold_json(GOLD)
+    eq_(DEFAULT_SCORE_TABLE["m0"], 0.0)
+    # the codes of the mN categories are assigned when the table is built
+    eq_(DEFAULT_SCORE_TABLE.codes, codes)
+    eq_(len(DEFAULT_SCORE_TABLE.values), len(codes))
+
+
+def test_match_score_table():
+    seq = compile_gold_json(GOLD, ScoreTable({"m5": 0.4}))["1ABC"]
+    found, scores = seq.match(np.array([4, 5]), np.array([3, 5]))
+    eq_(list(scores), [0.4, 0.8])
+    aligned, penalties = seq.unaligned_penalties(np.array([4]))
+    eq_(list(penalties), [0.4])
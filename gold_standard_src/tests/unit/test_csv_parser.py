@@ -1,4 +1,8 @@
-from gold_standard_src.gold_standard.parsers.csv_parser import csv_corvar_to_num
+from mock import mock_open, patch
+from nose.tools import eq_
+
+from gold_standard_src.gold_standard.parsers.csv_parser import \
+    csv_corvar_to_num, parse_csv_alignment
 
 
 def test_csv_corvar_to_num():
@@ -348,3 +352,32 @@ def test_csv_corvar_to_num():
         "------------------------------------------------------------" \
         "---"
     csv_corvar_to_num(csv_corvar)
+
+
+def test_csv_corvar_to_num_values():
+    aa_seq, aln, core_indexes = csv_corvar_to_num("a- BC-D e0 F")
+    eq_(aa_seq, ['B', 'C', '-', 'D', 'F'])
+    eq_(aln['cores'], [2, 3, '-', 4, 6])
+    eq_(aln['var'], [1, 5])
+    eq_(aln['full'], "ABCDEF")
+    eq_(core_indexes, {0, 4})
+
+
+@patch('gold_standard_src.gold_standard.parsers.csv_parser.open_input',
+       mock_open(read_data='"proteinid","pdbid","chain","alnsequence"\n'
+                           '"1","1abc","A","a- BC-D e0 F"\n'
+                           '"2","2abc","B","- BC-D - G"\n'
+                           '"3","3abc","A","k BC-D - F"\n'))
+@patch('gold_standard_src.gold_standard.parsers.csv_parser.os.path.exists')
+def test_parse_csv_alignment(mock_path_exists):
+    mock_path_exists.return_value = True
+    aa_aln, num_aln, core_indexes = parse_csv_alignment(
+        "aln.csv", ["2ABCB", "3ABCA"])
+    eq_(aa_aln, {'2ABCB': ['B', 'C', '-', 'D', 'G'],
+                 '3ABCA': ['B', 'C', '-', 'D', 'F']})
+    eq_(num_aln, {
+        'cores': {'2ABCB': [1, 2, '-', 3, 4], '3ABCA': [2, 3, '-', 4, 5]},
+        'var': {'2ABCB': [], '3ABCA': [1]}
+    })
+    # from the first row, even if it's not a gold structure
+    eq_(core_indexes, {0, 4})
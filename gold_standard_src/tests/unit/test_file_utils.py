@@ -0,0 +1,88 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_, raises
+
+from gold_standard_src.gold_standard.file_utils import atomic_write, \
+    detect_compression, get_output_path, open_input, open_output, \
+    strip_compression_suffix
+
+
+def test_atomic_write():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "out.txt")
+    try:
+        with atomic_write(path) as o:
+            o.write("abc")
+            # nothing at path until the file is complete
+            ok_("out.txt" not in os.listdir(tmp_dir))
+        eq_(os.listdir(tmp_dir), ["out.txt"])
+        with open(path) as a:
+            eq_(a.read(), "abc")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@raises(RuntimeError)
+def test_atomic_write_error():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "out.txt")
+    try:
+        with open(path, 'w') as o:
+            o.write("old")
+        with atomic_write(path) as o:
+            o.write("new")
+            raise RuntimeError()
+    finally:
+        # the old file is left untouched, the temporary file is removed
+        eq_(os.listdir(tmp_dir), ["out.txt"])
+        with open(path) as a:
+            eq_(a.read(), "old")
+        shutil.rmtree(tmp_dir)
+
+
+def test_open_input():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(tmp_dir, "aln.fasta")
+        with open(plain, 'w') as o:
+            o.write(">1\r\nABC\r\n")
+        gz = os.path.join(tmp_dir, "aln.fasta.gz")
+        with gzip.open(gz, 'wb') as o:
+            o.write(">1\nABC\n")
+        # the compression is detected from the content
+        bz = os.path.join(tmp_dir, "aln")
+        o = bz2.BZ2File(bz, 'w')
+        o.write(">1\nABC\n")
+        o.close()
+
+        eq_(detect_compression(plain), None)
+        eq_(detect_compression(gz), 'gzip')
+        eq_(detect_compression(bz), 'bz2')
+        for path in (plain, gz, bz):
+            with open_input(path) as a:
+                eq_(a.read().splitlines(), [">1", "ABC"])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_open_output():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "out.json")
+        for compression in (None, 'gzip', 'bz2'):
+            with open_output(path, compression) as o:
+                o.write("abc")
+                o.write("def")
+            out_path = get_output_path(path, compression)
+            eq_(strip_compression_suffix(out_path), path)
+            eq_(detect_compression(out_path), compression)
+            with open_input(out_path) as a:
+                eq_(a.read(), "abcdef")
+        eq_(sorted(os.listdir(tmp_dir)),
+            ["out.json", "out.json.bz2", "out.json.gz"])
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_, raises
+
+from gold_standard_src.gold_standard.gold_binary import StaleGoldError, \
+    compile_gold, get_source_paths, hash_sources, load_compiled_gold, \
+    load_gold_cached
+from gold_standard_src.gold_standard.gold_index import GoldIndex
+from gold_standard_src.gold_standard.parsers.gold import parse_gold_multi, \
+    parse_gold_pairwise
+
+
+TESTDATA = "gold_standard_src/tests/testdata/"
+
+
+def test_compile_gold_multi():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        out_path = os.path.join(tmp_dir, "gold.npy")
+        compile_gold(TESTDATA + "gold_multi.Var", True, out_path)
+        gold_in = load_compiled_gold(out_path)
+        expected = parse_gold_multi(TESTDATA + "gold_multi.Var")
+        ok_(isinstance(gold_in['alns'], GoldIndex))
+        eq_(gold_in['alns'].to_aln(), expected['alns'])
+        eq_(gold_in['ids'], expected['ids'])
+        eq_(gold_in['full_seq'], expected['full_seq'])
+        eq_(list(gold_in['alns'].arrays()['columns']['1ABCB']),
+            [-1, -1, -1, -1, 0, 1, 2, 3, 4, 5, -1, -1, 7, 8, 9, -1])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_compile_gold_pairwise():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        out_path = os.path.join(tmp_dir, "gold.npy")
+        compile_gold(TESTDATA + "multi_vars", False, out_path)
+        gold_in = load_compiled_gold(out_path)
+        expected = parse_gold_pairwise(TESTDATA + "multi_vars")
+        eq_(set(gold_in['alns']), set(expected['alns']))
+        for pair, aln in expected['alns'].iteritems():
+            eq_(gold_in['alns'][pair].to_aln(), aln)
+        eq_(gold_in['full_seq'], expected['full_seq'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_load_gold_cached():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        gold_path = os.path.join(tmp_dir, "gold.Var")
+        out_path = os.path.join(tmp_dir, "gold.npy")
+        shutil.copy(TESTDATA + "gold_multi.Var", gold_path)
+        load_gold_cached(gold_path, True, out_path)
+        ok_(isinstance(load_gold_cached(gold_path, True, out_path)['alns'],
+                       GoldIndex))
+        # change the source file - compiled file is stale
+        with open(gold_path, 'a') as o:
+            o.write("1ABCD, 0 RDG 0 GFH 0 FDGH 0\n")
+        gold_in = load_gold_cached(gold_path, True, out_path)
+        ok_('1ABCD' in gold_in['ids'])
+        source_hash = hash_sources(get_source_paths(gold_path, True))
+        ok_('1ABCD' in load_compiled_gold(out_path, source_hash)['ids'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+@raises(StaleGoldError)
+def test_load_compiled_gold_stale():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        out_path = os.path.join(tmp_dir, "gold.npy")
+        compile_gold(TESTDATA + "gold_multi.Var", True, out_path)
+        load_compiled_gold(out_path, "0" * 40)
+    finally:
+        shutil.rmtree(tmp_dir)
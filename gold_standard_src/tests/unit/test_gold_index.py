@@ -0,0 +1,31 @@
+from nose.tools import eq_, raises
+
+from gold_standard_src.gold_standard.gold_index import GoldIndex, get_gold_index
+
+
+def test_gold_index_pairwise():
+    golden = {"1": [1, 2, 3, '-', '-', 4, 5, 6, '-', '-'],
+              "2": ['-', '-', '-', 1, 2, 3, 4, 5, '-', '-']}
+    gold_index = GoldIndex(golden)
+    eq_(gold_index.columns["1"][4], 5)
+    eq_(gold_index.get_aligned_res(4, "1", "2"), 3)
+    eq_(gold_index.get_aligned_res(1, "1", "2"), '-')
+    eq_(gold_index.get_aligned_res(1, "2", "1"), '-')
+
+
+def test_gold_index_multi():
+    golden = {"cores": {"1": [2, 3, '-'], "2": [1, 2, 3]},
+              "var": {"1": [1, 4], "2": []}}
+    gold_index = GoldIndex(golden, multi=True)
+    eq_(gold_index.get_aligned_res(3, "1", "2"), 2)
+    eq_(gold_index.get_aligned_res(3, "2", "1"), '-')
+    eq_(gold_index.get_aligned_res(4, "1", "2"), '-')
+    # already indexed alignments are not indexed again
+    eq_(get_gold_index(gold_index, multi=True), gold_index)
+
+
+@raises(Exception)
+def test_gold_index_missing_residue():
+    golden = {"cores": {"1": [2, 3, '-'], "2": [1, 2, 3]},
+              "var": {"1": [1, 4], "2": []}}
+    GoldIndex(golden, multi=True).get_aligned_res(5, "1", "2")
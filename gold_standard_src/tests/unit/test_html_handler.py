@@ -1,8 +1,10 @@
 import os
+import shutil
+import tempfile
 
 from nose.tools import eq_, ok_
 
-from gold_standard_src.gold_standard.html_handler import HtmlHandler
+from gold_standard_src.gold_standard.html_handler import CSS, HtmlHandler
 from gold_standard_src.gold_standard.num_seq import core_aln_to_num
 
 
@@ -175,3 +177,27 @@ def test_get_full_seq_pos():
     pos = hh.get_full_seq_pos(merged_corvar_seq, corvar_index)
     eq_(pos, expected_pos)
 
+
+def test_write_html():
+    aa_aln = {'1': 'ACDEF', '2': 'A-CDE'}
+    wrong = {'1': {0: 1}, '2': {}}
+    order = ['1', '2']
+    quality_data = {'aa_aln': aa_aln, 'wrong_cols': wrong, 'order': order}
+    hh = HtmlHandler()
+    head, middle, tail = hh.get_template_parts()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        outname = os.path.join(tmp_dir, "test")
+        hh.write_html(quality_data, outname, mode="cores")
+        with open(outname + ".html") as a:
+            res = a.read()
+        body = hh.aln_to_html(aa_aln, wrong, order)
+        eq_(res, "{}".join([head, middle, tail]).format(CSS, body))
+        ok_(body.startswith("<div class=monospacediv"))
+        eq_(body.count("<span class=featWRONG"), 1)
+
+        # unknown mode, nothing is written
+        hh.write_html(quality_data, outname + "_x", mode="unknown")
+        ok_(not os.path.exists(outname + "_x.html"))
+    finally:
+        shutil.rmtree(tmp_dir)
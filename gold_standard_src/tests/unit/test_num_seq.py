@@ -62,6 +62,19 @@ def test_get_var_pos():
     eq_(expected, ns.get_var_pos(num_seq, full_seq))
 
 
+def test_get_unaligned_residues():
+    grounded = {"A": ['-', 2, 3, '-'], "B": [1, 4, '-', 5]}
+    result = ns.get_unaligned_residues(grounded, {"A": 4, "B": 6})
+    eq_(result, {"A": [1, 4], "B": [2, 3, 6]})
+
+
+def test_convert_3ssp_to_gold_aln():
+    num_aln = {"A": ['-', 2, 3], "B": [1, '-', 2]}
+    full_seq = {"A": "ABCDE", "B": "AB", "C": "ABCD"}
+    gold_aln = ns.convert_3ssp_to_gold_aln(num_aln, full_seq)
+    eq_(gold_aln, {"cores": num_aln, "var": {"A": [1, 4, 5], "B": []}})
+
+
 def test_get_next_core():
     seq = "--ASDFSSSDFH-SS-"
 
@@ -93,7 +106,7 @@ def test_get_next_core():
     eq_(res['core_start'], expected_start)
 
 
-@patch('gold_standard_src.gold_standard.num_seq.open',
+@patch('gold_standard_src.gold_standard.num_seq.open_input',
        mock_open(read_data="1ABCA ABCD ABC ABC-- DFGJH"), create=True)
 def test_get_core_indexes():
     result = ns.get_core_indexes('testfile')
@@ -144,6 +157,24 @@ def test_split_core():
     eq_(new_cores, expected_cores)
 
 
+def test_split_core_long():
+    # many short segments, used to hit the recursion limit
+    full_seq = "DW" * 1200
+    new_cores = ns.split_core("D" * 1200, full_seq)
+    eq_(new_cores, [{'pos': 2 * i, 'seq': 'D'} for i in range(1200)])
+
+
+def test_find_core_prefixes():
+    eq_(ns.find_core_prefixes("DAS", "SDWDAS"), [0, 1, 3, 3])
+    eq_(ns.find_core_prefixes("DAS", "SDWDAS", 2), [0, 1, 1, 1])
+    # X in the sequence matches any residue
+    eq_(ns.find_core_prefixes("DAS", "SXAW"), [0, 1, 1, -1])
+    # X in the core matches any residue
+    eq_(ns.find_core_prefixes("DXS", "SDWS"), [0, 1, 1, 1])
+    eq_(ns.find_core("DXS", "SDWS"), 1)
+    eq_(ns.find_core("DAS", "SDAWS"), -1)
+
+
 @raises(Exception)
 def test_split_core_exception():
     core = "ASYTGHMTG"
@@ -162,6 +193,18 @@ def test_corvar_to_num():
     eq_(num_seq, expected)
 
 
+def test_decode_corvar():
+    decoded = ns.decode_corvar('0 AD-G bc -B- 0')
+    eq_(decoded['cores'].tolist(), [1, 2, 0, 3, 0, 6, 0])
+    eq_(decoded['var'].tolist(), [4, 5])
+    eq_(decoded['full'], 'ADGBCB')
+
+
+@raises(ns.ParsingError)
+def test_decode_corvar_incorrect_character():
+    ns.decode_corvar('0 AD*G 0')
+
+
 def test_core_aln_to_num():
     full_seq = {
         '1': 'ABCDEFGHIJKL'
@@ -180,6 +223,31 @@ def test_core_aln_to_num():
     eq_(num_aln, expected)
 
 
+def test_a3m_aln_to_num():
+    full_seq = {
+        '1': 'MABCDEFGHIJKL',
+        '2': 'ABDEFG'
+    }
+    # sequence 1 starts at the second residue, C and I are insertions
+    aln_dict = {
+        '1': 'ABcDEFGHiJK',
+        '2': 'AB-DEFG--'
+    }
+    expected = {
+        'cores': {'1': [2, 3, 5, 6, 7, 8, 9, 11, 12],
+                  '2': [1, 2, '-', 3, 4, 5, 6, '-', '-']},
+        'var': {'1': [1, 4, 10, 13], '2': []}
+    }
+    num_aln, core_indexes = ns.a3m_aln_to_num(aln_dict, full_seq)
+    eq_(num_aln, expected)
+    eq_(sorted(core_indexes), [0, 2, 7])
+
+
+@raises(ns.ParsingError)
+def test_a3m_to_num_not_found():
+    ns.a3m_to_num('ABcD', 'ABCE')
+
+
 def test_core_aln_to_num_real():
     aln_dict = {
         '1NDDA':
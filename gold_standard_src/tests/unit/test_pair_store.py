@@ -0,0 +1,58 @@
+import numpy as np
+from nose.tools import eq_, ok_, raises
+
+from gold_standard_src.gold_standard.pair_store import CONFUSION_KEYS, \
+    PairArray, PairDict, tri_index
+
+
+fs = frozenset
+
+
+def test_tri_index():
+    eq_([tri_index(i, j) for j in range(1, 4) for i in range(j)],
+        range(6))
+    eq_(tri_index(2, 0), tri_index(0, 2))
+
+
+def test_pair_dict():
+    pairs = PairDict()
+    pairs[fs(['1a', '1b'])] = 'ab'
+    pairs[fs(['1c', '1a'])] = 'ac'
+    pairs[('1b', '1c')] = 'bc'
+    eq_(len(pairs), 3)
+    eq_(pairs[fs(['1b', '1a'])], 'ab')
+    eq_(pairs[('1c', '1b')], 'bc')
+    eq_(set(pairs), {fs(['1a', '1b']), fs(['1a', '1c']), fs(['1b', '1c'])})
+    ok_(fs(['1a', '1d']) not in pairs)
+    ok_(fs(['1a']) not in pairs)
+    del pairs[fs(['1a', '1b'])]
+    eq_(len(pairs), 2)
+    eq_(dict(pairs), {fs(['1a', '1c']): 'ac', fs(['1b', '1c']): 'bc'})
+
+
+@raises(KeyError)
+def test_pair_dict_missing():
+    pairs = PairDict(['1a', '1b'])
+    pairs[fs(['1a', '1b'])]
+
+
+def test_pair_array():
+    pairs = PairArray(['1a', '1b', '1c'], fields=CONFUSION_KEYS,
+                      dtype=np.int64)
+    matrix = {'TP': 4, 'FP': 2, 'FN': 1, 'TN': 0}
+    pairs[fs(['1a', '1c'])] = matrix
+    eq_(dict(pairs), {fs(['1a', '1c']): matrix})
+    # values can be added for ids not given on creation
+    pairs[fs(['1d', '1a'])] = matrix
+    eq_(len(pairs), 2)
+    eq_(pairs[fs(['1a', '1d'])], matrix)
+
+
+def test_pair_array_set_square():
+    scores = PairArray(['1a', '1b', '1c'])
+    values = np.arange(9, dtype=float).reshape(3, 3)
+    mask = np.ones((3, 3), dtype=bool)
+    mask[2, 0] = False
+    scores.set_square(values, mask)
+    eq_(dict(scores), {fs(['1a', '1b']): 3., fs(['1b', '1c']): 7.})
+    eq_(list(scores.as_array()), [3., 7.])
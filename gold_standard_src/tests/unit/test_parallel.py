@@ -0,0 +1,74 @@
+from nose.tools import eq_
+
+from gold_standard_src.gold_standard.aln_analyzer import calc_scores_3dm
+from gold_standard_src.gold_standard.num_seq import core_aln_to_num
+from gold_standard_src.gold_standard.parallel import chunk_by_cost, \
+    chunk_in_order, get_shared, pool_imap, pool_map
+from gold_standard_src.gold_standard.parsers.aln3SSP import parse_3SSP
+from gold_standard_src.gold_standard.parsers.gold import parse_gold_multi
+
+
+def test_chunk_by_cost():
+    items = ['a', 'b', 'c', 'd', 'e']
+    costs = [1, 5, 3, 5, 2]
+    eq_(chunk_by_cost(items, costs, 2), [['b', 'd', 'c'], ['e', 'a']])
+    eq_(chunk_by_cost(items, costs, 10), [['b'], ['d'], ['c'], ['e'], ['a']])
+    eq_(chunk_by_cost([], [], 4), [])
+
+
+def test_chunk_in_order():
+    items = ['a', 'b', 'c', 'd', 'e']
+    eq_(chunk_in_order(items, 2), [['a', 'b', 'c'], ['d', 'e']])
+    eq_(chunk_in_order(items, 10), [['a'], ['b'], ['c'], ['d'], ['e']])
+    eq_(chunk_in_order([], 4), [])
+
+
+def test_calc_scores_3dm_jobs():
+    family_dir = "data/p450_multi_goldstandard_2016/"
+    gold_in = parse_gold_multi(family_dir + "final_core.txt.Var")
+    aln_dict, _ = parse_3SSP(family_dir + "final_core.txt")
+    num_aln = core_aln_to_num(aln_dict, gold_in['full_seq'],
+                              golden_ids=gold_in['ids'])[0]
+    expected = calc_scores_3dm(gold_in['alns'], num_aln, multi=True)
+    chunks = []
+    eq_(calc_scores_3dm(gold_in['alns'], num_aln, multi=True, jobs=2,
+                        on_pairs=lambda m, sp: chunks.append((m, sp))),
+        expected)
+    # the pairs are handed over chunk by chunk, each of them once
+    eq_(len(chunks), 8)
+    eq_(sum(len(matrices) for matrices, _ in chunks),
+        len(expected['pairwise']))
+    # the chunks are consecutive in the order of the sorted ids
+    eq_([pair for matrices, _ in chunks
+         for pair in sorted(matrices, key=sorted)],
+        sorted(expected['pairwise'], key=sorted))
+    for matrices, sp_scores in chunks:
+        for pair, matrix in matrices.iteritems():
+            eq_(matrix, expected['pairwise'][pair])
+            eq_(sp_scores[pair], expected['sp_scores'][pair])
+
+
+def _nested_chunk(chunk):
+    outer = get_shared()['outer']
+    inner = pool_map(_inner_chunk, [chunk], 1, {'inner': 10})
+    return [outer + x for x in inner[0]] + [get_shared()['outer']]
+
+
+def _inner_chunk(chunk):
+    return [get_shared()['inner'] + x for x in chunk]
+
+
+def test_pool_map_nested():
+    eq_(pool_map(_nested_chunk, [[1, 2], [3]], 1, {'outer': 100}),
+        [[111, 112, 100], [113, 100]])
+    eq_(get_shared(), {})
+
+
+def test_pool_imap():
+    results = pool_imap(_inner_chunk, [[1, 2], [3]], 1, {'inner': 10})
+    eq_(next(results), [11, 12])
+    # the shared data is restored between the chunks
+    eq_(get_shared(), {})
+    eq_(list(results), [[13]])
+    eq_(list(pool_imap(_inner_chunk, [[1, 2], [3], [4]], 2, {'inner': 10})),
+        [[11, 12], [13], [14]])
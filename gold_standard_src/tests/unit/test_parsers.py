@@ -1,10 +1,14 @@
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 from mock import mock_open, patch
 
+from gold_standard_src.gold_standard.parsers.a3m import parse_a3m
 from gold_standard_src.gold_standard.parsers.aln3SSP import parse_3SSP
+from gold_standard_src.gold_standard.parsers.clustal import parse_clustal
 from gold_standard_src.gold_standard.parsers.gold import parse_gold_pairwise, \
     fill_in_target, parse_gold_json
-from gold_standard_src.gold_standard.parsers.fasta import parse_fasta
+from gold_standard_src.gold_standard.parsers.fasta import iter_fasta, \
+    parse_fasta
+from gold_standard_src.gold_standard.parsers.stockholm import parse_stockholm
 from gold_standard_src.gold_standard.parsers.var_file import (
     parse_var_file, convert_var_to_aln)
 
@@ -24,7 +28,7 @@ def test_parse_var_file():
     eq_(var['ids'], ['1HVXA', '1E43A'])
 
 
-@patch('gold_standard_src.gold_standard.parsers.fasta.open', mock_open(
+@patch('gold_standard_src.gold_standard.parsers.fasta.open_input', mock_open(
     read_data=">ID1\nA-C\nDEF\n>ID2\nGHI\n"), create=True)
 @patch('gold_standard_src.gold_standard.parsers.fasta.os.path.exists')
 def test_parse_fasta(mock_path_exists):
@@ -34,6 +38,16 @@ def test_parse_fasta(mock_path_exists):
     eq_(aln, expected)
 
 
+@patch('gold_standard_src.gold_standard.parsers.fasta.open_input', mock_open(
+    read_data=">ID1 x\nA-C\ndef*\n>ID2|y\nGHI\n>ID3\nKLM\n"),
+       create=True)
+def test_iter_fasta():
+    records = iter_fasta("path", ["ID1x", "ID3"])
+    eq_(next(records), ("ID1x", "A-CDEF"))
+    eq_(list(records), [("ID3", "KLM")])
+    eq_(list(iter_fasta("path"))[1], ("ID2", "GHI"))
+
+
 @patch('gold_standard_src.gold_standard.parsers.gold.os.path.exists')
 @patch('gold_standard_src.gold_standard.parsers.gold.os.listdir')
 @patch('gold_standard_src.gold_standard.parsers.gold.parse_var_file')
@@ -49,7 +63,60 @@ def test_parse_golden_alns(mock_parse, mock_listdir, mock_path_exists):
     eq_(2, len(res['alns']))
 
 
-@patch('gold_standard_src.gold_standard.parsers.aln3SSP.open', mock_open(
+def test_parse_gold_pairwise_lazy():
+    gold_dir = "gold_standard_src/tests/testdata/multi_vars"
+    with patch('gold_standard_src.gold_standard.parsers.gold.parse_var_file',
+               side_effect=parse_var_file) as mock_parse:
+        res = parse_gold_pairwise(gold_dir)
+        eq_(mock_parse.call_count, 0)
+        eq_(sorted(res['ids']), ['1', '1', '2', '2', '3', '3'])
+        eq_(len(res['alns']), 3)
+        # only the file with the pair is parsed
+        eq_(res['alns'][frozenset(['1', '3'])],
+            {'1': [1, 2, 3, '-', '-', '-'], '3': [1, 2, '-', 3, 4, 5]})
+        eq_(mock_parse.call_count, 1)
+        eq_(res['full_seq']['3'], "ABCDE")
+        # at most one more file (depends on the directory order)
+        ok_(mock_parse.call_count <= 2)
+        eq_(dict(res['full_seq']), {'1': "ABC", '2': "AABC", '3': "ABCDE"})
+
+
+@patch('gold_standard_src.gold_standard.parsers.stockholm.open_input', mock_open(
+    read_data="# STOCKHOLM 1.0\n#=GF ID test\n\nID1/2-7 A-C.D\nID2 ghi--\n"
+              "ID3 KLMNO\n#=GC SS_cons .....\n\nID1/2-7 EF\nID2 .J\n"
+              "ID3 PQ\n//\n"), create=True)
+@patch('gold_standard_src.gold_standard.parsers.stockholm.os.path.exists')
+def test_parse_stockholm(mock_path_exists):
+    mock_path_exists.return_value = True
+    aln, order = parse_stockholm("path", ["ID1", "ID2"])
+    eq_(aln, {"ID1": "A-C-DEF", "ID2": "GHI---J"})
+    eq_(order, ["ID1", "ID2"])
+
+
+@patch('gold_standard_src.gold_standard.parsers.clustal.open_input', mock_open(
+    read_data="CLUSTAL W (1.83) multiple sequence alignment\n\n\n"
+              "ID1      A-CD 3\nID2      GHI- 3\n         * *\n\n"
+              "ID1      EF 5\nID2      -J 4\n         *\n"), create=True)
+@patch('gold_standard_src.gold_standard.parsers.clustal.os.path.exists')
+def test_parse_clustal(mock_path_exists):
+    mock_path_exists.return_value = True
+    aln, order = parse_clustal("path")
+    eq_(aln, {"ID1": "A-CDEF", "ID2": "GHI--J"})
+    eq_(order, ["ID1", "ID2"])
+
+
+@patch('gold_standard_src.gold_standard.parsers.fasta.open_input', mock_open(
+    read_data="#A3M#\n>ID1\nAbC-D\n>ID2\nA..C-D*\n>ID3\nACDE\n"),
+       create=True)
+@patch('gold_standard_src.gold_standard.parsers.a3m.os.path.exists')
+def test_parse_a3m(mock_path_exists):
+    mock_path_exists.return_value = True
+    aln, order = parse_a3m("path", ["ID1", "ID2"])
+    eq_(aln, {"ID1": "AbC-D", "ID2": "AC-D"})
+    eq_(order, ["ID1", "ID2"])
+
+
+@patch('gold_standard_src.gold_standard.parsers.aln3SSP.open_input', mock_open(
     read_data="ID01 A A-?CDEF\nID02 A GHI\n"), create=True)
 @patch('gold_standard_src.gold_standard.parsers.aln3SSP.os.path.exists')
 def test_aln_3SSP(mock_path_exists):
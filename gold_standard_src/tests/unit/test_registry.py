@@ -0,0 +1,103 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_, raises
+
+from gold_standard_src.gold_standard.parsers import registry
+from gold_standard_src.gold_standard.parsers.error_types import ParserError
+from gold_standard_src.gold_standard.parsers.registry import InputFormat, \
+    detect_format, get_format, get_format_names, register_format
+
+
+def write_file(path, text):
+    with open(path, 'w') as o:
+        o.write(text)
+
+
+def test_detect_format():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = {
+            "aln.a3m": ">1\nAbC\n",
+            "stockholm.txt": "# STOCKHOLM 1.0\n1 ABC\n//\n",
+            "clustal.txt": "CLUSTAL W (1.83) multiple sequence alignment\n",
+            "3ssp.txt": "1ABC A ABC-DEF\n",
+            "3dm.txt": "1abcA abc-def\n",
+            # the content is recognized before the extension
+            "3dm.aln": "1abcA abc-def\n",
+            "3ssp.aln": "1ABC A ABC-DEF\n",
+            "clustal.aln": "CLUSTAL W (1.83) multiple sequence alignment\n"
+        }
+        for name, text in files.iteritems():
+            write_file(os.path.join(tmp_dir, name), text)
+        with gzip.open(os.path.join(tmp_dir, "aln.a2m.gz"), 'wb') as o:
+            o.write(">1\nAbC\n")
+        with gzip.open(os.path.join(tmp_dir, "clustal.gz"), 'wb') as o:
+            o.write(files["clustal.txt"])
+
+        expected = {
+            "aln.a3m": "a3m",
+            "aln.a2m.gz": "a2m",
+            "stockholm.txt": "stockholm",
+            "clustal.txt": "clustal",
+            "clustal.gz": "clustal",
+            "3ssp.txt": "3SSP",
+            "3dm.txt": "3dm",
+            "3dm.aln": "3dm",
+            "3ssp.aln": "3SSP",
+            "clustal.aln": "clustal"
+        }
+        for name, in_format in expected.iteritems():
+            eq_(detect_format(os.path.join(tmp_dir, name)), in_format)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_detect_format_cache():
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "aln.txt")
+    try:
+        write_file(path, "# STOCKHOLM 1.0\n")
+        eq_(detect_format(path), "stockholm")
+        # the file isn't read again while its mtime is the same
+        with open(path, 'w') as o:
+            o.write("CLUSTAL W\n")
+        os.utime(path, (1, 1))
+        eq_(detect_format(path), "clustal")
+        write_file(path, "# STOCKHOLM 1.0\n")
+        os.utime(path, (1, 1))
+        eq_(detect_format(path), "clustal")
+        os.utime(path, (2, 2))
+        eq_(detect_format(path), "stockholm")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_register_format():
+    formats = list(registry._formats)
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "aln.txt")
+    try:
+        parse = lambda aln_path, gold_ids: ({'1': 'AB'}, ['1'])
+        register_format(InputFormat("custom", parse,
+                                    lambda head: head.startswith("#CUSTOM"),
+                                    ('.cst',)))
+        ok_("custom" in get_format_names())
+        eq_(get_format("custom").parse(path, []), ({'1': 'AB'}, ['1']))
+        write_file(path, "#CUSTOM\n")
+        eq_(detect_format(path), "custom")
+        # the extension isn't enough if the format can be sniffed
+        write_file(os.path.join(tmp_dir, "aln.cst"), "")
+        eq_(detect_format(os.path.join(tmp_dir, "aln.cst")), "3dm")
+        register_format(InputFormat("custom", parse, extensions=('.cst',)))
+        eq_(detect_format(os.path.join(tmp_dir, "aln.cst")), "custom")
+    finally:
+        registry._formats[:] = formats
+        shutil.rmtree(tmp_dir)
+
+
+@raises(ParserError)
+def test_get_format_invalid():
+    get_format("json")
@@ -1,6 +1,15 @@
-from nose.tools import assert_almost_equals, eq_
+import json
+import os
+import shutil
+import tempfile
 
-from gold_standard_src.gold_standard.result_processor import calc_stats
+import numpy as np
+from nose.tools import assert_almost_equals, eq_, ok_
+
+import gold_standard_src.gold_standard.result_processor as rp
+from gold_standard_src.gold_standard.result_processor import STAT_FIELDS, \
+    ResultWriter, bootstrap_intervals, calc_stats, calc_stats_array, \
+    process_results, stats_to_dict
 
 
 def test_calc_stats():
@@ -12,3 +21,136 @@ def test_calc_stats():
     eq_(len(result['m1']), len(expected['m1']))
     for key, value in expected['m1'].iteritems():
         assert_almost_equals(result['m1'][key], value)
+
+
+def test_calc_stats_array():
+    # TP, FP, FN, TN
+    stats = calc_stats_array(np.array([[2, 6, 0, 4], [0, 0, 0, 5]]))
+    eq_(stats.dtype.names, STAT_FIELDS)
+    assert_almost_equals(stats['specificity'][0], 0.4)
+    assert_almost_equals(stats['mcc'][0], 0.316227766)
+    eq_(stats['specificity'][1], 1.0)
+    # zero denominators
+    ok_(np.isnan(stats['sensitivity'][1]))
+    ok_(np.isnan(stats['ppv'][1]))
+    ok_(np.isnan(stats['mcc'][1]))
+    eq_(stats_to_dict(stats[1]), {'specificity': 1.0, 'sensitivity': None,
+                                  'ppv': None, 'npv': 1.0, 'mcc': 0.0})
+    for stats_row in stats:
+        eq_(type(stats_to_dict(stats_row)['mcc']), float)
+
+
+def test_process_results_formats():
+    fs = frozenset
+    matrices = {
+        fs(['A', 'B']): {"TP": 2, "FN": 0, "TN": 4, "FP": 6},
+        fs(['A', 'C']): {"TP": 0, "FN": 0, "TN": 5, "FP": 0}
+    }
+    full_matrix = {"TP": 2, "FN": 0, "TN": 9, "FP": 6}
+    sp_scores = {fs(['A', 'B']): 0.5, fs(['A', 'C']): 1.0}
+    tmp_dir = tempfile.mkdtemp()
+    output = os.path.join(tmp_dir, "out")
+    try:
+        result = process_results(matrices, full_matrix, sp_scores, output, 3,
+                                 formats=['txt', 'jsonl', 'csv', 'npz'])
+        eq_(result['sp_score'], 0.75)
+        eq_(sorted(os.listdir(tmp_dir)),
+            ["out", "out.csv", "out.jsonl", "out.npz"])
+        with open(output) as a:
+            lines = a.read().splitlines()
+        eq_(lines[0], "#### RESULTS ####")
+        # the fields are in the same order whatever the order of the dicts
+        eq_(lines[1], "TP: 2 FP: 6 FN: 0 TN: 9")
+        eq_(lines[2], "TPr: 0.118 FPr: 0.353 FNr: 0.000 TNr: 0.529")
+        eq_([line.split(':')[0] for line in lines[3:8]], list(STAT_FIELDS))
+
+        with open(output + ".jsonl") as a:
+            records = [json.loads(l) for l in a]
+        eq_(records[0]['type'], 'summary')
+        eq_(records[0]['aligned_templates'], 3)
+        pairs = {fs(r['ids']): r for r in records[1:]}
+        eq_(pairs[fs(['A', 'B'])]['TP'], 2)
+        eq_(pairs[fs(['A', 'C'])]['sensitivity'], None)
+        eq_(pairs[fs(['A', 'C'])]['sp_score'], 1.0)
+
+        with open(output + ".csv") as a:
+            lines = a.read().splitlines()
+        eq_(lines[0], "id1,id2,TP,FP,FN,TN,specificity,sensitivity,ppv,npv,"
+                      "mcc,sp_score")
+        ok_(lines[1].startswith("full,,2,6,0,9,"))
+        eq_(len(lines), 4)
+
+        npz = np.load(output + ".npz")
+        eq_(sorted(npz['pairs']), sorted(' '.join(ids) for ids in matrices))
+        eq_(npz['matrices'].shape, (2, 4))
+        eq_(list(npz['full_matrix']), [2, 6, 0, 9])
+        eq_(float(npz['sp_score']), 0.75)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_bootstrap_intervals():
+    # all pairs are the same, so are all resamples
+    counts = [[2, 1, 1, 4]] * 5
+    intervals = bootstrap_intervals(counts, [0.5] * 5, 50)
+    eq_(intervals['sp_score'], [0.5, 0.5])
+    for stat in ['sensitivity', 'mcc']:
+        assert_almost_equals(intervals[stat][0], intervals[stat][1])
+    assert_almost_equals(intervals['sensitivity'][0], 2 / 3.)
+
+    counts = [[5, 0, 0, 5], [0, 5, 5, 0], [3, 1, 2, 4], [4, 0, 1, 5]]
+    sp_scores = [1.0, 0.0, 0.5, 0.8]
+    intervals = bootstrap_intervals(counts, sp_scores, 200, confidence=0.9)
+    full = calc_stats_array(np.sum(counts, axis=0)[np.newaxis])[0]
+    for stat, value in [('sp_score', np.mean(sp_scores)),
+                        ('mcc', full['mcc']),
+                        ('sensitivity', full['sensitivity'])]:
+        lower, upper = intervals[stat]
+        ok_(lower < value < upper)
+    # the resamples don't depend on the block size
+    block_size = rp.BOOTSTRAP_BLOCK_SIZE
+    rp.BOOTSTRAP_BLOCK_SIZE = 10
+    try:
+        eq_(bootstrap_intervals(counts, sp_scores, 200, confidence=0.9),
+            intervals)
+    finally:
+        rp.BOOTSTRAP_BLOCK_SIZE = block_size
+
+    # undefined in all resamples
+    eq_(bootstrap_intervals([[0, 0, 0, 3]], [1.0], 10)['sensitivity'], None)
+
+
+def test_result_writer_chunks():
+    fs = frozenset
+    matrices = {
+        fs(['A', 'B']): {"TP": 2, "FN": 0, "TN": 4, "FP": 6},
+        fs(['A', 'C']): {"TP": 0, "FN": 0, "TN": 5, "FP": 0}
+    }
+    full_matrix = {"TP": 2, "FN": 0, "TN": 9, "FP": 6}
+    sp_scores = {fs(['A', 'B']): 0.5, fs(['A', 'C']): 1.0}
+    formats = ['txt', 'jsonl', 'csv']
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        process_results(matrices, full_matrix, sp_scores,
+                        os.path.join(tmp_dir, "all"), 3, formats=formats)
+        # the pairs are written one by one while they're scored
+        writer = ResultWriter(os.path.join(tmp_dir, "chunks"), formats)
+        for pair in [fs(['A', 'B']), fs(['A', 'C'])]:
+            writer.write_pairs({pair: matrices[pair]},
+                               {pair: sp_scores[pair]})
+        eq_(sorted(os.listdir(tmp_dir)), ["all", "all.csv", "all.jsonl"])
+        process_results(matrices, full_matrix, sp_scores,
+                        os.path.join(tmp_dir, "chunks"), 3, writer=writer)
+        for suffix in ["", ".jsonl", ".csv"]:
+            with open(os.path.join(tmp_dir, "all" + suffix)) as a:
+                expected = a.read().splitlines()
+            with open(os.path.join(tmp_dir, "chunks" + suffix)) as a:
+                result = a.read().splitlines()
+            eq_(result[0], expected[0])
+            eq_(sorted(result), sorted(expected))
+        # the pairs of a chunk are written in the order of their ids
+        with open(os.path.join(tmp_dir, "all.csv")) as a:
+            eq_([row.split(',')[:2] for row in a.read().splitlines()[2:]],
+                [['A', 'B'], ['A', 'C']])
+    finally:
+        shutil.rmtree(tmp_dir)
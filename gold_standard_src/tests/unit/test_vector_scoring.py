@@ -0,0 +1,128 @@
+import numpy as np
+from nose.tools import eq_, raises
+
+import gold_standard_src.gold_standard.aln_analyzer as aa
+import gold_standard_src.gold_standard.vector_scoring as vs
+
+from gold_standard_src.gold_standard.aln_processor import make_master_seq_full
+from gold_standard_src.gold_standard.dict_utils import merge_dicts
+from gold_standard_src.gold_standard.gold_index import GoldIndex
+from gold_standard_src.gold_standard.num_seq import core_aln_to_num
+from gold_standard_src.gold_standard.parsers.aln3SSP import parse_3SSP
+from gold_standard_src.gold_standard.parsers.fasta import parse_fasta
+from gold_standard_src.gold_standard.parsers.gold import (
+    parse_gold_multi, parse_gold_pairwise)
+
+
+def compare_engines(golden_alns, num_aln, multi):
+    ids = sorted(num_aln['cores'])
+    for i, id1 in enumerate(ids):
+        for id2 in ids[i + 1:]:
+            if multi:
+                golden_aln = golden_alns
+            else:
+                golden_aln = golden_alns[frozenset([id1, id2])]
+            sequences = {id1: num_aln['cores'][id1],
+                         id2: num_aln['cores'][id2]}
+            var_regs = {id1: num_aln['var'][id1], id2: num_aln['var'][id2]}
+            expected = aa.calc_pairwise_score_3dm(golden_aln, sequences,
+                                                  var_regs, multi)
+            result = vs.calc_pairwise_score_3dm_np(golden_aln, sequences,
+                                                   var_regs, multi)
+            eq_(result, expected)
+
+
+def parse_multi_family(family):
+    family_dir = "data/{}_goldstandard_2016/".format(family)
+    gold_in = parse_gold_multi(family_dir + "final_core.txt.Var")
+    aln_dict, _ = parse_3SSP(family_dir + "final_core.txt")
+    num_aln = core_aln_to_num(aln_dict, gold_in['full_seq'],
+                              golden_ids=gold_in['ids'])[0]
+    return gold_in, num_aln
+
+
+def test_engines_multi_families():
+    for family in ["p450_multi", "ubiquitin", "cytokines"]:
+        gold_in, num_aln = parse_multi_family(family)
+        compare_engines(gold_in['alns'], num_aln, multi=True)
+
+
+def score_all_pairs(golden_aln, num_aln, target_id=None):
+    """
+    All pairs scored one by one with the reference implementation
+    """
+    result = {
+        'pairwise': {},
+        'full': {'TP': 0, 'FP': 0, 'TN': 0, 'FN': 0},
+        'sp_scores': {},
+        'wrong_cols': {seq_id: {} for seq_id in num_aln['cores']}
+    }
+    ids = sorted(num_aln['cores'])
+    for i, id1 in enumerate(ids):
+        for id2 in ids[i + 1:]:
+            if target_id and target_id not in [id1, id2]:
+                continue
+            sequences = {id1: num_aln['cores'][id1],
+                         id2: num_aln['cores'][id2]}
+            var_regs = {id1: num_aln['var'][id1], id2: num_aln['var'][id2]}
+            scores = aa.calc_pairwise_score_3dm(golden_aln, sequences,
+                                                var_regs, multi=True)
+            id_set = frozenset([id1, id2])
+            result['pairwise'][id_set] = scores['matrix']
+            result['sp_scores'][id_set] = scores['sp_score']
+            result['full'] = merge_dicts(result['full'], scores['matrix'])
+            for seq_id in id_set:
+                result['wrong_cols'][seq_id] = merge_dicts(
+                    result['wrong_cols'][seq_id],
+                    scores['wrong_cols'][seq_id])
+    return result
+
+
+def test_batched_multi_families():
+    for family in ["p450_multi", "ubiquitin"]:
+        gold_in, num_aln = parse_multi_family(family)
+        gold_index = GoldIndex(gold_in['alns'], multi=True)
+        # small blocks to check that splitting up the columns works
+        eq_(vs.calc_scores_3dm_batched(gold_index, num_aln,
+                                       max_block_size=1000),
+            score_all_pairs(gold_in['alns'], num_aln))
+        target_id = gold_in['ids'][0]
+        eq_(vs.calc_scores_3dm_batched(gold_index, num_aln, target_only=True,
+                                       target_id=target_id),
+            score_all_pairs(gold_in['alns'], num_aln, target_id))
+
+
+def test_engines_pairwise_family():
+    gold_in = parse_gold_pairwise("data/amylase_goldstandard_2016")
+    aln_path = "gold_standard_src/tests/testdata/filtered_amylase_mafft.fasta"
+    aln_dict = parse_fasta(aln_path, gold_in['ids'])
+    aln_dict = make_master_seq_full(aln_dict, gold_in['full_seq'],
+                                    gold_in['ids'], gold_in['ids'][0])
+    num_aln = core_aln_to_num(aln_dict, gold_in['full_seq'],
+                              golden_ids=gold_in['ids'])[0]
+    compare_engines(gold_in['alns'], num_aln, multi=False)
+
+
+def test_score_pair_arrays():
+    golden = {"cores": {"1": [1, 2, '-', 3], "2": [1, '-', 2, 3]},
+              "var": {"1": [4], "2": [4]}}
+    test = {"1": [1, 2, 3, '-'], "2": [1, '-', 2, 3]}
+    var = {"1": [4], "2": [4]}
+    expected = aa.calc_pairwise_score_3dm(golden, test, var, multi=True)
+    result = vs.calc_pairwise_score_3dm_np(GoldIndex(golden, multi=True),
+                                           test, var, multi=True)
+    eq_(result, expected)
+
+
+def test_wrong_cols_to_dict():
+    eq_(vs.wrong_cols_to_dict(np.array([0, 2, 0, 1])), {1: 2, 3: 1})
+    eq_(vs.wrong_cols_to_dict(np.zeros(3, dtype=bool)), {})
+
+
+@raises(Exception)
+def test_score_pair_arrays_missing_residue():
+    golden = {"cores": {"1": [1, 2], "2": [1, 2]},
+              "var": {"1": [], "2": []}}
+    test = {"1": [1, 3], "2": [1, 2]}
+    vs.calc_pairwise_score_3dm_np(golden, test, {"1": [], "2": []},
+                                  multi=True)